@@ -81,6 +81,7 @@ TEMPLATE_LOADERS = (
 
 MIDDLEWARE_CLASSES = (
     'django.middleware.gzip.GZipMiddleware',
+    'middleware.SolrStatsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'middleware.SiteRedirectMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -140,6 +141,10 @@ CELERY_ROUTES = {
         'queue': 'solr',
         'routing_key': 'solr.update_solr'
     },
+    'tasks.task_tag_custom_facets': {
+        'queue': 'solr',
+        'routing_key': 'solr.tag_custom_facets'
+    },
     'tasks.task_clear_solr': {
         'queue': 'solr',
         'routing_key': 'solr.clear_solr'
@@ -164,6 +169,14 @@ CELERY_ROUTES = {
         'queue': 'myjobs',
         'routing_key': 'myjobs.send_search_digests'
     },
+    'tasks.send_search_batch': {
+        'queue': 'myjobs',
+        'routing_key': 'myjobs.send_search_batch'
+    },
+    'tasks.send_search_digests_report': {
+        'queue': 'myjobs',
+        'routing_key': 'myjobs.send_search_digests_report'
+    },
     'tasks.delete_inactive_activations': {
         'queue': 'myjobs',
         'routing_key': 'myjobs.delete_inactive_activations',
@@ -185,6 +198,18 @@ CELERY_ROUTES = {
         'queue': 'myjobs',
         'routing_key': 'dseo.submit_all_sitemaps'
     },
+    'tasks.generate_sitemaps': {
+        'queue': 'dseo',
+        'routing_key': 'dseo.generate_sitemaps'
+    },
+    'tasks.generate_site_sitemaps': {
+        'queue': 'dseo',
+        'routing_key': 'dseo.generate_sitemaps'
+    },
+    'tasks.generate_all_sitemaps': {
+        'queue': 'dseo',
+        'routing_key': 'dseo.generate_sitemaps'
+    },
     'tasks.process_sendgrid_event': {
         'queue': 'sendgrid',
         'routing_key': 'sendgrid.process_sendgrid_event',
@@ -223,6 +248,11 @@ CELERYBEAT_SCHEDULE = {
         'task': 'tasks.submit_all_sitemaps',
         'schedule': crontab(hour=13, minute=0)
     },
+    # Stored sitemap indexes are only good for the day they're generated on.
+    'daily-sitemap-generation': {
+        'task': 'tasks.generate_all_sitemaps',
+        'schedule': crontab(minute=5, hour=0),
+    },
 }
 
 
@@ -423,6 +453,23 @@ SITE_NAME = ""
 SITE_BUIDS = []
 SITE_PACKAGES =[]
 DEFAULT_FACET = ""
+# MultiHostMiddleware keeps each request's site configuration in a
+# seo.site_context.SiteContext. If True, it is also copied onto these
+# settings for code outside this project (e.g. django.contrib.sites) that
+# reads them directly; set to False to run multi-threaded workers.
+SITE_CONTEXT_MIRROR_SETTINGS = True
+# Fetch a site's default and featured jobs with a single grouped Solr
+# request (see seo.search_backend.GroupedSearch) instead of one each.
+GROUP_FEATURED_JOBS = True
+# Count a site's standard custom facets with a facet.field over the custom
+# facet ids jobs are tagged with after each import, instead of a facet.query
+# per custom facet. Jobs that aren't tagged (e.g. post-a-job jobs) are still
+# counted with a facet.query per custom facet. Jobs are only tagged while
+# this is on.
+CUSTOM_FACET_COUNTS_FROM_INDEX = False
+# Seconds between an import and tagging its jobs with custom facets. Must be
+# longer than the commitWithin the import posts jobs with (30 seconds).
+CUSTOM_FACET_TAG_DELAY = 60
 
 DEFAULT_PAGE_SIZE = 40
 DEFAULT_SORT_DIRECTION = '-num_jobs'
@@ -457,6 +504,23 @@ FEED_VIEW_SOURCES = {
     'indeed': 27,
     'sitemap': 28,
 }
+# Syndication feeds of more than this many jobs are streamed to the client,
+# fetching FEED_STREAM_CHUNK_SIZE jobs from Solr at a time, instead of being
+# built in memory (and cached) in one go.
+FEED_STREAM_MIN_ITEMS = 100
+FEED_STREAM_CHUNK_SIZE = 100
+# Directory the sitemaps of every site are stored in, gzipped, after each
+# import (see seo.sitemap.write_site_sitemaps). The sitemap views serve
+# them from there, and only generate sitemaps that aren't stored. If None,
+# sitemaps are always generated when requested.
+SITEMAP_SHARD_DIR = None
+# Seconds to wait after an import before regenerating sitemaps, to allow
+# for Solr replication.
+SITEMAP_SHARD_DELAY = 1500
+# Seconds a site's sitemap regeneration waits, once queued, so that the
+# imports finishing in the meantime are covered by it rather than each
+# queueing their own (see tasks.task_generate_sitemaps).
+SITEMAP_SITE_DELAY = 300
 
 # Solr/Haystack
 HAYSTACK_LIMIT_TO_REGISTERED_MODELS = False
@@ -465,10 +529,48 @@ TEST_SOLR_INSTANCE = {
     'all': 'http://127.0.0.1:8983/solr/myjobs_test/',
     'current': 'http://127.0.0.1:8983/solr/myjobs_test_current/'
 }
+# Connections kept alive (and concurrent requests allowed) per Solr host
+# by the clients in seo_pysolr, how many times a request that couldn't
+# connect or a read that timed out is retried, and the delay before the
+# first retry (doubled for every one after it).
+SOLR_POOL_SIZE = 10
+SOLR_RETRIES = 2
+SOLR_RETRY_BACKOFF = 0.1
+# Request timeouts in seconds by core name, for the cores that shouldn't
+# use the default of 60.
+SOLR_TIMEOUTS = {}
+# Solr requests taking at least this many milliseconds are logged, with
+# their parameters, by solr_stats. None turns the log off.
+SOLR_SLOW_QUERY_MS = 1000
+# If True, reading a field that isn't in a search's field profile (see
+# seo.helpers.FIELD_PROFILES) from one of its results raises an exception
+# instead of returning None. On for the tests.
+SOLR_FIELD_PROFILE_STRICT = False
+
+# Job import
+# Path of the pickled moc_coding.helpers.MocIndex shared by import runs on
+# this host, and how many seconds it may be reused for. If None, the index
+# is rebuilt for every import run.
+MOC_INDEX_SNAPSHOT = None
+MOC_INDEX_MAX_AGE = 60 * 60 * 24
+# Threads per stage, and the maximum number of feed files/document chunks
+# waiting between stages, for import_pipeline.ImportPipeline.
+IMPORT_PIPELINE_WORKERS = {
+    'download': 4,
+    'parse': 2,
+    'post': 2,
+}
+IMPORT_PIPELINE_QUEUE_SIZE = 8
 
 
 # Caching
 MINUTES_TO_CACHE = 120
+# Seconds raw Solr results are cached for by seo.solr_cache, and for how
+# many seconds after that a stale result is still served while it's
+# refreshed in the background. A TTL of 0 turns the cache off.
+SOLR_RESULT_CACHE_TTL = 60 * 5
+SOLR_RESULT_CACHE_STALE_TTL = 60 * 10
+SOLR_RESULT_CACHE_LOCK_TIMEOUT = 30
 CACHE_MIDDLEWARE_KEY_PREFIX = 'this'
 CACHE_MIDDLEWARE_ANONYMOUS_ONLY = True
 
@@ -583,4 +685,30 @@ EMAIL_FORMATS = {
     },
 }
 
+# Saved searches for the json feed of one of our sites search Solr for its
+# jobs directly (see mysearches.helpers.search_json_feed) rather than
+# requesting the feed from the site.
+SAVED_SEARCH_SOLR_FEEDS = False
+
+# Each batch of saved search emails retrieves the jobs for each distinct
+# saved search feed query in it once, up front (see
+# mysearches.helpers.plan_feed_queries), rather than each email retrieving
+# its own.
+SAVED_SEARCH_PLAN_DIGESTS = False
+
+# send_search_digests sends saved search emails in batches of this many
+# digests or searches, at no more than SAVED_SEARCH_SEND_RATE emails per
+# second across all batches (None for no limit).
+SAVED_SEARCH_BATCH_SIZE = 500
+SAVED_SEARCH_SEND_RATE = None
+
+# Number of saved search emails in a batch sent over each mail connection
+# (see universal.helpers.EmailBatch).
+SAVED_SEARCH_EMAILS_PER_CONNECTION = 1
+
+# The rendered rows for a job in saved search emails are cached for this
+# many seconds (see mysearches.helpers.render_job_row), so changes to a job
+# can take this long to show up in them.
+SAVED_SEARCH_JOB_ROW_CACHE_TIMEOUT = 60 * 60 * 6
+
 MEMOIZE = True
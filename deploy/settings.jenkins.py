@@ -40,6 +40,7 @@ SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 JENKINS_TEST_RUNNER = 'silent_testrunner.SilentTestRunner'
 TEST_SOLR_INSTANCE = SOLR
 CELERY_ALWAYS_EAGER = True
+SOLR_FIELD_PROFILE_STRICT = True
 
 CC_AUTH = TESTING_CC_AUTH
 
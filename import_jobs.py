@@ -4,11 +4,12 @@ import sys
 import urllib
 import datetime
 import logging
-from itertools import izip_longest
+from itertools import islice
 import urllib2
 import base64
+import hashlib
+import tempfile
 import zipfile
-import shutil
 
 from slugify import slugify
 from lxml import etree
@@ -16,12 +17,14 @@ from django.conf import settings
 from django.db import IntegrityError
 from billiard import current_process
 
+from moc_coding.helpers import get_moc_index
 from seo_pysolr import Solr
 from xmlparse import DEv2JobFeed
-from seo.helpers import slices, create_businessunit
-from seo.models import BusinessUnit, Company
+from seo.helpers import create_businessunit
+from seo.models import (BusinessUnit, Company, CustomFacet, SeoSiteFacet,
+                        job_sites)
 import tasks
-from transform import hr_xml_to_json, make_redirect
+from transform import TransformContext, hr_xml_to_json, make_redirects
 
 
 logger = logging.getLogger(__name__)
@@ -32,6 +35,19 @@ sys.path.insert(0, os.path.join(BASE_DIR))
 sys.path.insert(0, os.path.join(BASE_DIR, '../'))
 os.environ['DJANGO_SETTINGS_MODULE'] = 'directseo.settings'
 FEED_FILE_PREFIX = "dseo_feed_"
+# JobsFS zipfiles smaller than this many bytes are spooled in memory rather
+# than to a temporary file.
+ZIP_SPOOL_SIZE = 16 * 1024 * 1024
+# Number of documents sent to Solr per request by update_solr(). This is
+# bounded by the maxBooleanClauses setting in solrconfig.xml.
+UPDATE_CHUNK_SIZE = 4096
+# Fields left out of content_hash(). 'salted_date' is randomized on every
+# import, so including it would make every job look changed.
+# 'custom_facets' and 'custom_facets_tagged' aren't feed data; they're kept
+# up to date separately by tag_custom_facets().
+CONTENT_HASH_EXCLUDED_FIELDS = frozenset(['content_hash', 'salted_date',
+                                          'custom_facets',
+                                          'custom_facets_tagged'])
 
 
 def update_job_source(guid, buid, name, clear_cache=False):
@@ -49,9 +65,10 @@ def update_job_source(guid, buid, name, clear_cache=False):
     zf = get_jobsfs_zipfile(guid)
     jobs = get_jobs_from_zipfile(zf, guid)
     jobs = filter_current_jobs(jobs, bu)
-    jobs = [hr_xml_to_json(job, bu) for job in jobs]
-    for job in jobs:
-        job['link'] = make_redirect(job, bu).make_link()
+    context = TransformContext(bu, moc_index=get_moc_index())
+    jobs = [hr_xml_to_json(job, bu, context=context) for job in jobs]
+    for job, redirect in zip(jobs, make_redirects(jobs, context)):
+        job['link'] = redirect.make_link()
     add_jobs(jobs)
     remove_expired_jobs(buid, jobs)
 
@@ -62,6 +79,18 @@ def update_job_source(guid, buid, name, clear_cache=False):
     if clear_cache:
         # Clear cache in 25 minutes to allow for solr replication
         tasks.task_clear_bu_cache.delay(buid=bu.id, countdown=1500)
+    schedule_sitemaps(bu.id)
+
+
+def schedule_sitemaps(buid):
+    """
+    Regenerates the stored sitemaps of the sites showing a business unit's
+    jobs once its import has been replicated.
+
+    """
+    if getattr(settings, 'SITEMAP_SHARD_DIR', None):
+        tasks.task_generate_sitemaps.apply_async(
+            args=[buid], countdown=settings.SITEMAP_SHARD_DELAY)
 
 
 def filter_current_jobs(jobs, bu):
@@ -106,59 +135,47 @@ def get_jobsfs_zipfile(guid):
 def get_jobs_from_zipfile(zipfileobject, guid):
     """Get a list of xml documents representing all the current jobs.
 
+    The download is spooled to a single temporary file (kept in memory if
+    it is smaller than ZIP_SPOOL_SIZE) and each job is parsed straight out
+    of the archive, so individual jobs never touch the filesystem. The
+    spool is removed once the generator is exhausted, closed or garbage
+    collected.
+
     Input:
+        :zipfileobject: A file-like object containing the zipfile.
         :guid: A guid used to access the jobsfs server.
     :return: [lxml.eTree, lxml.eTree,...]"""
     logger.debug("Getting current Jobs for guid: %s", guid)
 
-
-    # Get current worker process id, to prevent race conditions.
+    spool = tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_SIZE)
     try:
-        p = current_process()
-        process_id =  p.index
-    except AttributeError:
-        process_id = 0
-
-
-    # Delete any existing data and use the guid to create a unique folder.
-    directory = "/tmp/%s/%s" % (process_id, guid)
-    prefix =  os.path.commonprefix(['/tmp/%s' % process_id, os.path.abspath(directory)])
-    assert prefix == '/tmp/%s' % process_id, "Directory should be located in /tmp/%s" % process_id
-
-    if os.path.exists(directory):
-        shutil.rmtree(directory)
-    os.makedirs(directory)
-
-    # Write zipfile to filesystem
-    filename = os.path.join(directory, '%s.zip' % guid)
-    with open(filename, 'wb') as f:
         for chunk in iter(lambda: zipfileobject.read(1024 * 16), ''):
-            f.write(chunk)
-
-    # Extact all files from zipfile.
-    # Note: Using try/finally because zipfile doesn't support context managers
-    #       until python 2.7.  Upon migration to python 2.7, can be replaced.
-    zf = zipfile.ZipFile(filename)
-    try:
-        zf.extractall(directory)
+            spool.write(chunk)
+        spool.seek(0)
+
+        with zipfile.ZipFile(spool) as zf:
+            active_directory = 'ActiveDirectory_%s/' % guid
+            members = [m for m in zf.infolist()
+                       if m.filename.startswith(active_directory) and
+                       m.filename != active_directory]
+            files = []
+            folders = set()
+            for member in members:
+                name = member.filename[len(active_directory):]
+                if '/' in name:
+                    folders.add(name.split('/')[0])
+                else:
+                    files.append(member)
+            for folder in folders:
+                logger.warn("Found folder '%s' inside active jobs for JSID: %s",
+                            folder, guid)
+
+            logger.info("Found %s jobs for guid %s", len(files), guid)
+            for member in files:
+                yield etree.fromstring(zf.read(member))
     finally:
-        zf.close()
-
-    # Process the files.
-    active_directory = os.path.join(directory, 'ActiveDirectory_%s' % guid)
-    files = os.listdir(active_directory)
-    logger.info("Found %s jobs for guid %s", len(files), guid)
-    for f in files:
-        path = os.path.join(active_directory, f)
-        if os.path.isdir(path):
-            logger.warn("Found folder '%s' inside active jobs for JSID: %s",
-                        f, guid)
-            continue
-        with open(path) as _f:
-            yield etree.fromstring(_f.read())
+        spool.close()
 
-    # clean up after ourselves.
-    shutil.rmtree(directory)
 
 class FeedImportError(Exception):
     def __init__(self, msg):
@@ -239,7 +256,8 @@ def add_company(bu):
 
 
 def update_solr(buid, download=True, force=True, set_title=False,
-                delete_feed=True, data_dir=DATA_DIR, clear_cache=False):
+                delete_feed=True, data_dir=DATA_DIR, clear_cache=False,
+                differential=True):
     """
     Update the Solr master index with the data contained in a feed file
     for a given buid/jsid.
@@ -256,9 +274,13 @@ def update_solr(buid, download=True, force=True, set_title=False,
     updated in the index. Otherwise, only the jobs seen in the feed file
     but not seen in the index will be updated. This latter option will
     soon be deprecated.
+    :differential: Boolean. If True, jobs that are already in the index
+    are only re-sent when their `content_hash` differs from the one in the
+    index, i.e. when the feed data for them has changed.
 
     Returns:
-    A 2-tuple consisting of the number of jobs added and the number deleted.
+    A 2-tuple consisting of the number of jobs added or updated and the
+    number deleted.
 
     Writes/Modifies:
     Job data found in the feed file is used to modify the Solr index. This
@@ -270,144 +292,241 @@ def update_solr(buid, download=True, force=True, set_title=False,
     if download:
         filepath = download_feed_file(buid, data_dir=data_dir)
     else:
-        # Get current worker process id, to prevent race conditions.
-        try:
-            p = current_process()
-            process_id =  p.index
-        except:
-            process_id = 0
-        filepath = os.path.join(data_dir, str(process_id), FEED_FILE_PREFIX + str(buid) +
-                                '.xml')
-    bu = BusinessUnit.objects.get(id=buid)
-    try:
-        co = bu.company_set.all()[0]
-    except IndexError:
-        co = None
-    jobfeed = DEv2JobFeed(filepath, jsid=buid, markdown=bu.enable_markdown,
-                          company=co)
-    # If the feed file did not pass validation, return. The return value is
-    # '(0, 0)' to match what's returned on a successful parse.
-    if jobfeed.errors:
-        error = jobfeed.error_messages
-        logging.error("BUID:%s - Feed file has failed validation on line %s. "
-                      "Exception: %s" % (buid, error['line'],
-                                         error['exception']))
-        raise FeedImportError(error)
+        filepath = feed_file_path(buid, data_dir=data_dir)
+    conn = Solr(settings.HAYSTACK_CONNECTIONS['default']['URL'])
+    update = FeedUpdate(buid, filepath, conn, force=force,
+                        differential=differential)
+    for update_chunk in update.add_chunks():
+        update.post(conn, update_chunk)
+    return update.finish(conn, set_title=set_title, clear_cache=clear_cache,
+                         delete_feed=delete_feed)
 
-    # A dictionary of uids
-    jobs = jobfeed.jobparse()
 
-    # Build a set of all the UIDs for all those instances.
-    job_uids = set([long(i.get('uid')) for i in jobs if i.get('uid')])
-    conn = Solr(settings.HAYSTACK_CONNECTIONS['default']['URL'])
-    step1 = 1024
-
-    # Get the count of all the results in the Solr index for this BUID.
-    hits = conn.search("*:*", fq="buid:%s" % buid, facet="false",
-                       mlt="false").hits
-    # Create (start-index, stop-index) tuples to facilitate handling results
-    # in ``step1``-sized chunks. So if ``hits`` returns 2048 results,
-    # ``job_slices`` will look like ``[(0,1024), (1024, 2048)]``. Those
-    # values are then used to slice up the total results.
-    #
-    # This was put in place because part of the logic to figuring out what
-    # jobs to delete from and add jobs to the Solr index is using set
-    # algebra. We convert the total list of UIDs in the index and the UIDs
-    # in the XML feed to sets, then compare them via ``.difference()``
-    # (seen below). However for very large feed files, say 10,000+ jobs,
-    # this process was taking so long that the connection would time out. To
-    # address this problem we break up the comparisons as described above.
-    # This results in more requests but it alleviates the connection timeout
-    # issue.
-    job_slices = slices(range(hits), step=step1)
-    results = [_solr_results_chunk(tup, buid, step1) for tup in job_slices]
-    solr_uids = reduce(lambda x, y: x | y, results) if results else set()
-    # Return the job UIDs that are in the Solr index but not in the feed
-    # file.
-    solr_del_uids = solr_uids.difference(job_uids)
-
-    if not force:
-        # Return the job UIDs that are in the feed file but not in the Solr
-        # index.
-        solr_add_uids = job_uids.difference(solr_uids)
-        # ``jobfeed.solr_jobs()`` yields a list of dictionaries. We want to
-        # filter out any dictionaries whose "uid" key is not in
-        # ``solr_add_uids``. This is because by default we only want to add
-        # new documents (which each ``solr_jobs()`` dictionary represents),
-        # not update.
-        add_docs = filter(lambda x: int(x.get("uid", 0)) in solr_add_uids,
-                          jobfeed.solr_jobs())
-    else:
-        # This might seem redundant to refer to the same value
-        # twice with two different variable names. However, this decision
-        # was made during the implementation of the "force Solr update"
-        # feature to this function.
+class FeedUpdate(object):
+    """
+    The work update_solr() does for one feed file, split into parsing,
+    posting and finishing steps so that import_pipeline can run each of
+    them on a different thread.
+
+    Creating an instance parses and validates the feed file (raising
+    FeedImportError if it is invalid) and reads the state of the index for
+    the business unit. `add_chunks()` then yields the documents that need
+    to be sent to Solr, `post()` sends one chunk of them and `finish()`
+    deletes expired jobs, schedules tagging the jobs with the custom facets
+    they match and updates the BusinessUnit.
+
+    """
+    def __init__(self, buid, filepath, conn, force=True, differential=True):
+        self.buid = buid
+        self.filepath = filepath
+        self.force = force
+        self.differential = differential
+        self.bu = BusinessUnit.objects.get(id=buid)
+        self.jobfeed = _job_feed(self.bu, filepath)
+        # If the feed file did not pass validation, raise before touching
+        # the index.
+        if self.jobfeed.errors:
+            error = self.jobfeed.error_messages
+            logging.error("BUID:%s - Feed file has failed validation on line "
+                          "%s. Exception: %s" % (buid, error['line'],
+                                                 error['exception']))
+            raise FeedImportError(error)
+
+        # A dictionary of uids
+        self.jobs = self.jobfeed.jobparse()
+
+        # Build a set of all the UIDs for all those instances.
+        job_uids = set([long(i.get('uid')) for i in self.jobs
+                        if i.get('uid')])
+
+        # A dictionary of {uid: content_hash} for every job already in the
+        # index for this BUID, and one of {uid: custom facet ids} (None for
+        # jobs that haven't been tagged). Only those fields are fetched, and
+        # the index is walked with a cursor rather than deep ``start``
+        # offsets, so this stays cheap for very large feed files.
+        self.solr_hashes, self.solr_custom_facets = _indexed_jobs(conn, buid)
+        # Without CUSTOM_FACET_COUNTS_FROM_INDEX, jobs aren't tagged at all.
+        if getattr(settings, 'CUSTOM_FACET_COUNTS_FROM_INDEX', False):
+            self.custom_facets = _buid_custom_facets(buid)
+        else:
+            self.custom_facets = None
+        # Return the job UIDs that are in the Solr index but not in the feed
+        # file.
+        self.solr_del_uids = set(self.solr_hashes).difference(job_uids)
+        self.counts = {'added': 0, 'changed': 0, 'unchanged': 0}
+
+    def add_chunks(self):
+        """
+        Yields lists of the job documents that need to be sent to Solr.
+
+        """
+        # If ``force`` is False we only want to add new documents (which
+        # each ``iter_solr_jobs()`` dictionary represents), not update.
         #
-        # Instead of adding only the documents with UIDs that are in the feed
-        # file but not in the Solr index, we're going to add ALL the documents
-        # in the feed file. This will add the new documents of course, but it
-        # will also update existing documents with any new data. Uniqueness of
-        # the documents is ensured by the ``id`` field defined in the Solr
-        # schema (the template for which can be seen in
+        # Otherwise, instead of adding only the documents with UIDs that are
+        # in the feed file but not in the Solr index, we're going to add the
+        # new documents and update existing documents with any new data.
+        # Uniqueness of the documents is ensured by the ``id`` field defined
+        # in the Solr schema (the template for which can be seen in
         # templates/search_configuration/solr.xml). At the very bottom you'll
-        # see <uniqueKey>id</uniqueKey>. This serves as the equivalent of the pk
-        # (i.e. globally unique) in a database.
-        solr_add_uids = job_uids
-        add_docs = jobfeed.solr_jobs()
-
-    # Slice up ``add_docs`` in chunks of 4096. This is because the
-    # maxBooleanClauses setting in solrconfig.xml is set to 4096. This means
-    # if we used any more than that Solr would throw an error and our
-    # updates wouldn't get processed.
-    add_steps = slices(range(len(solr_add_uids)), step=4096)
-    # Same concept as ``add_docs``.
-    del_steps = slices(range(len(solr_del_uids)), step=4096)
-    # Create a generator that yields 2-tuples with each invocation. The
-    # 2-tuples consist of one tuple each from del_steps & add_steps. Any
-    # mismatched values (e.g. there are more del_steps than add_steps)
-    # will be compensated for with the ``fillvalue``.
-    zipped_steps = izip_longest(del_steps, add_steps, fillvalue=(0, 0))
-
-    for tup in zipped_steps:
-        update_chunk = add_docs[tup[1][0]:tup[1][1] + 1]
-
-        if update_chunk:
-            logging.debug("BUID:%s - SOLR - Update chunk: %s" %
-                         (buid, [i['uid'] for i in update_chunk]))
-            # Pass 'commitWithin' so that Solr doesn't try to commit the new
-            # docs right away. This will help relieve some of the resource
-            # stress during the daily update. The value is expressed in
-            # milliseconds.
-            conn.add(update_chunk, commitWithin="30000")
-
-        delete_chunk = _build_solr_delete_query(
-            list(solr_del_uids)[tup[0][0]:tup[0][1] + 1])
-
-        if delete_chunk:
+        # see <uniqueKey>id</uniqueKey>. This serves as the equivalent of the
+        # pk (i.e. globally unique) in a database. With ``differential`` set,
+        # an existing document is only sent again if its content hash
+        # changed.
+        add_docs = _changed_jobs(self.jobfeed.iter_solr_jobs(),
+                                 self.solr_hashes, self.counts,
+                                 update=self.force,
+                                 differential=self.differential)
+        # Jobs keep the custom facets they're tagged with until
+        # tag_custom_facets() says otherwise.
+        add_docs = _with_custom_facets(add_docs, self.solr_hashes,
+                                       self.solr_custom_facets,
+                                       self.custom_facets)
+
+        # Post ``add_docs`` in chunks of 4096 as they come off the feed. This
+        # is because the maxBooleanClauses setting in solrconfig.xml is set
+        # to 4096. This means if we used any more than that Solr would throw
+        # an error and our updates wouldn't get processed. Since ``add_docs``
+        # is a generator, only one chunk of documents is ever held in memory.
+        return chunk_iter(add_docs, UPDATE_CHUNK_SIZE)
+
+    def post(self, conn, update_chunk):
+        logging.debug("BUID:%s - SOLR - Update chunk: %s" %
+                     (self.buid, [i['uid'] for i in update_chunk]))
+        # Pass 'commitWithin' so that Solr doesn't try to commit the new
+        # docs right away. This will help relieve some of the resource
+        # stress during the daily update. The value is expressed in
+        # milliseconds.
+        conn.add(update_chunk, commitWithin="30000")
+
+    def finish(self, conn, set_title=False, clear_cache=False,
+               delete_feed=True):
+        """
+        Deletes the jobs that are no longer in the feed and updates the
+        BusinessUnit. Must only be called once every chunk from
+        `add_chunks()` has been posted.
+
+        Returns the same 2-tuple as update_solr().
+
+        """
+        buid = self.buid
+        bu = self.bu
+        jobfeed = self.jobfeed
+        counts = self.counts
+
+        # Same concept as ``add_docs``.
+        for del_uids in chunk(list(self.solr_del_uids), UPDATE_CHUNK_SIZE):
             # Post-a-job jobs should not be deleted during import
-            delete_chunk = "(%s) AND -is_posted:true" % delete_chunk
+            delete_chunk = "(%s) AND -is_posted:true" % (
+                _build_solr_delete_query(del_uids))
             logging.debug("BUID:%s - SOLR - Delete chunk: %s" %
-                         (buid, list(solr_del_uids)))
+                         (buid, del_uids))
             conn.delete(q=delete_chunk)
 
-    #Update business unit information: title, dates, and associated_jobs
-    if set_title or not bu.title or (bu.title != jobfeed.job_source_name and
-                                     jobfeed.job_source_name):
-        bu.title = jobfeed.job_source_name
-    updated = bool(solr_add_uids) or bool(solr_del_uids)
-    _update_business_unit_modified_dates(bu, jobfeed.crawled_date,
-                                         updated=updated)
-    bu.associated_jobs = len(jobs)
-    bu.save()
-    if clear_cache:
-        # Clear cache in 25 minutes to allow for solr replication
-        tasks.task_clear_bu_cache.delay(buid=bu.id, countdown=1500)
-    #Update the Django database to reflect company additions and name changes
-    add_company(bu)
-    if delete_feed:
-        os.remove(filepath)
-        logging.info("BUID:%s - Deleted feed file." % buid)
-    return len(solr_add_uids), len(solr_del_uids)
+        tagging = self.schedule_custom_facet_tags(delete_feed)
+
+        #Update business unit information: title, dates, and associated_jobs
+        if set_title or not bu.title or (bu.title != jobfeed.job_source_name
+                                         and jobfeed.job_source_name):
+            bu.title = jobfeed.job_source_name
+        num_updated = counts['added'] + counts['changed']
+        logging.info("BUID:%s - SOLR - %s added, %s changed, %s unchanged, "
+                     "%s deleted" % (buid, counts['added'], counts['changed'],
+                                     counts['unchanged'],
+                                     len(self.solr_del_uids)))
+        updated = bool(num_updated) or bool(self.solr_del_uids)
+        _update_business_unit_modified_dates(bu, jobfeed.crawled_date,
+                                             updated=updated)
+        bu.associated_jobs = len(self.jobs)
+        bu.save()
+        if updated:
+            schedule_sitemaps(buid)
+        if clear_cache:
+            # Clear cache in 25 minutes to allow for solr replication
+            tasks.task_clear_bu_cache.delay(buid=bu.id, countdown=1500)
+        #Update the Django database to reflect company additions and name
+        #changes
+        add_company(bu)
+        if delete_feed and not tagging:
+            os.remove(self.filepath)
+            logging.info("BUID:%s - Deleted feed file." % buid)
+        return num_updated, len(self.solr_del_uids)
+
+    def schedule_custom_facet_tags(self, delete_feed=True):
+        """
+        Queues tag_custom_facets() for this feed file, to run once the
+        documents posted by this import have been committed (see post()).
+        Does nothing unless CUSTOM_FACET_COUNTS_FROM_INDEX is on and there
+        are tags to work out.
+
+        If `delete_feed` is True the feed file is handed over to the task,
+        which deletes it.
+
+        Returns True if the task was queued.
+
+        """
+        if self.custom_facets is None:
+            return False
+        if (not self.custom_facets and
+                not any(self.solr_custom_facets.values())):
+            # Every job posted by this import has already been tagged with
+            # no custom facets, and none of the others have any.
+            return False
+
+        filepath = self.filepath
+        if delete_feed:
+            # The next import of this business unit downloads its feed to
+            # the same path.
+            fd, filepath = tempfile.mkstemp(
+                prefix=os.path.basename(self.filepath) + '.',
+                suffix='.tagging', dir=os.path.dirname(self.filepath))
+            os.close(fd)
+            os.rename(self.filepath, filepath)
+        tasks.task_tag_custom_facets.apply_async(
+            args=[self.buid, filepath],
+            kwargs={'delete_feed': delete_feed},
+            countdown=getattr(settings, 'CUSTOM_FACET_TAG_DELAY', 60))
+        return True
+
+
+def tag_custom_facets(conn, buid, filepath):
+    """
+    Tags the jobs in a business unit's feed file with the ids of the
+    standard custom facets (of the sites the business unit is on) whose
+    saved_querystring they match, so that facet counts are a single
+    facet.field over `custom_facets` rather than a facet.query per custom
+    facet.
+
+    Membership is worked out by Solr itself, so this must only run once the
+    feed's documents are committed. Only the jobs whose tags changed are
+    re-sent, and jobs that changed in the index since `filepath` was
+    imported are left alone.
+
+    Returns the number of jobs re-sent.
+
+    """
+    bu = BusinessUnit.objects.get(id=buid)
+    tags = _custom_facet_tags(conn, buid, _buid_custom_facets(buid))
+    solr_hashes, solr_custom_facets = _indexed_jobs(conn, buid)
+    counts = {'retagged': 0}
+
+    def retagged_jobs():
+        for job in _job_feed(bu, filepath).iter_solr_jobs():
+            uid = long(job.get('uid', 0))
+            job['content_hash'] = content_hash(job)
+            if (solr_hashes.get(uid) != job['content_hash'] or
+                    solr_custom_facets[uid] == tags.get(uid, [])):
+                continue
+            job['custom_facets'] = tags.get(uid, [])
+            job['custom_facets_tagged'] = True
+            counts['retagged'] += 1
+            yield job
+
+    for update_chunk in chunk_iter(retagged_jobs(), UPDATE_CHUNK_SIZE):
+        conn.add(update_chunk, commitWithin="30000")
+    logging.info("BUID:%s - SOLR - %s jobs retagged with custom facets" %
+                 (buid, counts['retagged']))
+    return counts['retagged']
 
 
 def clear_solr(buid):
@@ -419,17 +538,154 @@ def clear_solr(buid):
     logging.info("BUID:%s - SOLR - All jobs deleted." % buid)
 
 
-def _solr_results_chunk(tup, buid, step):
+def _solr_buid_docs(conn, buid, fl="id", rows=1024):
     """
-    Takes a (start_index, stop_index) tuple and gets the results in that
-    range from the Solr index.
+    Yields the ``fl`` fields of every document in the Solr index for a
+    business unit.
 
     """
-    conn = Solr(settings.HAYSTACK_CONNECTIONS['default']['URL'])
-    results = conn.search("*:*", fq="buid:%s" % buid, fl="uid",
-                          rows=step, start=tup[0], facet="false",
-                          mlt="false").docs
-    return set([i['uid'] for i in results if 'uid' in i])
+    return conn.export(fq="buid:%s" % buid, fl=fl, rows=rows)
+
+
+def content_hash(job):
+    """
+    Returns a hex digest of a solr-ready job dictionary, ignoring fields
+    that change on every import without the job itself changing.
+
+    """
+    data = dict((k, v) for k, v in job.iteritems()
+                if k not in CONTENT_HASH_EXCLUDED_FIELDS)
+    return hashlib.md5(json.dumps(data, sort_keys=True,
+                                  default=unicode)).hexdigest()
+
+
+def _changed_jobs(jobs, solr_hashes, counts, update=True, differential=True):
+    """
+    Stamps each job with its content hash and yields only the ones that
+    need to be sent to Solr.
+
+    Inputs:
+    :jobs: An iterable of solr-ready job dictionaries.
+    :solr_hashes: A dictionary of {uid: content_hash} for the jobs already
+    in the index.
+    :counts: A dictionary whose 'added', 'changed' and 'unchanged' values
+    are incremented as jobs are consumed.
+    :update: Boolean. If False, jobs already in the index are never sent.
+    :differential: Boolean. If False, every job already in the index is
+    sent (as long as `update` is True), whether its hash changed or not.
+
+    """
+    for job in jobs:
+        job['content_hash'] = content_hash(job)
+        uid = long(job.get('uid', 0))
+        if uid not in solr_hashes:
+            counts['added'] += 1
+            yield job
+        elif update and (not differential or
+                         solr_hashes[uid] != job['content_hash']):
+            counts['changed'] += 1
+            yield job
+        else:
+            counts['unchanged'] += 1
+
+
+def _job_feed(bu, filepath):
+    try:
+        co = bu.company_set.all()[0]
+    except IndexError:
+        co = None
+    return DEv2JobFeed(filepath, jsid=bu.id, markdown=bu.enable_markdown,
+                       company=co, stream=True, moc_index=get_moc_index())
+
+
+def _indexed_jobs(conn, buid):
+    """
+    Returns a dictionary of {uid: content_hash} and one of {uid: sorted
+    custom facet ids} (None for jobs that haven't been tagged) for every
+    job of business unit `buid` in the index.
+
+    """
+    solr_hashes = {}
+    solr_custom_facets = {}
+    fl = "uid,content_hash,custom_facets,custom_facets_tagged"
+    for doc in _solr_buid_docs(conn, buid, fl=fl):
+        if 'uid' in doc:
+            solr_hashes[doc['uid']] = doc.get('content_hash')
+            if doc.get('custom_facets_tagged'):
+                solr_custom_facets[doc['uid']] = sorted(
+                    doc.get('custom_facets', []))
+            else:
+                solr_custom_facets[doc['uid']] = None
+    return solr_hashes, solr_custom_facets
+
+
+def _with_custom_facets(jobs, solr_hashes, solr_custom_facets,
+                        custom_facets=None):
+    """
+    Sets the custom facet tags of the jobs about to be sent to Solr.
+
+    Jobs whose content didn't change keep the tags they have in the index.
+    The others are left untagged (and counted with a facet.query per custom
+    facet; see seo.helpers) until tag_custom_facets() gets to them, unless
+    `custom_facets`, the business unit's standard custom facets, is empty,
+    in which case there's nothing for them to match.
+
+    """
+    for job in jobs:
+        uid = long(job.get('uid', 0))
+        tags = solr_custom_facets.get(uid)
+        if tags is not None and solr_hashes.get(uid) == job['content_hash']:
+            job['custom_facets'] = tags
+            job['custom_facets_tagged'] = True
+        elif custom_facets == []:
+            job['custom_facets'] = []
+            job['custom_facets_tagged'] = True
+        else:
+            job['custom_facets'] = []
+            job['custom_facets_tagged'] = False
+        yield job
+
+
+def _buid_custom_facets(buid):
+    """
+    The standard custom facets of every site that shows the jobs of
+    business unit `buid`, including the sites that show every job and the
+    sites it's on through site packages.
+
+    """
+    return list(CustomFacet.objects.filter(
+        seositefacet__seosite__in=job_sites(buid),
+        seositefacet__facet_type=SeoSiteFacet.STANDARD).exclude(
+        saved_querystring='').distinct())
+
+
+def _custom_facet_tags(conn, buid, facets):
+    """
+    Returns a dictionary of {uid: sorted list of custom facet ids} for the
+    jobs of business unit `buid` in the index that match any of `facets`.
+
+    """
+    fq = "buid:%s" % buid
+    # Count every facet in a single request first, so the jobs are only
+    # fetched for the facets that match any of them.
+    queries = {}
+    for facet in facets:
+        queries.setdefault(facet.saved_querystring, []).append(facet.id)
+    counts = {}
+    if queries:
+        results = conn.search('*:*', fq=fq, rows=0, facet='true',
+                              mlt='false', **{'facet.query': list(queries)})
+        counts = results.facets.get('facet_queries', {})
+
+    tags = {}
+    for query, count in counts.iteritems():
+        if not count:
+            continue
+        for doc in conn.export(q=query, fq=fq, fl="uid"):
+            tags.setdefault(long(doc['uid']), []).extend(queries[query])
+    for facet_ids in tags.values():
+        facet_ids.sort()
+    return tags
 
 
 def _job_filter(job):
@@ -448,21 +704,29 @@ def _xml_errors(jobfeed):
     return jobfeed.error_messages
 
 
-def download_feed_file(buid, data_dir=DATA_DIR):
+def feed_file_path(buid, data_dir=DATA_DIR):
     """
-    Downloads the job feed data for a particular job source id.
+    Returns the path download_feed_file() saves the feed file for a
+    particular job source id to.
 
     """
-
     # Get current worker process id, to prevent race conditions.
     try:
         p = current_process()
         process_id =  p.index
     except AttributeError:
         process_id = 0
+    return os.path.join(data_dir, str(process_id),
+                        FEED_FILE_PREFIX + str(buid) + '.xml')
+
 
-    full_file_path = os.path.join(data_dir, str(process_id), FEED_FILE_PREFIX + str(buid) +
-                                  '.xml')
+def download_feed_file(buid, data_dir=DATA_DIR):
+    """
+    Downloads the job feed data for a particular job source id.
+
+    """
+
+    full_file_path = feed_file_path(buid, data_dir=data_dir)
     # Download new feed file for today
     logging.info("Downloading new file for BUID %s..." % buid)
     if not os.path.exists(os.path.dirname(full_file_path)):
@@ -581,18 +845,28 @@ def chunk(l, chunk_size=1024):
         yield l[i:i + chunk_size]
 
 
+def chunk_iter(iterable, chunk_size=1024):
+    """
+    Create chunks from any iterable, including generators, without
+    consuming more than one chunk at a time.
+
+    """
+    iterator = iter(iterable)
+    while True:
+        group = list(islice(iterator, chunk_size))
+        if not group:
+            return
+        yield group
+
+
 def remove_expired_jobs(buid, active_jobs, upload_chunk_size=1024):
     """
     Given a job source id and a list of active jobs for that job source,
     Remove the jobs on solr that are not among the active jobs.
     """
     conn = Solr(settings.HAYSTACK_CONNECTIONS['default']['URL'])
-    count = conn.search("*:*", fq="buid:%s" % buid, facet="false",
-                                      mlt="false").hits
-    old_jobs = conn.search("*:*", fq="buid:%s" % buid, facet="false",
-                           rows=count, mlt="false").docs
     active_ids = set(j['id'] for j in active_jobs)
-    old_ids = set(j['id'] for j in old_jobs)
+    old_ids = set(j['id'] for j in _solr_buid_docs(conn, buid))
     expired = old_ids - active_ids
     chunks = chunk(list(expired), upload_chunk_size)
     for jobs in chunks:
@@ -0,0 +1,279 @@
+"""
+Imports the feed files for many business units at once.
+
+update_solr() downloads, parses and posts a feed in lockstep, so a worker
+importing a list of BUIDs is always waiting on either the network, lxml or
+Solr. ImportPipeline splits that work into three stages, each with its own
+pool of threads, connected by bounded queues:
+
+    download -> parse/transform -> post to Solr
+
+so downloading one feed, parsing another and posting a third all overlap,
+while the queue sizes bound how many feed files are waiting on disk and
+how many chunks of documents are waiting in memory.
+
+"""
+import logging
+import Queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+import import_jobs
+from seo_pysolr import Solr
+
+
+logger = logging.getLogger(__name__)
+
+# Tells a stage's workers that there is no more work coming.
+STOP = object()
+
+
+class StageStats(object):
+    """
+    Thread-safe throughput counters for one stage of an ImportPipeline.
+
+    """
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.docs = 0
+        self.errors = 0
+        # Seconds spent doing work, not counting time spent waiting on the
+        # queues on either side of the stage.
+        self.busy = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, busy, docs=0, items=1, error=False):
+        with self.lock:
+            self.items += items
+            self.docs += docs
+            self.busy += busy
+            if error:
+                self.errors += 1
+
+    def summary(self, elapsed):
+        elapsed = elapsed or 1
+        return ("%-8s %6d items %8d docs %4d errors %8.1fs busy "
+                "%8.2f items/s %9.1f docs/s" % (
+                    self.name, self.items, self.docs, self.errors, self.busy,
+                    self.items / elapsed, self.docs / elapsed))
+
+
+class FeedTracker(object):
+    """
+    Keeps track of the chunks of one feed that are still waiting to be
+    posted, so that the feed is finished (expired jobs deleted, business
+    unit updated) exactly once, after the last of them.
+
+    """
+    def __init__(self, buid, update):
+        self.buid = buid
+        self.update = update
+        self.pending = 0
+        self.parsed = False
+        self.failed = False
+        self.lock = threading.Lock()
+
+    def add_chunk(self):
+        with self.lock:
+            self.pending += 1
+
+    def chunk_done(self, failed=False):
+        """Returns True if the caller should finish the feed."""
+        with self.lock:
+            self.pending -= 1
+            self.failed = self.failed or failed
+            return self.parsed and self.pending == 0
+
+    def parse_done(self):
+        """Returns True if the caller should finish the feed."""
+        with self.lock:
+            self.parsed = True
+            return self.pending == 0
+
+
+class ImportPipeline(object):
+    """
+    Runs update_solr() for a list of BUIDs with the download, parse and
+    post stages on separate threads.
+
+    Worker counts and the queue size default to the
+    IMPORT_PIPELINE_WORKERS and IMPORT_PIPELINE_QUEUE_SIZE settings. The
+    remaining arguments have the same meaning as for update_solr().
+
+    Usage:
+        pipeline = ImportPipeline(parse_workers=4)
+        results = pipeline.run([13, 14, 15])
+
+    """
+    def __init__(self, download_workers=None, parse_workers=None,
+                 post_workers=None, queue_size=None, download=True,
+                 force=True, differential=True, clear_cache=False,
+                 delete_feed=True, data_dir=import_jobs.DATA_DIR):
+        workers = getattr(settings, 'IMPORT_PIPELINE_WORKERS', {})
+        self.workers = {
+            'download': download_workers or workers.get('download', 4),
+            'parse': parse_workers or workers.get('parse', 2),
+            'post': post_workers or workers.get('post', 2),
+        }
+        self.queue_size = (queue_size or
+                           getattr(settings, 'IMPORT_PIPELINE_QUEUE_SIZE', 8))
+        self.download_feeds = download
+        self.force = force
+        self.differential = differential
+        self.clear_cache = clear_cache
+        self.delete_feed = delete_feed
+        self.data_dir = data_dir
+        self.stats = dict((name, StageStats(name)) for name in
+                          ('download', 'parse', 'post'))
+        self.results = {}
+        self.elapsed = 0
+
+    def run(self, buids):
+        """
+        Imports every BUID in `buids`.
+
+        Returns a dictionary of {buid: result}, where result is the 2-tuple
+        update_solr() would have returned, or the exception that stopped
+        that BUID from being imported.
+
+        """
+        start = time.time()
+        self.results = {}
+        download_queue = Queue.Queue()
+        parse_queue = Queue.Queue(maxsize=self.queue_size)
+        post_queue = Queue.Queue(maxsize=self.queue_size)
+        for buid in buids:
+            download_queue.put(buid)
+
+        # Each stage is only told to stop once every worker of the stage
+        # before it has exited, so nothing is left in a queue.
+        stages = [
+            ('download', self.download_worker, download_queue, parse_queue),
+            ('parse', self.parse_worker, parse_queue, post_queue),
+            ('post', self.post_worker, post_queue, None),
+        ]
+        threads = []
+        for name, target, in_queue, out_queue in stages:
+            threads.append([
+                threading.Thread(target=self._worker,
+                                 name="import-%s-%s" % (name, i),
+                                 args=(target, in_queue, out_queue))
+                for i in range(self.workers[name])])
+        for stage_threads in threads:
+            for thread in stage_threads:
+                thread.start()
+        for (name, target, in_queue, out_queue), stage_threads in zip(
+                stages, threads):
+            for thread in stage_threads:
+                in_queue.put(STOP)
+            for thread in stage_threads:
+                thread.join()
+
+        self.elapsed = time.time() - start
+        return self.results
+
+    def summary(self):
+        """
+        Returns a line of throughput figures per stage for the last run.
+
+        """
+        return "\n".join(self.stats[name].summary(self.elapsed)
+                         for name in ('download', 'parse', 'post'))
+
+    def _worker(self, target, in_queue, out_queue):
+        conn = Solr(settings.HAYSTACK_CONNECTIONS['default']['URL'])
+        try:
+            while True:
+                item = in_queue.get()
+                if item is STOP:
+                    return
+                target(item, out_queue, conn)
+        finally:
+            # Each thread has its own database connection.
+            connection.close()
+
+    def download_worker(self, buid, out_queue, conn):
+        start = time.time()
+        try:
+            if self.download_feeds:
+                filepath = import_jobs.download_feed_file(
+                    buid, data_dir=self.data_dir)
+            else:
+                filepath = import_jobs.feed_file_path(buid,
+                                                      data_dir=self.data_dir)
+        except Exception as e:
+            logger.exception("BUID:%s - Unable to download feed file", buid)
+            self.results[buid] = e
+            self.stats['download'].record(time.time() - start, error=True)
+            return
+        self.stats['download'].record(time.time() - start)
+        out_queue.put((buid, filepath))
+
+    def parse_worker(self, item, out_queue, conn):
+        buid, filepath = item
+        stats = self.stats['parse']
+        tick = time.time()
+        busy = 0.0
+        docs = 0
+        try:
+            tracker = FeedTracker(buid, self.parse(buid, filepath, conn))
+            chunks = tracker.update.add_chunks()
+            while True:
+                try:
+                    update_chunk = next(chunks)
+                except StopIteration:
+                    break
+                busy += time.time() - tick
+                docs += len(update_chunk)
+                tracker.add_chunk()
+                out_queue.put((tracker, update_chunk))
+                tick = time.time()
+        except Exception as e:
+            logger.exception("BUID:%s - Unable to parse feed file", buid)
+            self.results[buid] = e
+            stats.record(busy + time.time() - tick, docs=docs, error=True)
+            return
+        stats.record(busy + time.time() - tick, docs=docs)
+        if tracker.parse_done():
+            self.finish(tracker, conn)
+
+    def post_worker(self, item, out_queue, conn):
+        tracker, update_chunk = item
+        start = time.time()
+        failed = False
+        try:
+            self.post(tracker, update_chunk, conn)
+        except Exception as e:
+            logger.exception("BUID:%s - Unable to post chunk to Solr",
+                             tracker.buid)
+            self.results[tracker.buid] = e
+            failed = True
+        self.stats['post'].record(time.time() - start,
+                                  docs=len(update_chunk), error=failed)
+        if tracker.chunk_done(failed=failed):
+            self.finish(tracker, conn)
+
+    def parse(self, buid, filepath, conn):
+        return import_jobs.FeedUpdate(buid, filepath, conn, force=self.force,
+                                      differential=self.differential)
+
+    def post(self, tracker, update_chunk, conn):
+        tracker.update.post(conn, update_chunk)
+
+    def finish(self, tracker, conn):
+        # A feed whose documents didn't all make it into Solr is left as
+        # is (feed file included) for the next import to retry.
+        if tracker.failed:
+            return
+        try:
+            self.results[tracker.buid] = tracker.update.finish(
+                conn, clear_cache=self.clear_cache,
+                delete_feed=self.delete_feed)
+        except Exception as e:
+            logger.exception("BUID:%s - Unable to finish import",
+                             tracker.buid)
+            self.results[tracker.buid] = e
@@ -11,6 +11,9 @@ from django.shortcuts import redirect
 
 from postajob.models import SitePackage
 from seo.models import SeoSite, SeoSiteRedirect, SeoSiteFacet
+from seo.site_context import (SiteContext, clear_site_context,
+                              set_site_context)
+import solr_stats
 import version
 
 
@@ -111,6 +114,36 @@ class NewRelic(object):
             newrelic.agent.add_custom_parameter('user_id', 'anonymous')
 
 
+class SolrStatsMiddleware(object):
+    """
+    Collects the Solr requests each view makes (see solr_stats) and, when
+    DEBUG is on, summarizes them in an X-Solr-Queries response header.
+
+    """
+    def process_request(self, request):
+        solr_stats.start_request()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        stats = solr_stats.current()
+        if stats is not None:
+            stats.view = '%s.%s' % (view_func.__module__,
+                                    getattr(view_func, '__name__',
+                                            view_func.__class__.__name__))
+
+    def process_response(self, request, response):
+        stats = solr_stats.finish_request()
+        if stats is None:
+            return response
+        if settings.DEBUG:
+            response['X-Solr-Queries'] = stats.header()
+        if settings.NEW_RELIC_TRACKING:
+            totals = stats.totals()
+            newrelic.agent.add_custom_parameter('solr_queries',
+                                                totals['queries'])
+            newrelic.agent.add_custom_parameter('solr_qtime', totals['qtime'])
+        return response
+
+
 class CompactP3PMiddleware(object):
     """
     Adds a compact privacy policy to site headers
@@ -182,89 +215,114 @@ class MultiHostMiddleware:
         #             127.0.0.1:8000,
         #             find.ibm.jobs:80
         host = host.split(":")[0]
-        site_cache_key = '%s:SeoSite' % host
-        MINUTES_TO_CACHE = getattr(settings, 'MINUTES_TO_CACHE', 120)
-        ## REMINDER: make domain a unique field on site model
-        # see if the cache has it
-        my_site = cache.get(site_cache_key)
-        if not my_site:
-            #DO NOT add filters to prefetched objects. Use only with .all()
-            sites = SeoSite.objects.select_related('group',
-                                                   'microsite_carousel',
-                                                   'view_sources',
-                                                   ).prefetch_related('billboard_images',
-                                                                      'business_units',
-                                                                      'featured_companies',
-                                                                      'site_tags',
-                                                                      'google_analytics')
-            # the cache didn't have it, so lets get it and set the cache
-            try:
-                my_site = sites.get(domain=host)
-            except Site.MultipleObjectsReturned:
-                my_site = sites.filter(domain=host)[:1][0]
-            except Site.DoesNotExist:
-                my_site = sites.get(id=1)
-            cache.set(site_cache_key, my_site, MINUTES_TO_CACHE*60)
-        settings.SITE = my_site
-        my_buids = [bu.id for bu in my_site.business_units.all()]
-        settings.SITE_ID = my_site.id
-        settings.SITE_NAME = my_site.name
-        settings.SITE_BUIDS = my_buids
-        settings.SITE_TAGS = [tag.site_tag for tag in my_site.site_tags.all()]
+        site_values = cached_site_bundle(host)
+
         # version information
         settings.VERSION = version.marketing_version
         settings.BUILD = version.build_calculated
         settings.FULL_VERSION = version.release_number
 
-        # Place variables that need a non blank default value here
-        if my_site.site_title:  # title defaults to site name
-            settings.SITE_TITLE = my_site.site_title
-        else:
-            settings.SITE_TITLE = my_site.name
-        if my_site.site_heading:  # heading defaults to site name
-            settings.SITE_HEADING = my_site.site_heading
-        else:
-            settings.SITE_HEADING = my_site.name
-        if my_site.site_description:
-            settings.SITE_DESCRIPTION = my_site.site_description
-        else:
-            settings.SITE_DESCRIPTION = None
-
-        # Default variable loading. Assigns empty string as default
-        site_flags = {
-            'ats_source_codes': 'ATS_SOURCE_CODES',
-            'google_analytics_campaigns': 'GA_CAMPAIGN',
-            'special_commitments': 'COMMITMENTS',
-            'view_sources': 'VIEW_SOURCE'
-        }
-
-        for k, v in site_flags.items():
-            attr = getattr(my_site, k)
-            if attr:
-                setattr(settings, v, attr)
-            else:
-                setattr(settings, v, '')
-
-        site_facets = SeoSiteFacet.objects.filter(seosite=my_site)
-        site_facets = site_facets.select_related('customfacet')
-
-        settings.CACHE_MIDDLEWARE_KEY_PREFIX = "%s" % my_site.domain
-
-        default = SeoSiteFacet.DEFAULT
-        default_site_facets = site_facets.filter(facet_type=default)
-        settings.DEFAULT_FACET = custom_facets_ops_groups(default_site_facets)
-
-        featured = SeoSiteFacet.FEATURED
-        featured_site_facets = site_facets.filter(facet_type=featured)
-        settings.FEATURED_FACET = custom_facets_ops_groups(featured_site_facets)
-
-        standard = SeoSiteFacet.STANDARD
-        standard_site_facets = site_facets.filter(facet_type=standard)
-        settings.STANDARD_FACET = custom_facets_ops_groups(standard_site_facets)
-
-        packages = SitePackage.objects.filter(sites=my_site)
-        settings.SITE_PACKAGES = [int(site_package.pk)
-                                  for site_package in packages]
+        # The site configuration is specific to this request, so it is kept
+        # on the request and in a thread-local rather than on the settings
+        # shared by every thread. See seo.site_context.
+        request.site_context = SiteContext(**site_values)
+        set_site_context(request.site_context)
+        if getattr(settings, 'SITE_CONTEXT_MIRROR_SETTINGS', True):
+            request.site_context.apply_to_settings()
+
+    def process_response(self, request, response):
+        clear_site_context()
+        return response
+
+
+def cached_site_bundle(host):
+    """
+    Returns site_bundle(host), from the cache if it's there.
+
+    """
+    bundle_cache_key = '%s:site_bundle' % host
+    MINUTES_TO_CACHE = getattr(settings, 'MINUTES_TO_CACHE', 120)
+    # The bundle holds everything about the site that comes from the
+    # database, so a request for a cached site doesn't query it.
+    site_values = cache.get(bundle_cache_key)
+    if site_values is None:
+        site_values = site_bundle(host)
+        cache.set(bundle_cache_key, site_values, MINUTES_TO_CACHE*60)
+    return site_values
+
+
+def site_bundle(host):
+    """
+    Returns the site-specific values MultiHostMiddleware needs for `host`
+    as a dictionary of setting name -> value (see seo.site_context).
+
+    Everything in it is resolved up front (related objects are prefetched
+    and facets carry their boolean operation and group), so the bundle can
+    be pickled into the cache and used without further queries. Cached
+    bundles are removed by SeoSite.clear_caches/Configuration.clear_caches.
+
+    """
+    ## REMINDER: make domain a unique field on site model
+    #DO NOT add filters to prefetched objects. Use only with .all()
+    sites = SeoSite.objects.select_related('group',
+                                           'microsite_carousel',
+                                           'view_sources',
+                                           ).prefetch_related('billboard_images',
+                                                              'business_units',
+                                                              'featured_companies',
+                                                              'site_tags',
+                                                              'google_analytics')
+    try:
+        my_site = sites.get(domain=host)
+    except Site.MultipleObjectsReturned:
+        my_site = sites.filter(domain=host)[:1][0]
+    except Site.DoesNotExist:
+        my_site = sites.get(id=1)
+
+    site_values = {
+        'SITE': my_site,
+        'SITE_ID': my_site.id,
+        'SITE_NAME': my_site.name,
+        'SITE_BUIDS': [bu.id for bu in my_site.business_units.all()],
+        'SITE_TAGS': [tag.site_tag for tag in my_site.site_tags.all()],
+    }
+
+    # Place variables that need a non blank default value here
+    # title and heading default to site name
+    site_values['SITE_TITLE'] = my_site.site_title or my_site.name
+    site_values['SITE_HEADING'] = my_site.site_heading or my_site.name
+    site_values['SITE_DESCRIPTION'] = my_site.site_description or None
+
+    # Default variable loading. Assigns empty string as default
+    site_flags = {
+        'ats_source_codes': 'ATS_SOURCE_CODES',
+        'google_analytics_campaigns': 'GA_CAMPAIGN',
+        'special_commitments': 'COMMITMENTS',
+        'view_sources': 'VIEW_SOURCE'
+    }
+
+    for k, v in site_flags.items():
+        site_values[v] = getattr(my_site, k) or ''
+
+    site_values['CACHE_MIDDLEWARE_KEY_PREFIX'] = "%s" % my_site.domain
+
+    # One query for every facet type.
+    site_facets = SeoSiteFacet.objects.filter(seosite=my_site)
+    site_facets = site_facets.select_related('customfacet')
+    facets_by_type = {}
+    for site_facet in site_facets:
+        facets_by_type.setdefault(site_facet.facet_type, []).append(
+            site_facet)
+    for facet_type, name in [(SeoSiteFacet.DEFAULT, 'DEFAULT_FACET'),
+                             (SeoSiteFacet.FEATURED, 'FEATURED_FACET'),
+                             (SeoSiteFacet.STANDARD, 'STANDARD_FACET')]:
+        site_values[name] = custom_facets_ops_groups(
+            facets_by_type.get(facet_type, []))
+
+    packages = SitePackage.objects.filter(sites=my_site)
+    site_values['SITE_PACKAGES'] = [int(pk) for pk in
+                                    packages.values_list('pk', flat=True)]
+    return site_values
 
 
 def custom_facets_ops_groups(site_facets):
@@ -0,0 +1,181 @@
+import cPickle as pickle
+import logging
+import os
+import time
+from collections import defaultdict, namedtuple
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Max
+
+from moc_coding.models import CustomCareer, Moc
+
+
+logger = logging.getLogger(__name__)
+
+# Lightweight, picklable stand-in for a Moc instance. It exposes the only
+# attributes the import code reads (see xmlparse.JobFeed.moc_data).
+MocRecord = namedtuple("MocRecord", "id code branch title")
+
+
+class MocIndex(object):
+    """
+    An in-memory O*NET -> MOC index, plus the per-business unit
+    CustomCareer overrides, so that MOC enrichment of a feed is a set of
+    dictionary lookups instead of several queries per job.
+
+    Build one per import run with `MocIndex.build()`, or use
+    `get_moc_index()` to reuse a snapshot on disk when one is configured
+    (see `settings.MOC_INDEX_SNAPSHOT`).
+
+    """
+    # Bump whenever the pickled layout of this class changes.
+    VERSION = 1
+
+    def __init__(self, mocs, onet_mocs, custom_careers, fingerprint=None):
+        """
+        Inputs:
+        :mocs: A dictionary of moc id -> MocRecord.
+        :onet_mocs: A dictionary of onet code -> set of moc ids.
+        :custom_careers: A dictionary of buid -> {onet code: set of moc ids}
+        :fingerprint: The result of `MocIndex.fingerprint()` at build time.
+
+        """
+        self.mocs = mocs
+        self.onet_mocs = onet_mocs
+        self.custom_careers = custom_careers
+        self.fingerprint = fingerprint
+        self.built = time.time()
+
+    @staticmethod
+    def fingerprint():
+        """
+        A cheap summary of the mapping tables, used to tell whether a
+        snapshot is stale without rebuilding it.
+
+        """
+        onet_map = Moc.onets.through.objects
+        return (Moc.objects.count(),
+                onet_map.count(),
+                onet_map.aggregate(Max('id'))['id__max'],
+                CustomCareer.objects.count(),
+                CustomCareer.objects.aggregate(Max('id'))['id__max'])
+
+    @classmethod
+    def build(cls):
+        """
+        Loads every MOC, O*NET mapping and business unit CustomCareer in
+        a constant number of queries.
+
+        """
+        from seo.models import BusinessUnit
+
+        mocs = dict((pk, MocRecord(pk, code, branch, title)) for
+                    pk, code, branch, title in
+                    Moc.objects.values_list('id', 'code', 'branch', 'title'))
+
+        onet_mocs = defaultdict(set)
+        for onet, moc in Moc.onets.through.objects.values_list('onet_id',
+                                                                'moc_id'):
+            onet_mocs[onet].add(moc)
+
+        content_type = ContentType.objects.get_for_model(BusinessUnit)
+        custom_careers = defaultdict(lambda: defaultdict(set))
+        careers = CustomCareer.objects.filter(content_type=content_type)
+        for buid, onet, moc in careers.values_list('object_id', 'onet_id',
+                                                   'moc_id'):
+            custom_careers[buid][onet].add(moc)
+
+        return cls(mocs, dict(onet_mocs),
+                   dict((buid, dict(onets)) for buid, onets
+                        in custom_careers.items()),
+                   fingerprint=cls.fingerprint())
+
+    @classmethod
+    def load(cls, path):
+        """
+        Returns the MocIndex pickled at `path`, or None if there isn't one
+        or it was written by a different version of this class.
+
+        """
+        try:
+            with open(path, 'rb') as f:
+                version, index = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError, ValueError,
+                AttributeError, ImportError):
+            return None
+        if version != cls.VERSION:
+            return None
+        return index
+
+    def save(self, path):
+        """
+        Atomically writes this index to `path`.
+
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp_path = "%s.%s.tmp" % (path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((self.VERSION, self), f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, path)
+
+    def _records(self, moc_ids):
+        records = [self.mocs[pk] for pk in moc_ids if pk in self.mocs]
+        return sorted(records, key=lambda moc: (moc.branch, moc.code))
+
+    def job_mocs(self, onets):
+        """
+        The index equivalent of `xmlparse.JobFeed.job_mocs`; returns the
+        MocRecords mapped to any of `onets`, ordered like `Moc.Meta`.
+
+        """
+        moc_ids = set()
+        for onet in onets or []:
+            moc_ids.update(self.onet_mocs.get(onet, ()))
+        return self._records(moc_ids)
+
+    def mapped_mocs(self, buid, onets):
+        """
+        The index equivalent of `xmlparse.get_mapped_mocs`; returns the
+        standard MocRecords for `onets` plus any CustomCareer mappings
+        business unit `buid` has for them.
+
+        """
+        moc_ids = set(moc.id for moc in self.job_mocs(onets))
+        bu_careers = self.custom_careers.get(buid, {})
+        for onet in onets or []:
+            moc_ids.update(bu_careers.get(onet, ()))
+        return self._records(moc_ids)
+
+
+def get_moc_index(path=None, max_age=None):
+    """
+    Returns a MocIndex for an import run.
+
+    If `path` (default: `settings.MOC_INDEX_SNAPSHOT`) is set, a snapshot
+    written there is reused as long as it is younger than `max_age`
+    seconds (default: `settings.MOC_INDEX_MAX_AGE`) and the mapping tables
+    haven't changed since it was written; otherwise a new index is built
+    and the snapshot is replaced.
+
+    """
+    path = path or getattr(settings, 'MOC_INDEX_SNAPSHOT', None)
+    if max_age is None:
+        max_age = getattr(settings, 'MOC_INDEX_MAX_AGE', 60 * 60 * 24)
+
+    if path:
+        index = MocIndex.load(path)
+        if (index is not None and time.time() - index.built < max_age and
+                index.fingerprint == MocIndex.fingerprint()):
+            return index
+
+    index = MocIndex.build()
+    if path:
+        try:
+            index.save(path)
+        except (IOError, OSError):
+            logger.warn("Unable to write MOC index snapshot to %s", path,
+                        exc_info=True)
+    return index
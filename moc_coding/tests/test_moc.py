@@ -2,9 +2,11 @@ import os
 
 from django.contrib.contenttypes.models import ContentType
 
+from moc_coding.models import CustomCareer
 from seo.models import User, BusinessUnit
 from seo.tests.setup import DirectSEOBase
 
+from moc_coding.helpers import MocIndex, get_moc_index
 from moc_coding.tests.factories import (CustomCareerFactory, MocFactory,
                                         MocDetailFactory, OnetFactory)
 from xmlparse import DEv2JobFeed
@@ -63,6 +65,40 @@ class MocTestCase(DirectSEOBase):
 
         self.assertEqual(len(mocs), 2)
 
+    def test_moc_index_matches_queries(self):
+        new_onet = OnetFactory(code="22222222")
+        new_moc = MocFactory(code="2")
+        new_moc.onets = [new_onet]
+        new_moc.save()
+        CustomCareerFactory(object_id=1, onet_id="22222222")
+
+        job = {'onet_code': ['99999999', '22222222']}
+        index = MocIndex.build()
+
+        with self.assertNumQueries(0):
+            mocs = index.job_mocs(job['onet_code'])
+            mapped_mocs = index.mapped_mocs(self.mapping.object_id,
+                                            job['onet_code'])
+        self.assertEqual([moc.id for moc in mocs],
+                         [moc.id for moc in DEv2JobFeed.job_mocs(job)])
+        self.assertItemsEqual(
+            [moc.id for moc in mapped_mocs],
+            set([new_moc.id, self.mapping.moc.id,
+                 CustomCareer.objects.get(onet_id="22222222").moc.id]))
+        self.assertEqual(index.mapped_mocs(5, job['onet_code']), mocs)
+
+    def test_moc_index_snapshot(self):
+        path = os.path.join(os.path.abspath(os.path.dirname(__file__)),
+                            'moc_index.pickle')
+        self.addCleanup(lambda: os.path.exists(path) and os.remove(path))
+        index = get_moc_index(path=path)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(get_moc_index(path=path).built, index.built)
+
+        # Changing the mappings invalidates the snapshot.
+        CustomCareerFactory(object_id=2)
+        self.assertNotEqual(get_moc_index(path=path).built, index.built)
+
     def test_authentication(self):
         #If user isn't logged in, redirect to login view
         resp = self.client.get('/mocmaps/newmap/?onet=99999999')
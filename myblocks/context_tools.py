@@ -1,40 +1,110 @@
-import collections
+from contextlib import contextmanager
 import functools
 from itertools import chain
+import logging
+import threading
 
 from django.conf import settings
 from django.contrib.humanize.templatetags.humanize import intcomma
 from django.core.urlresolvers import reverse, resolve
-from django.http import QueryDict
+from django.http import HttpRequest, QueryDict
 
 from seo import cache, helpers
 from seo.breadbox import Breadbox
 from seo.search_backend import DESearchQuerySet
+from seo.site_context import site_settings
 from seo.templatetags.job_setup import create_arranged_jobs
 
 
+logger = logging.getLogger(__name__)
+
+
+# The RequestMemo for the request whose blocks are being rendered by this
+# thread; see request_memo().
+_local = threading.local()
+
+
+class RequestMemo(object):
+    """
+    The values memoized while handling a single request, with hit and miss
+    counters.
+
+    """
+    def __init__(self):
+        self.values = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return '<RequestMemo: %s values, %s hits, %s misses>' % (
+            len(self.values), self.hits, self.misses)
+
+
+def get_request_memo(request):
+    """
+    Returns the RequestMemo stored on `request`, adding one if needed.
+
+    """
+    memo = getattr(request, '_memo', None)
+    if memo is None:
+        memo = RequestMemo()
+        request._memo = memo
+    return memo
+
+
+@contextmanager
+def request_memo(request):
+    """
+    Makes the memo for `request` the one used by Memoized functions that
+    aren't passed the request (e.g. Block.cast()) for the duration of the
+    block, and drops the memoized values when it exits.
+
+    """
+    previous = getattr(_local, 'memo', None)
+    memo = get_request_memo(request)
+    _local.memo = memo
+    try:
+        yield memo
+    finally:
+        _local.memo = previous
+        if previous is not memo:
+            del request._memo
+            logger.debug("%s %r", request.path, memo)
+
+
 class Memoized(object):
     """
     Caches a function's return value each time it is called.
     If called later with the same arguments, the cached value is returned
     (not reevaluated).
 
+    Values are only kept for the duration of a request: in the memo stored
+    on the request if one is passed in, or the memo opened by
+    request_memo() otherwise. Outside of a request nothing is cached.
+
     """
     def __init__(self, func):
         self.func = func
-        self.cache = {}
 
     def __call__(self, *args, **kwargs):
-        if not settings.MEMOIZE:
-            return self.func(*args, **kwargs)
-        if not isinstance(args, collections.Hashable) or kwargs:
+        if not settings.MEMOIZE or kwargs:
             return self.func(*args, **kwargs)
-        if args in self.cache:
-            return self.cache[args]
-        else:
+        memo = self.get_memo(args)
+        if memo is None:
+            return self.func(*args)
+        key = (self.func, args)
+        try:
+            value = memo.values[key]
+        except KeyError:
+            memo.misses += 1
             value = self.func(*args)
-            self.cache[args] = value
-            return value
+            memo.values[key] = value
+        except TypeError:
+            # Unhashable arguments.
+            return self.func(*args)
+        else:
+            memo.hits += 1
+        return value
 
     def __repr__(self):
         return self.func.__doc__
@@ -42,6 +112,13 @@ class Memoized(object):
     def __get__(self, obj, objtype):
         return functools.partial(self.__call__, obj)
 
+    @staticmethod
+    def get_memo(args):
+        for arg in args:
+            if isinstance(arg, HttpRequest):
+                return get_request_memo(arg)
+        return getattr(_local, 'memo', None)
+
 
 @Memoized
 def get_arranged_jobs(request):
@@ -130,7 +207,7 @@ def get_filters(request):
 
 @Memoized
 def get_google_analytics(request):
-    return settings.SITE.google_analytics.all()
+    return site_settings.SITE.google_analytics.all()
 
 @Memoized
 def get_job(request, job_id):
@@ -140,7 +217,8 @@ def get_job(request, job_id):
 
     try:
         query = "%s:(%s)" % (search_type, job_id)
-        return DESearchQuerySet().narrow(query)[0]
+        sqs = DESearchQuerySet().narrow(query)
+        return helpers.apply_field_profile(sqs, 'job_detail')[0]
     except IndexError:
         return None
 
@@ -252,7 +330,7 @@ def get_search_url(request):
 
 @Memoized
 def get_site_commitments_string(request):
-    return helpers.make_specialcommit_string(settings.COMMITMENTS.all())
+    return helpers.make_specialcommit_string(site_settings.COMMITMENTS.all())
 
 
 @Memoized
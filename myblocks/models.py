@@ -20,6 +20,7 @@ from myjobs.helpers import expire_login
 from myjobs.models import User
 from registration.forms import CustomAuthForm, RegistrationForm
 from seo import helpers
+from seo.site_context import site_settings
 
 
 # Attempt to use a secondary cache for blocks. This
@@ -408,7 +409,7 @@ class SearchResultBlock(Block):
             'results_heading': context_tools.get_results_heading(request),
             'site_commitments_string': context_tools.get_site_commitments_string(request),
             'site_config': context_tools.get_site_config(request),
-            'site_tags': settings.SITE_TAGS,
+            'site_tags': site_settings.SITE_TAGS,
             'title_term': context_tools.get_title_term(request),
         }
 
@@ -451,7 +452,7 @@ class SearchResultBlock(Block):
         query_string = context_tools.get_query_string(request)
         config = context_tools.get_site_config(request)
         config = '%s::%s' % (config.pk, config.revision)
-        buids = [str(buid) for buid in getattr(settings, 'SITE_BUIDS', [])]
+        buids = [str(buid) for buid in getattr(site_settings, 'SITE_BUIDS', [])]
         buids = '#'.join(buids)
         key = '###'.join([block, path, query_string, config,
                           buids, domain]).encode('utf-8')
@@ -600,8 +601,8 @@ class Page(models.Model):
         for block in self.all_blocks():
             context.update(block.context(request, **kwargs))
 
-        context['site_title'] = settings.SITE_TITLE
-        context['site_description'] = settings.SITE_DESCRIPTION
+        context['site_title'] = site_settings.SITE_TITLE
+        context['site_description'] = site_settings.SITE_DESCRIPTION
 
         return context
 
@@ -739,7 +740,7 @@ class Page(models.Model):
         rows = '#'.join(rows)
         config = context_tools.get_site_config(request)
         config = '%s::%s' % (config.pk, config.revision)
-        buids = [str(buid) for buid in getattr(settings, 'SITE_BUIDS', [])]
+        buids = [str(buid) for buid in getattr(site_settings, 'SITE_BUIDS', [])]
         buids = '#'.join(buids)
         key = '###'.join([page, path, query_string, config, blocks, rows,
                           buids, domain]).encode('utf-8')
@@ -771,8 +772,8 @@ class Page(models.Model):
         if not job:
             raise Http404
 
-        if settings.SITE_BUIDS and job.buid not in settings.SITE_BUIDS:
-            on_this_site = set(settings.SITE_PACKAGES) & set(job.on_sites)
+        if site_settings.SITE_BUIDS and job.buid not in site_settings.SITE_BUIDS:
+            on_this_site = set(site_settings.SITE_PACKAGES) & set(job.on_sites)
             if job.on_sites and not on_this_site:
                 return redirect('home')
 
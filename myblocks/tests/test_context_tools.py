@@ -3,6 +3,7 @@ from django.core.urlresolvers import reverse
 
 from myblocks import context_tools
 from myblocks.tests.setup import BlocksTestBase
+from seo.tests.setup import patch_settings
 
 
 class ContextToolsTests(BlocksTestBase):
@@ -77,4 +78,40 @@ class ContextToolsTests(BlocksTestBase):
 
     def test_get_site_commitments_string(self):
         string = context_tools.get_site_commitments_string(self.search_results_request)
-        self.assertEqual(string, self.commitment.commit)
\ No newline at end of file
+        self.assertEqual(string, self.commitment.commit)
+
+    def test_memoized_lifetime(self):
+        """
+        Memoized values are shared for the duration of a request and are
+        dropped along with its memo.
+
+        """
+        calls = []
+
+        @context_tools.Memoized
+        def request_func(request):
+            calls.append(request)
+            return len(calls)
+
+        @context_tools.Memoized
+        def no_request_func(value):
+            calls.append(value)
+            return len(calls)
+
+        request = self.search_results_request
+        with patch_settings(MEMOIZE=True):
+            # Without a request there's nothing to scope the value to.
+            self.assertEqual(no_request_func(1), 1)
+            self.assertEqual(no_request_func(1), 2)
+
+            with context_tools.request_memo(request) as memo:
+                self.assertEqual(request_func(request), 3)
+                self.assertEqual(request_func(request), 3)
+                self.assertEqual(no_request_func(1), 4)
+                self.assertEqual(no_request_func(1), 4)
+                self.assertEqual(memo.hits, 2)
+                self.assertEqual(memo.misses, 2)
+
+            self.assertFalse(hasattr(request, '_memo'))
+            self.assertEqual(no_request_func(1), 5)
+            self.assertEqual(request_func(request), 6)
@@ -1,15 +1,23 @@
-from django.conf import settings
 from django.http import Http404, HttpResponse
 
 from django.views.generic import View
 
+from myblocks import context_tools
 from myblocks.models import Page
 
+from seo.site_context import site_settings
+
 
 class BlockView(View):
     page = None
     page_type = None
 
+    def dispatch(self, request, *args, **kwargs):
+        # Blocks memoize the queries they share for as long as the request
+        # is being handled.
+        with context_tools.request_memo(request):
+            return super(BlockView, self).dispatch(request, *args, **kwargs)
+
     def get(self, request, *args, **kwargs):
         return self.handle_request(request, *args, **kwargs)
 
@@ -47,7 +55,7 @@ class BlockView(View):
         """
         if request.user.is_authenticated() and request.user.is_staff:
             try:
-                page = Page.objects.filter(sites=settings.SITE,
+                page = Page.objects.filter(sites=site_settings.SITE,
                                            status=Page.STAGING,
                                            page_type=self.page_type)[0]
                 setattr(self, 'page', page)
@@ -55,7 +63,7 @@ class BlockView(View):
                 pass
 
         try:
-            page = Page.objects.filter(sites=settings.SITE,
+            page = Page.objects.filter(sites=site_settings.SITE,
                                        status=Page.PRODUCTION,
                                        page_type=self.page_type)[0]
         except IndexError:
@@ -28,6 +28,8 @@ from registration import signals as custom_signals
 from mymessages.models import Message, MessageInfo
 from universal.helpers import get_domain, send_email
 
+from seo.site_context import site_settings
+
 BAD_EMAIL = ['dropped', 'bounce']
 STOP_SENDING = ['unsubscribe', 'spamreport']
 DEACTIVE_TYPES_AND_NONE = ['none'] + BAD_EMAIL + STOP_SENDING
@@ -140,8 +142,8 @@ class CustomUserManager(BaseUserManager):
                 user_args['source'] = request_source
             elif last_microsite_source:
                 user_args['source'] = last_microsite_source
-            elif hasattr(settings, 'SITE') and settings.SITE:
-                user_args['source'] = settings.SITE.domain
+            elif hasattr(settings, 'SITE') and site_settings.SITE:
+                user_args['source'] = site_settings.SITE.domain
 
             user = self.model(**user_args)
             user.set_password(password)
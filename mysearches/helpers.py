@@ -1,4 +1,6 @@
+import hashlib
 import json
+import logging
 import urllib
 import urllib2
 from urlparse import urlparse, urlunparse, parse_qs, parse_qsl
@@ -8,11 +10,19 @@ import datetime
 from bs4 import BeautifulSoup
 from dateutil import parser as dateparser
 from django.conf import settings
+from django.core.cache import cache
+from django.template import TemplateDoesNotExist
+from django.template.loader import render_to_string
+from django.template.loaders import app_directories, filesystem
 from django.utils.encoding import smart_str, smart_unicode
+from django.utils.safestring import mark_safe
 
 from universal.helpers import get_domain
 
 
+logger = logging.getLogger(__name__)
+
+
 def update_url_if_protected(url, user):
     """
     Adds a key that bypasses authorization on protected sites
@@ -132,6 +142,55 @@ def get_json(json_url):
         return []
 
 
+def search_json_feed(feed_url):
+    """
+    Returns the jobs in the json feed of one of our sites, as get_json()
+    would, but by searching Solr for them directly instead of requesting
+    the feed from the site.
+
+    Inputs:
+    :feed_url:    URL of a json feed (.../feed/json?...)
+
+    Outputs:
+                    List of Python dictionaries, or None if :feed_url: isn't
+                    the json feed of one of our sites
+    """
+    from django.contrib.sites.models import Site
+    from django.core.urlresolvers import Resolver404, resolve
+    from django.http import QueryDict
+    from middleware import cached_site_bundle
+    from seo import helpers as seo_helpers
+    from seo.site_context import SiteContext, using_site_context
+
+    feed_parts = urlparse(feed_url)
+    try:
+        match = resolve(feed_parts.path or '/',
+                        urlconf='seo.urls.search_urls')
+    except Resolver404:
+        return None
+    if match.url_name != 'feed' or match.kwargs['feed_type'] != 'json':
+        return None
+
+    host = feed_parts.netloc
+    domain = host.split(':')[0]
+    try:
+        site_values = cached_site_bundle(domain)
+    except Site.DoesNotExist:
+        return None
+    # site_bundle() falls back to the default site for unknown domains.
+    if site_values['SITE'].domain != domain:
+        return None
+
+    params = QueryDict(feed_parts.query)
+    with using_site_context(SiteContext(**site_values)):
+        feed = seo_helpers.feed_jobs(match.kwargs['filter_path'], params)
+        jobs = seo_helpers.recent_jobs(feed['jobs'], feed['days_ago'])
+        jobs = jobs.values(*seo_helpers.FEED_ITEM_FIELDS)
+        offset = feed['offset']
+        jobs = jobs[offset:offset + feed['num_items']]
+        return json.loads(seo_helpers.make_json(jobs, host))
+
+
 def parse_feed(feed_url, frequency='W', num_items=100, offset=0,
                return_items=None, use_json=True, last_sent=None,
                ignore_dates=False):
@@ -188,7 +247,20 @@ def parse_feed(feed_url, frequency='W', num_items=100, offset=0,
 
     is_json = 'feed/json' in feed_url
     if is_json:
-        items = get_json(feed_url)
+        items = None
+        if getattr(settings, 'SAVED_SEARCH_SOLR_FEEDS', False):
+            items = search_json_feed(feed_url)
+        if items is None:
+            items = get_json(feed_url)
+        # The json feed provides company name, while the rss feed does not;
+        # only try retrieving companies if we're pulling the json feed. All
+        # companies have logos specified, but only members should have their
+        # logos shown
+        from seo.models import Company
+        companies = Company.objects.filter(
+            name__in=set(item.get('company') for item in items),
+            member=True)
+        companies = dict((company.name, company) for company in companies)
     else:
         rss_soup = get_rss_soup(feed_url)
         items = rss_soup.find_all('item')
@@ -198,19 +270,8 @@ def parse_feed(feed_url, frequency='W', num_items=100, offset=0,
             item['link'] = item.pop('url')
             item['pubdate'] = dateparser.parse(item.pop('date_new'))
             item_dict = item
-            from seo.models import Company
-            try:
-                # The json feed provides company name, while the rss feed does
-                # not; only try retrieving a company if we're pulling the
-                # json feed
-                company = Company.objects.get(name=item_dict['company'])
-            except Company.DoesNotExist:
-                pass
-            else:
-                if company.member:
-                    # All companies have logos specified, but only members
-                    # should have their logos shown
-                    item_dict['company'] = company
+            if item_dict.get('company') in companies:
+                item_dict['company'] = companies[item_dict['company']]
         else:
             item_dict = {}
             item_dict['title'] = item.findChild('title').text
@@ -232,6 +293,88 @@ def parse_feed(feed_url, frequency='W', num_items=100, offset=0,
     return item_list, len(item_list)
 
 
+def normalize_feed_url(feed_url):
+    """
+    Normalizes a feed url so that urls for the same feed compare equal: the
+    scheme and host are lowercased and the query string is sorted.
+
+    """
+    feed_parts = urlparse(smart_str(feed_url))
+    query = sorted(parse_qsl(feed_parts.query, keep_blank_values=True))
+    feed_parts = feed_parts._replace(scheme=feed_parts.scheme.lower(),
+                                     netloc=feed_parts.netloc.lower(),
+                                     query=urlencode(query))
+    return smart_unicode(urlunparse(feed_parts))
+
+
+def feed_query_key(query):
+    """
+    Returns a key identifying the results of a parse_feed() query, given its
+    arguments (see SavedSearch.feed_query). Queries with the same key
+    return the same jobs.
+
+    parse_feed() only uses the date of :last_sent:, so searches last sent on
+    the same day share a key.
+    """
+    last_sent = query.get('last_sent')
+    return (normalize_feed_url(query['feed_url']),
+            query.get('frequency', 'W'),
+            query.get('num_items', 100),
+            query.get('return_items'),
+            last_sent.date() if last_sent is not None else None,
+            query.get('ignore_dates', False))
+
+
+def plan_feed_queries(searches):
+    """
+    Retrieves the jobs for each of :searches:, parsing each distinct feed
+    query (see feed_query_key) only once.
+
+    Queries that fail, for whatever reason, aren't retried here; their
+    searches are left out of the results so that they're retried (and
+    disabled if need be) when their email is sent.
+
+    Inputs:
+    :searches: SavedSearch instances
+
+    Outputs:
+    :tuple: First index is the jobs for each search, {search pk: (items,
+                count)}, suitable for SavedSearch.get_feed_items
+            Second index is a report, {'searches': number of searches,
+                'queries': number of distinct queries, 'failed': number of
+                queries that failed}
+    """
+    groups = {}
+    queries = {}
+    for search in searches:
+        query = search.feed_query()
+        key = feed_query_key(query)
+        queries.setdefault(key, query)
+        groups.setdefault(key, set()).add(search.pk)
+
+    feed_items = {}
+    failed = 0
+    for key, query in queries.items():
+        try:
+            result = parse_feed(**query)
+        except Exception:
+            # Whatever went wrong, the emails for these searches retrieve
+            # their jobs themselves, with the usual retry handling.
+            logger.exception("Couldn't retrieve the jobs for %s",
+                             query['feed_url'])
+            failed += 1
+            continue
+        for pk in groups[key]:
+            feed_items[pk] = result
+
+    report = {
+        'searches': sum(len(pks) for pks in groups.values()),
+        'queries': len(queries),
+        'failed': failed,
+    }
+    return feed_items, report
+
+
 def date_in_range(start, end, x):
     return start <= x <= end
 
@@ -276,3 +419,56 @@ def get_interval_from_frequency(frequency):
                  'W': -7,
                  'M': -30}
     return intervals.get(frequency, -1)
+
+
+JOB_ROW_TEMPLATE = 'mysearches/email_job_row.html'
+_template_revisions = {}
+
+
+def template_revision(template_name):
+    """
+    Returns a short hash of the source of :template_name:, which changes
+    whenever the template does.
+
+    """
+    if template_name not in _template_revisions:
+        source = ''
+        for loader in [filesystem.Loader(), app_directories.Loader()]:
+            try:
+                source, _ = loader.load_template_source(template_name)
+            except TemplateDoesNotExist:
+                continue
+            break
+        _template_revisions[template_name] = hashlib.md5(
+            smart_str(source)).hexdigest()[:8]
+    return _template_revisions[template_name]
+
+
+def render_job_row(item):
+    """
+    Renders the rows for one job in a saved search email.
+
+    A job's rows are the same in every email it's sent in, so they're
+    cached by the job's guid, for settings.SAVED_SEARCH_JOB_ROW_CACHE_TIMEOUT
+    seconds. The key also covers the parts that can differ between emails
+    (the link, which partner saved searches add parameters to, and whether
+    the job is new) and the revision of the template.
+
+    Inputs:
+    :item: A job, as returned by parse_feed()
+
+    Outputs:
+    :rows: The rendered rows
+    """
+    job = hashlib.md5(smart_str(item.get('guid') or item.get('link')))
+    variant = hashlib.md5(smart_str(u'%s|%s' % (item.get('link'),
+                                                 bool(item.get('new')))))
+    key = 'email_job_row:%s:%s:%s' % (template_revision(JOB_ROW_TEMPLATE),
+                                      job.hexdigest(), variant.hexdigest())
+    rows = cache.get(key)
+    if rows is None:
+        rows = render_to_string(JOB_ROW_TEMPLATE, {'item': item})
+        cache.set(key, rows,
+                  getattr(settings, 'SAVED_SEARCH_JOB_ROW_CACHE_TIMEOUT',
+                          60 * 60 * 6))
+    return mark_safe(rows)
@@ -1,3 +1,4 @@
+import copy
 from datetime import datetime
 from django.contrib.contenttypes.models import ContentType
 from pynliner import Pynliner
@@ -125,7 +126,12 @@ class SavedSearch(models.Model):
             if choice[0] == self.day_of_week:
                 return choice[1]
 
-    def get_feed_items(self, num_items=None):
+    def feed_query(self, num_items=None):
+        """
+        Returns the arguments get_feed_items() passes to parse_feed() to
+        retrieve this search's jobs.
+
+        """
         num_items = num_items or self.jobs_per_email
         url_of_feed = url_sort_options(self.feed, self.sort_by, self.frequency,
                                        hasattr(self, 'partnersavedsearch'))
@@ -139,11 +145,29 @@ class SavedSearch(models.Model):
         }
         if hasattr(self, 'partnersavedsearch'):
             parse_feed_args['ignore_dates'] = True
-        items = parse_feed(**parse_feed_args)
+        return parse_feed_args
+
+    def get_feed_items(self, num_items=None, feed_items=None):
+        """
+        Inputs:
+        :num_items: Number of jobs to retrieve; Default: jobs_per_email
+        :feed_items: Jobs already retrieved for saved searches, keyed by
+            saved search pk (see mysearches.helpers.plan_feed_queries); used
+            instead of parsing the feed if this search is in it
+
+        Outputs:
+        :tuple: The jobs and the job count, as returned by parse_feed()
+        """
+        if num_items is None and feed_items and self.pk in feed_items:
+            items, count = feed_items[self.pk]
+            # Several searches can share the same items, and sending an
+            # email can modify them.
+            return copy.deepcopy(items), count
+        items = parse_feed(**self.feed_query(num_items))
         return items
 
     def send_email(self, custom_msg=None, additional_categories=None,
-                   additional_headers=None):
+                   additional_headers=None, feed_items=None):
         log_kwargs = {
             'was_sent': False,
             'was_received': False,
@@ -154,7 +178,7 @@ class SavedSearch(models.Model):
             'uuid': uuid.uuid4().hex
         }
         if self.user.can_receive_myjobs_email():
-            items, count = self.get_feed_items()
+            items, count = self.get_feed_items(feed_items=feed_items)
             is_pss = hasattr(self, 'partnersavedsearch')
             if items or is_pss:
                 log_kwargs['was_sent'] = True
@@ -413,7 +437,7 @@ class SavedSearchDigest(models.Model):
                 SavedSearchDigest).pk
         return CONTENT_TYPES['ssd']
 
-    def send_email(self, custom_msg=None):
+    def send_email(self, custom_msg=None, feed_items=None):
         log_kwargs = {
             'was_sent': False,
             'was_received': False,
@@ -428,7 +452,7 @@ class SavedSearchDigest(models.Model):
         search_list = []
         contains_pss = False
         for search in saved_searches:
-            items, count = search.get_feed_items()
+            items, count = search.get_feed_items(feed_items=feed_items)
             total_jobs += count
             pss = None
             if hasattr(search, 'partnersavedsearch'):
@@ -1,6 +1,7 @@
 from django import template
 from django.core.urlresolvers import reverse
 
+from mysearches.helpers import render_job_row
 from registration.models import ActivationProfile
 from universal.helpers import update_url_param
 
@@ -17,6 +18,15 @@ def make_verbose_frequency(value):
         return 'Monthly'
 
 
+@register.simple_tag
+def email_job_row(item):
+    """
+    Renders the rows for one job in a saved search email; see
+    mysearches.helpers.render_job_row.
+    """
+    return render_job_row(item)
+
+
 @register.filter(name='time_created')
 def time_created(savedsearch):
     return savedsearch.created_on.strftime('%A, %B %d, %Y %l:%M %p')
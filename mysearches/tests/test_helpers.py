@@ -4,17 +4,20 @@ from urlparse import urlparse, parse_qs
 
 from django.conf import settings
 from django.contrib.auth.models import Group
+from django.core.cache import get_cache
 
-from mock import patch
+from mock import Mock, patch
 
 from myjobs.tests.setup import MyJobsBase
 from mysearches.models import SavedSearch
-from mysearches.helpers import (date_in_range, parse_feed,
+from mysearches.helpers import (date_in_range, parse_feed, render_job_row,
                                 update_url_if_protected, url_sort_options,
                                 validate_dotjobs_url)
 
 from mysearches.tests.helpers import return_file
 from myjobs.tests.factories import UserFactory
+from seo.tests.factories import CompanyFactory
+from seo.tests.solr_settings import SOLR_FIXTURE
 
 
 class SavedSearchHelperTests(MyJobsBase):
@@ -104,6 +107,61 @@ class SavedSearchHelperTests(MyJobsBase):
         items, count = parse_feed(feed_url, num_items=num_items)
         self.assertEqual(count, num_items)
 
+    def test_parse_feed_from_solr(self):
+        """
+        With SAVED_SEARCH_SOLR_FEEDS on, the json feed of one of our sites
+        is searched for in Solr rather than requested, while the feeds of
+        other sites still are.
+
+        """
+        from mydashboard.tests.factories import SeoSiteFactory
+        site = SeoSiteFactory()
+        company = CompanyFactory(name=SOLR_FIXTURE[1]['company'])
+        self.ms_solr.add(SOLR_FIXTURE)
+
+        feed_url = 'http://%s/jobs/feed/rss?date_sort=False' % site.domain
+        with self.settings(SAVED_SEARCH_SOLR_FEEDS=True):
+            with patch('urllib2.urlopen', Mock(side_effect=AssertionError)):
+                items, count = parse_feed(feed_url)
+            self.assertEqual(count, len(SOLR_FIXTURE))
+            self.assertEqual(sorted(item['title'] for item in items),
+                             sorted(job['title'] for job in SOLR_FIXTURE))
+            for item in items:
+                self.assertTrue(item['link'].startswith(
+                    'http://%s/' % site.domain))
+                self.assertTrue(item['pubdate'])
+            # Member companies are looked up, as for a requested feed.
+            self.assertIn(company, [item['company'] for item in items])
+
+            items, count = parse_feed('http://www.my.jobs/feed/rss')
+            self.assertEqual(count, 2)
+
+    def test_render_job_row(self):
+        """
+        A job's rows are rendered once and then reused for every email the
+        job is in, unless the email changes the job's link or marks it new.
+
+        """
+        items, _ = parse_feed('http://www.my.jobs/jobs/feed/json',
+                              frequency='D')
+        item = items[0]
+        cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        with patch('mysearches.helpers.cache', cache):
+            rows = render_job_row(item)
+            self.assertIn(item['title'], rows)
+            self.assertIn(item['link'], rows)
+
+            with patch('mysearches.helpers.render_to_string') as render:
+                self.assertEqual(render_job_row(dict(item)), rows)
+                self.assertFalse(render.called)
+
+            new_rows = render_job_row(dict(item, new=True))
+            self.assertIn('New!', new_rows)
+            self.assertNotIn('New!', rows)
+
+            link = item['link'] + '?z=1'
+            self.assertIn(link, render_job_row(dict(item, link=link)))
+
     def test_url_sort_options(self):
         feed = 'http://www.my.jobs/jobs/feed/rss?date_sort=False'
 
@@ -1,9 +1,11 @@
 from celery.exceptions import RetryTaskError
 import datetime
 import re
+import socket
 
 from django.conf import settings
 from django.core import mail
+from django.core.mail import get_connection
 
 from bs4 import BeautifulSoup
 from mock import patch, Mock
@@ -23,7 +25,7 @@ from mysearches.tests.factories import (SavedSearchFactory,
                                         PartnerSavedSearchFactory)
 from mysearches.tests.test_helpers import return_file
 from registration.models import ActivationProfile, Invitation
-from tasks import send_search_digests
+from tasks import send_search_batch, send_search_digests
 
 
 class SavedSearchModelsTests(MyJobsBase):
@@ -109,6 +111,103 @@ class SavedSearchModelsTests(MyJobsBase):
         send_search_digests()
         self.assertEqual(len(mail.outbox), 1)
     
+    def test_send_search_digests_planned(self):
+        """
+        With SAVED_SEARCH_PLAN_DIGESTS, identical saved searches in a batch
+        are only retrieved once, however many users saved them.
+
+        """
+        other_user = UserFactory(email='bob@example.com')
+        digest_user = UserFactory(email='carol@example.com')
+        SavedSearchDigestFactory(user=self.user, is_active=False)
+        SavedSearchDigestFactory(user=other_user, email=other_user.email,
+                                 is_active=False)
+        SavedSearchDigestFactory(user=digest_user, email=digest_user.email)
+        for user in [self.user, other_user, digest_user]:
+            SavedSearchFactory(user=user, email=user.email, frequency='D')
+
+        with self.settings(SAVED_SEARCH_PLAN_DIGESTS=True):
+            with patch('urllib2.urlopen',
+                       Mock(side_effect=return_file())) as urlopen:
+                send_search_digests()
+        # Once for the batch of searches and once for the batch of digests.
+        self.assertEqual(urlopen.call_count, 2)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertItemsEqual([email.to[0] for email in mail.outbox],
+                              [self.user.email, other_user.email,
+                               digest_user.email])
+        self.assertEqual(SavedSearchLog.objects.filter(was_sent=True).count(),
+                         3)
+        for email in mail.outbox:
+            self.assertTrue("table" in email.body)
+
+    def test_send_search_digests_in_batches(self):
+        SavedSearchDigestFactory(user=self.user, is_active=False)
+        for x in range(3):
+            SavedSearchFactory(user=self.user, frequency='D',
+                               url='www.my.jobs/jobs?q=search+%s' % x)
+
+        with self.settings(SAVED_SEARCH_BATCH_SIZE=2):
+            with patch('tasks.chord') as chord:
+                send_search_digests()
+        batches = chord.call_args[0][0]
+        self.assertEqual([batch.args[0] for batch in batches],
+                         ['search', 'search'])
+        self.assertEqual([len(batch.args[1]) for batch in batches], [2, 1])
+
+    def test_send_search_batch_rate(self):
+        searches = [SavedSearchFactory(user=self.user, frequency='D')
+                    for x in range(3)]
+
+        with self.settings(SAVED_SEARCH_SEND_RATE=10):
+            with patch('tasks.time') as mock_time:
+                mock_time.time.return_value = 0
+                timing = send_search_batch('search',
+                                           [search.pk for search in searches])
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(timing['emails'], 3)
+        self.assertEqual(timing['failed'], 0)
+        # Each email waits until it's due at 10 emails per second.
+        self.assertEqual([call[0][0] for call in
+                          mock_time.sleep.call_args_list], [0.1, 0.2, 0.3])
+
+    def test_send_search_batch_bad_feed(self):
+        """
+        A feed that fails while the batch is planned only affects its own
+        email, which is handed to send_search_digest to be retried.
+
+        """
+        good = SavedSearchFactory(user=self.user, frequency='D')
+        bad = SavedSearchFactory(user=self.user, frequency='D',
+                                 feed='http://timeout.jobs/feed/rss')
+        feed = return_file()
+
+        def urlopen(url, *args, **kwargs):
+            if 'timeout.jobs' in url:
+                raise socket.timeout('timed out')
+            return feed(url, *args, **kwargs)
+
+        with self.settings(SAVED_SEARCH_PLAN_DIGESTS=True):
+            with patch('urllib2.urlopen', urlopen):
+                with patch('tasks.send_search_digest.apply_async') as retry:
+                    timing = send_search_batch('search', [good.pk, bad.pk])
+        self.assertEqual(timing['failed'], 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].subject, good.label)
+        self.assertEqual(retry.call_count, 1)
+        self.assertEqual(retry.call_args[0][0][0].pk, bad.pk)
+
+    def test_send_search_batch_connections(self):
+        searches = [SavedSearchFactory(user=self.user, frequency='D')
+                    for x in range(3)]
+
+        with self.settings(SAVED_SEARCH_EMAILS_PER_CONNECTION=2):
+            with patch('universal.helpers.get_connection',
+                       Mock(side_effect=get_connection)) as connection:
+                send_search_batch('search', [search.pk for search in searches])
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(connection.call_count, 2)
+
     def test_initial_email(self):
         search = SavedSearchFactory(user=self.user, is_active=False,
                                     url='www.my.jobs/search?q=new+search')
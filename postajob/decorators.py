@@ -1,10 +1,10 @@
 from functools import partial
-from django.conf import settings
 from universal.decorators import not_found_when, warn_when
+from seo.site_context import site_settings
 
 def site_misconfigured(request):
     try:
-        return not settings.SITE.canonical_company.has_packages
+        return not site_settings.SITE.canonical_company.has_packages
     except AttributeError:
         return True
 
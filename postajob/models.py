@@ -9,12 +9,13 @@ from django.contrib.contenttypes.models import ContentType
 from django.core.validators import MinValueValidator
 from django.db import models, DEFAULT_DB_ALIAS
 from django.db.models.query import QuerySet
-from django.db.models.signals import pre_delete
+from django.db.models.signals import m2m_changed, pre_delete
 from django.template.loader import render_to_string
 from django.utils.translation import ugettext_lazy as _
 
 from location_data import countries, all_regions, country_list, state_list
 from universal.helpers import send_email
+from seo.site_context import site_settings
 
 
 class BaseManagerMixin(object):
@@ -511,6 +512,27 @@ class SitePackage(Package):
         self.save()
 
 
+def on_sites_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Clears the cached site bundles (see MultiHostMiddleware), which include
+    each site's SITE_PACKAGES, of the sites a SitePackage was added to or
+    removed from.
+
+    """
+    from seo.models import SeoSite
+
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if reverse:
+        sites = SeoSite.objects.filter(pk=instance.pk)
+    elif action == 'pre_clear':
+        sites = instance.sites.all()
+    else:
+        sites = SeoSite.objects.filter(pk__in=pk_set or [])
+    SeoSite.clear_caches(list(sites))
+m2m_changed.connect(on_sites_changed, sender=SitePackage.sites.through)
+
+
 class PurchasedProduct(BaseModel):
     FILTER_BY_SITES_KWARGS = 'product__package__sitepackage__sites__in'
     EVENT_FIELDS = {'value': ['jobs_remaining', 'is_approved'],
@@ -813,7 +835,7 @@ class Request(BaseModel):
                 'requester': self.requesting_company().name,
             }
             body = render_to_string('postajob/request_email.html', data)
-            site = getattr(settings, 'SITE', None)
+            site = getattr(site_settings, 'SITE', None)
             headers = {
                 'X-SMTPAPI': '{"category": "Request Created (%s)"}' % self.pk
             }
@@ -995,7 +1017,7 @@ class Invoice(BaseModel):
         recipients = set(other_recipients + list(owner_admins))
         if recipients:
             body = render_to_string('postajob/invoice_email.html', data)
-            site = getattr(settings, 'SITE', None)
+            site = getattr(site_settings, 'SITE', None)
             headers = {
                 'X-SMTPAPI': '{"category": "Invoice sent (%s)"}' % self.pk
             }
@@ -1,7 +1,7 @@
 from django.template import Library
-from django.conf import settings
 
 from seo.models import SeoSite
+from seo.site_context import site_settings
 
 register = Library()
 
@@ -10,7 +10,7 @@ register = Library()
 def get_current_seosite(attr=None, str_func=None):
     """
     Gets the current seo site and optionally returns an attr of that site as a
-    string, which may have a str_func run on it. if settings.SITE is not an
+    string, which may have a str_func run on it. if site_settings.SITE is not an
     SeoSite object, the one for secure.my.jobs is returned instead.
 
     inputs:
@@ -23,7 +23,7 @@ def get_current_seosite(attr=None, str_func=None):
     'My.jobs' 
     """
 
-    seosite = getattr(settings, 'SITE') or SeoSite.objects.get(
+    seosite = getattr(site_settings, 'SITE') or SeoSite.objects.get(
         domain="secure.my.jobs")
 
     if attr:
@@ -23,6 +23,8 @@ from myprofile.forms import (InitialNameForm, InitialAddressForm,
                              InitialWorkForm)
 from registration.forms import CustomPasswordResetForm
 
+from seo.site_context import site_settings
+
 
 # New in Django 1.5. Class based template views for static pages
 class RegistrationComplete(TemplateView):
@@ -175,7 +177,7 @@ class DseoLogin(BlockView):
         """
         if request.user.is_authenticated() and request.user.is_staff:
             try:
-                page = Page.objects.filter(sites=settings.SITE,
+                page = Page.objects.filter(sites=site_settings.SITE,
                                            status=Page.STAGING,
                                            page_type=self.page_type)[0]
                 setattr(self, 'page', page)
@@ -184,7 +186,7 @@ class DseoLogin(BlockView):
                 pass
 
         try:
-            page = Page.objects.filter(sites=settings.SITE,
+            page = Page.objects.filter(sites=site_settings.SITE,
                                        status=Page.PRODUCTION,
                                        page_type=self.page_type)[0]
         except IndexError:
@@ -196,8 +198,8 @@ class DseoLogin(BlockView):
 def custom_password_reset(request):
     template = 'registration/%s/password_reset_form.html' % settings.PROJECT
     email_domain = 'my.jobs'
-    if getattr(settings, 'SITE', None):
-        email_domain = settings.SITE.email_domain
+    if getattr(site_settings, 'SITE', None):
+        email_domain = site_settings.SITE.email_domain
 
     from_email = settings.EMAIL_FORMATS[settings.FORGOTTEN_PASSWORD]['address']
     from_email = from_email.format(domain=email_domain.lower())
@@ -3,9 +3,10 @@ import hashlib
 from django.core.cache import cache
 from django.http import HttpRequest
 from django.utils.cache import get_cache_key
-from seo.helpers import get_jobs, get_solr_facet
+from seo.helpers import get_jobs, get_solr_facet, solr_facet_query
 
 from seo.models import Configuration
+from seo.site_context import site_settings
 from django.conf import settings
 
 # This module is currently a holding place for low-level caching that was
@@ -39,20 +40,41 @@ def site_item_key(item_key):
         :item_key: A string to uniquely identify the cached item within a site
 
     """
-    return "%s::%s" % (item_key, settings.SITE_ID)
+    return "%s::%s" % (item_key, site_settings.SITE_ID)
 
 
-def get_total_jobs_count():
-    """Returns the job count for the current site's default job view"""
+def get_total_jobs_count(sqs=None):
+    """
+    Returns the job count for the current site's default job view
+
+    Input:
+        :sqs: The queryset returned by prefetch_total_jobs_count(), if any.
+
+    """
     jobs_count_key = site_item_key('jobs_count')
     jobs_count = cache.get(jobs_count_key)
     if not jobs_count:
-        jobs_count = get_jobs(custom_facets=settings.DEFAULT_FACET,
-                              jsids=settings.SITE_BUIDS).count()
+        if sqs is None:
+            sqs = get_jobs(custom_facets=site_settings.DEFAULT_FACET,
+                           jsids=site_settings.SITE_BUIDS)
+        jobs_count = sqs.count()
         cache.set(jobs_count_key, jobs_count, MINUTES_TO_CACHE_JOB_DATA*60)
     return jobs_count
 
 
+def prefetch_total_jobs_count(fanout):
+    """
+    Adds the query behind get_total_jobs_count() to a SearchFanOut unless
+    the count is already cached. Returns the queryset to pass to
+    get_total_jobs_count(), or None.
+
+    """
+    if cache.get(site_item_key('jobs_count')):
+        return None
+    return fanout.count(get_jobs(custom_facets=site_settings.DEFAULT_FACET,
+                                 jsids=site_settings.SITE_BUIDS))
+
+
 def get_facet_count_key(filters=None, query_string=None):
     """
     Returns a unique key for the current site and filter path
@@ -66,24 +88,48 @@ def get_facet_count_key(filters=None, query_string=None):
 
     #We use a hash to ensure key length is under memcache's 250 character limit
     return "browsefacets::%s%s%s" % (
-        settings.SITE_ID,
+        site_settings.SITE_ID,
         hashlib.md5(unicode(filters)).hexdigest(),
         hashlib.md5(unicode(query_string)).hexdigest()
     )
 
 
-def get_custom_facets(request, filters=None, query_string=None):
+def get_custom_facets(request, filters=None, query_string=None, query=None):
+    """
+    Returns the custom facet counts for the current search.
+
+    Input:
+        :query: The query returned by prefetch_custom_facets(), if any.
+
+    """
     custom_facet_key = get_facet_count_key(filters, query_string)
     custom_facets = cache.get(custom_facet_key)
 
     if not custom_facets:
-        custom_facets = get_solr_facet(settings.SITE_BUIDS, filters=filters,
-                                       params=request.GET)
+        custom_facets = get_solr_facet(site_settings.SITE_BUIDS, filters=filters,
+                                       params=request.GET, query=query)
         cache.set(custom_facet_key, custom_facets)
 
     return custom_facets
 
 
+def prefetch_custom_facets(request, fanout, filters=None, query_string=None):
+    """
+    Adds the query behind get_custom_facets() to a SearchFanOut unless the
+    counts are already cached. Returns the query to pass to
+    get_custom_facets(), or None.
+
+    """
+    if cache.get(get_facet_count_key(filters, query_string)):
+        return None
+    query = solr_facet_query(site_settings.SITE_BUIDS, filters=filters,
+                             params=request.GET)
+    tagged_facets, sqs = query
+    if sqs is not None:
+        fanout.facet_counts(sqs)
+    return query
+
+
 def get_site_config(request):
     """
     Returns the currently active site configuration for the input request
@@ -15,6 +15,7 @@ from django.template import RequestContext
 from django.views.decorators.cache import cache_page
 
 from seo.cache import cache_page_prefix, get_site_config
+from seo.site_context import site_settings
 from myjobs.models import Ticket, User
 
 
@@ -26,16 +27,16 @@ def home_page_check(view_func):
             data_dict = {
                 'item_type': 'home',
                 'facet_blurb': False,
-                'site_name': settings.SITE_NAME,
-                'site_title': settings.SITE_TITLE,
-                'site_heading': settings.SITE_HEADING,
-                'site_tags': settings.SITE_TAGS,
-                'site_description': settings.SITE_DESCRIPTION,
+                'site_name': site_settings.SITE_NAME,
+                'site_title': site_settings.SITE_TITLE,
+                'site_heading': site_settings.SITE_HEADING,
+                'site_tags': site_settings.SITE_TAGS,
+                'site_description': site_settings.SITE_DESCRIPTION,
                 'host': str(request.META.get("HTTP_HOST", "localhost")),
                 'site_config': config,
                 'build_num': settings.BUILD,
                 'filters': {},
-                'view_source': settings.VIEW_SOURCE
+                'view_source': site_settings.VIEW_SOURCE
             }
 
             return render_to_response(config.home_page_template, data_dict,
@@ -48,10 +49,10 @@ def home_page_check(view_func):
 def protected_site(view_func):
     @wraps(view_func)
     def decorator(request, *args, **kwargs):
-        if settings.SITE_ID in settings.PROTECTED_SITES:
+        if site_settings.SITE_ID in settings.PROTECTED_SITES:
             if request.REQUEST.get('key') == settings.SEARCH_API_KEY:
                     return view_func(request, *args, **kwargs)
-            groups = settings.PROTECTED_SITES[settings.SITE_ID]
+            groups = settings.PROTECTED_SITES[site_settings.SITE_ID]
             if request.user.is_authenticated():
                 if list(set(groups) &
                         set(request.user.groups.values_list('id', flat=True))):
@@ -7,22 +7,28 @@ import operator
 from pysolr import SolrError
 import urllib
 from itertools import islice
+from StringIO import StringIO
 from urlparse import urljoin, urlparse, parse_qs, parse_qsl
 
 from django.conf import settings
 from django.shortcuts import redirect
 from django.template.defaultfilters import safe
+from django.utils.feedgenerator import Atom1Feed
 from django.utils.html import strip_tags
+from django.utils.xmlutils import SimplerXMLGenerator
 from haystack.backends.solr_backend import SolrSearchQuery
 from haystack.inputs import Raw
 from haystack.query import SQ, EmptySearchQuerySet
 from ordereddict import OrderedDict
 
 from seo_pysolr import Solr
-from seo.search_backend import DESearchQuerySet
+from seo.search_backend import (DESearchQuerySet, SearchFanOut,
+                                profiled_result_class)
 from seo.models import BusinessUnit, Company
 from seo.templatetags.seo_extras import facet_text, smart_truncate
 from seo.filters import FacetListWidget, CustomFacetListWidget
+from seo.site_context import (get_site_context, site_settings,
+                              using_site_context)
 from serializers import JSONExtraValuesSerializer
 from moc_coding.models import Moc
 from xmlparse import text_fields
@@ -50,9 +56,36 @@ search_fields = ['apply_info', 'city', 'company', 'company_canonical_microsite',
                  'location_exact', 'reqid', 'score', 'state',
                  'state_short', 'text', 'title', 'title_exact', 'uid']
 
+# The fields each kind of page reads from the jobs it gets from Solr, so
+# that it isn't sent every stored field of every job (the MOC and O*NET
+# lists, most of the slabs, content_hash, ...) only to throw most of them
+# away. See apply_field_profile().
+FIELD_PROFILES = {
+    # Job listings (and the breadbox built from their first job).
+    'listing': search_fields + ['title_slug'],
+    # The listing_items.html fragment returned by ajax_get_jobs.
+    'ajax_listing': ['city', 'company', 'company_canonical_microsite',
+                     'company_enhanced', 'company_slab', 'country',
+                     'country_short', 'date_new', 'description', 'guid',
+                     'highlighted', 'html_description', 'location', 'state',
+                     'state_short', 'text', 'title'],
+    # RSS, Atom, JSON and XML feeds, and their breadbox.
+    'feed': ['city', 'company', 'country', 'country_short', 'date_new',
+             'date_updated', 'description', 'guid', 'is_posted', 'location',
+             'reqid', 'state', 'state_short', 'title', 'title_slug', 'uid'],
+    'sitemap': ['title', 'location', 'uid', 'guid'],
+    'job_detail': ['apply_info', 'buid', 'city', 'city_slab', 'company',
+                   'company_canonical_microsite', 'company_slab', 'country',
+                   'country_short', 'country_slab', 'date_new',
+                   'date_updated', 'description', 'guid', 'html_description',
+                   'link', 'location', 'on_sites', 'reqid', 'state',
+                   'state_short', 'state_slab', 'title', 'title_slab',
+                   'title_slug', 'uid'],
+}
+
 
 def standard_facets_by_name_slug(name_slugs):
-    custom_facets = settings.STANDARD_FACET
+    custom_facets = site_settings.STANDARD_FACET
     return [facet for facet in custom_facets
             if facet.name_slug in name_slugs]
 
@@ -529,10 +562,28 @@ def get_bread_box_headings(filters=None, jobs=None):
     return bread_box_headings
 
 
+def apply_field_profile(sqs, profile):
+    """
+    Limits the fields Solr returns for the results of `sqs` to the ones in
+    FIELD_PROFILES[profile].
+
+    When settings.SOLR_FIELD_PROFILE_STRICT is on (as it is for the
+    tests), reading any other index field from one of the results raises
+    search_backend.FieldNotInProfile, so a template that starts using a
+    field has to add it to the profile.
+
+    """
+    fields = FIELD_PROFILES[profile]
+    sqs = sqs.fields(list(fields))
+    if getattr(settings, 'SOLR_FIELD_PROFILE_STRICT', False):
+        sqs = sqs.result_class(profiled_result_class(profile, fields))
+    return sqs
+
+
 def get_jobs(custom_facets=None, exclude_facets=None, jsids=None,
              default_sqs=None, filters={},  fields=None, facet_limit=250,
              facet_sort="count", facet_offset=None, mc=1,
-             sort_order='relevance'):
+             sort_order='relevance', profile='listing'):
     """
     Returns 3-tuple containing a DESearchQuerySet object, a set of facet
     counts that have been filtered, and a set of unfiltered facet counts.
@@ -550,6 +601,9 @@ def get_jobs(custom_facets=None, exclude_facets=None, jsids=None,
         :facet_sort: How to sort facets
         :facet_offset: offset into the facet list
         :mc: mincount - Smallest facet size to return
+        :fields: The fields to fetch for each job. Overrides `profile`.
+        :profile: The FIELD_PROFILES entry naming the fields to fetch for
+                  each job, or None to fetch all of them.
 
     """
     if default_sqs is not None:
@@ -559,7 +613,8 @@ def get_jobs(custom_facets=None, exclude_facets=None, jsids=None,
     sqs = sqs_apply_custom_facets(custom_facets, sqs, exclude_facets)
     sqs = _sqs_narrow_by_buid_and_site_package(sqs, buids=jsids)
     # Limit the retrieved results to only fields that are actually needed.
-    #sqs = sqs.fields(search_fields)
+    if profile and not fields:
+        sqs = apply_field_profile(sqs, profile)
 
     sqs = sqs.order_by(sort_order_mapper.get(sort_order, '-score'))
 
@@ -641,7 +696,7 @@ def filter_sqs(sqs, filters):
                 t = t.split('/')[1]
             except IndexError:
                 pass
-            if settings.SITE_BUIDS:
+            if site_settings.SITE_BUIDS:
                 sqs = sqs.narrow("mapped_moc_exact:(%s)" % _clean(t))
             else:
                 sqs = sqs.narrow("moc_exact:(%s)" % _clean(t))
@@ -668,8 +723,8 @@ def get_featured_jobs(*args, **kwargs):
     with site featured facets if they exist
 
     """
-    if settings.FEATURED_FACET:
-        kwargs.update(custom_facets=settings.FEATURED_FACET)
+    if site_settings.FEATURED_FACET:
+        kwargs.update(custom_facets=site_settings.FEATURED_FACET)
         featured_jobs = get_jobs(*args, **kwargs)
     else:
         featured_jobs = EmptySearchQuerySet()
@@ -783,7 +838,7 @@ def sort_custom_facets_by_group(custom_facets):
     grouped_facets = {1: [], 2: [], 3: []}
 
     for facet, count in custom_facets:
-        cached_facets = getattr(settings, 'STANDARD_FACET', [])
+        cached_facets = getattr(site_settings, 'STANDARD_FACET', [])
         try:
             # Attempt to match the facet to a cached version, which
             # will have the facet_group already included.
@@ -810,7 +865,7 @@ def get_widgets(request, site_config, facet_counts, custom_facets,
     """
     filters = filters or {}
 
-    moc_field = 'mapped_moc' if settings.SITE_BUIDS else 'moc'
+    moc_field = 'mapped_moc' if site_settings.SITE_BUIDS else 'moc'
     if featured:
         types = [('featured', 1),
                  ('city', site_config.browse_city_order+1),
@@ -1019,7 +1074,7 @@ def prepare_sqs_from_search_params(params, sqs=None):
         # Before we can search for MOC, we have to find out if the SeoSite
         # has specified any custom MOC-Onet mappings. If they do, we'll search
         # on the jobs mapped_moc* fields
-        prefix = 'mapped_' if settings.SITE_BUIDS else ''
+        prefix = 'mapped_' if site_settings.SITE_BUIDS else ''
 
         if moc_id_val:
             moc_filt = SQ(**{'%smocid' % prefix: moc_id_val})
@@ -1042,10 +1097,10 @@ def _sqs_narrow_by_buid_and_site_package(sqs, buids=None, site_packages=None):
         :sqs: SearchQuerySet narrowed to documents with buids in list 'buids'.
     """
     if site_packages is None:
-        site_packages = settings.SITE_PACKAGES
+        site_packages = site_settings.SITE_PACKAGES
 
     if buids is None:
-        buids = settings.SITE_BUIDS
+        buids = site_settings.SITE_BUIDS
     if not buids:
         site_packages.append(0)
 
@@ -1157,12 +1212,175 @@ def create_businessunit(buid):
         return False
 
 
+# The fields of each job in a syndication feed.
+FEED_ITEM_FIELDS = ('city', 'company', 'country', 'country_short', 'date_new',
+                    'description', 'location', 'reqid', 'state', 'state_short',
+                    'title', 'uid', 'guid', 'is_posted')
+
+
+def feed_jobs(filter_path, params):
+    """
+    Returns the search for a syndication feed and the parameters it was
+    made with, as a dictionary of filters, jobs, num_items, offset and
+    days_ago, for the current site.
+
+    Inputs:
+    :filter_path: The slug path the feed url starts with, if any.
+    :params: The query string parameters of the feed url (a QueryDict).
+
+    """
+    filters = build_filter_dict(filter_path)
+    date_sort = 'True'
+    max_items, num_items, offset, days_ago = 1000, 500, 0, 0
+    if params:
+        sqs = prepare_sqs_from_search_params(params)
+        #Leave num_items and offset at defaults if they're not in QueryDict
+        date_sort = params.get(u'date_sort', date_sort)
+        try:
+            new_num_items = params.get(u'num_items')
+            num_items = int(new_num_items)
+        except (ValueError, TypeError, UnicodeEncodeError):
+            pass
+        try:
+            new_offset = params.get(u'offset', offset)
+            offset = int(new_offset)
+        except (ValueError, TypeError, UnicodeEncodeError):
+            pass
+        try:
+            new_days_ago = params.get(u'days_ago', days_ago)
+            days_ago = int(new_days_ago)
+        except (ValueError, TypeError, UnicodeEncodeError):
+            pass
+
+    else:
+        sqs = _sqs_narrow_by_buid_and_site_package(
+            sqs_apply_custom_facets(site_settings.DEFAULT_FACET))
+    sort_order = 'new' if date_sort == 'True' else 'relevance'
+    jobs = get_jobs(default_sqs=sqs,
+                    custom_facets=site_settings.DEFAULT_FACET,
+                    jsids=site_settings.SITE_BUIDS,
+                    filters=filters, sort_order=sort_order,
+                    profile='feed')
+
+    return {
+        'filters': filters,
+        'jobs': jobs,
+        'num_items': min(num_items, max_items),
+        'offset': offset,
+        'days_ago': days_ago,
+    }
+
+
+def recent_jobs(jobs, days_ago):
+    if days_ago:
+        now = datetime.datetime.utcnow()
+        start_date = now - datetime.timedelta(days=days_ago)
+        jobs = jobs.filter(date_new__gte=start_date)
+    return jobs
+
+
 def make_json(data, host):
     s = JSONExtraValuesSerializer(publisher_url="http://%s" % host)
     output = s.serialize(data)
     return output
 
 
+def make_json_chunks(chunks, host):
+    """
+    The streaming version of make_json(); yields the JSON for each of
+    `chunks` (see search_chunks()) in turn.
+
+    """
+    s = JSONExtraValuesSerializer(publisher_url="http://%s" % host)
+    return s.serialize_chunks(chunks)
+
+
+def search_chunks(sqs, start, stop, chunk_size):
+    """
+    Yields the results of `sqs` from `start` to `stop` a page of
+    `chunk_size` results at a time, each page from its own Solr request,
+    so that only one page is held in memory at once.
+
+    """
+    for chunk_start in xrange(start, stop, chunk_size):
+        yield sqs._clone()[chunk_start:min(chunk_start + chunk_size, stop)]
+
+
+def stream_feed(feed, obj, request, chunks):
+    """
+    Yields the RSS or Atom feed built by `feed` (a
+    django.contrib.syndication Feed, such as a JobFeed) for `obj` a chunk
+    of items at a time, taking its items from each of `chunks` in turn
+    instead of from `feed.items`.
+
+    The output is the same as writing the feed in one go, except that
+    the feed's lastBuildDate (or updated) comes from its first chunk.
+
+    The feed is written while the response is being sent, after the
+    request's site context stops being the current one, so each chunk is
+    written with the request's site context made current again.
+
+    """
+    context = getattr(request, 'site_context', None) or get_site_context()
+    return _in_site_context(context, _stream_feed(feed, obj, request,
+                                                  chunks))
+
+
+def _in_site_context(context, iterator):
+    """
+    Yields the values of `iterator`, with `context` as the current site
+    context only while each of them is being produced.
+
+    """
+    while True:
+        with using_site_context(context):
+            try:
+                value = next(iterator)
+            except StopIteration:
+                return
+        yield value
+
+
+def _stream_feed(feed, obj, request, chunks):
+    output = StringIO()
+    handler = SimplerXMLGenerator(output, 'utf-8')
+    chunks = iter(chunks)
+    feed.items = list(next(chunks, []))
+    generator = feed.get_feed(obj, request)
+    atom = isinstance(generator, Atom1Feed)
+
+    handler.startDocument()
+    if atom:
+        handler.startElement('feed', generator.root_attributes())
+    else:
+        handler.startElement('rss', generator.rss_attributes())
+        handler.startElement('channel', generator.root_attributes())
+    generator.add_root_elements(handler)
+    generator.write_items(handler)
+    yield _flush_xml(handler, output)
+
+    for items in chunks:
+        feed.items = list(items)
+        feed.get_feed(obj, request).write_items(handler)
+        yield _flush_xml(handler, output)
+
+    if atom:
+        handler.endElement('feed')
+    else:
+        generator.endChannelElement(handler)
+        handler.endElement('rss')
+    yield _flush_xml(handler, output)
+
+
+def _flush_xml(handler, output):
+    # The XML generator buffers its output until the end of a line.
+    handler._flush()
+    value = output.getvalue()
+    output.seek(0)
+    output.truncate()
+    return value
+
+
 def make_specialcommit_string(special_commits):
     """
     Build the site commitment string here instead of multiple times in the
@@ -1171,7 +1389,7 @@ def make_specialcommit_string(special_commits):
     [10-8-12 JPSOLE]
 
     Inputs:
-    :special_commits:      settings.COMMITMENTS.all() object
+    :special_commits:      site_settings.COMMITMENTS.all() object
 
     Returns:
     A space separated string of values in special_commits
@@ -1328,36 +1546,109 @@ def _build_facet_queries(custom_facets):
     return tagged_facets, sqs
 
 
+# Matches the jobs that haven't been tagged with the custom facets they
+# match (see import_jobs.tag_custom_facets).
+UNTAGGED_JOBS_QUERY = '*:* -custom_facets_tagged:true'
+
+
+def _build_facet_field(custom_facets):
+    """
+    The equivalent of _build_facet_queries() for custom facet counts taken
+    from the `custom_facets` field jobs are tagged with at import time
+    (see import_jobs.tag_custom_facets). The jobs that aren't tagged are
+    counted too, so that _untagged_facet_counts() knows whether to count
+    them separately.
+
+    """
+    tagged_facets = dict((facet.id, {'custom_facet': facet})
+                         for facet in custom_facets)
+    sqs = DESearchQuerySet().facet('custom_facets').facet_limit(-1)\
+                            .facet_mincount(1)\
+                            .query_facet(UNTAGGED_JOBS_QUERY)
+    return tagged_facets, sqs
+
+
+def _untagged_facet_counts(tagged_facets, sqs):
+    """
+    Counts the jobs matched by `sqs` that aren't tagged with custom facets
+    (such as post-a-job jobs, jobs loaded by add_jobs() and jobs imported
+    before tagging was turned on) with a facet.query per custom facet, as
+    _build_facet_queries() does for every job.
+
+    Returns a dictionary of {custom facet id: count}.
+
+    """
+    untagged = sqs._clone()
+    untagged.query.facets = {}
+    untagged.query.query_facets = []
+    untagged = untagged.narrow('-custom_facets_tagged:true')
+    facet_ids = {}
+    for facet_id, tagged_facet in tagged_facets.items():
+        query = tagged_facet['custom_facet'].saved_querystring
+        facet_ids.setdefault(query, []).append(facet_id)
+        untagged = untagged.query_facet(query)
+
+    counts = {}
+    query_counts = (untagged.facet_counts() or {}).get('queries', {})
+    for query, count in query_counts.iteritems():
+        for facet_id in facet_ids.get(query, []):
+            counts[facet_id] = count
+    return counts
+
+
 def _facet_query_result_counts(tagged_facets, sqs):
     """
     Map query results back to their originating CustomFacet instances.
 
     """
-    fields = ['django_ct', 'django_id', 'score', 'id']
-    sqs.query.fields = fields
-    sqs.query.end_offset = 0
     facet_results = sqs.facet_counts()
     if not facet_results:
         return []
 
+    if getattr(settings, 'CUSTOM_FACET_COUNTS_FROM_INDEX', False):
+        # Jobs are tagged with the custom facets of every site they're on,
+        # not just this one's.
+        field_counts = dict(
+            (int(facet_id), count) for facet_id, count in
+            facet_results.get('fields', {}).get('custom_facets', []))
+        if facet_results.get('queries', {}).get(UNTAGGED_JOBS_QUERY):
+            untagged_counts = _untagged_facet_counts(tagged_facets, sqs)
+        else:
+            untagged_counts = {}
+        results = [(facet_id, field_counts.get(facet_id, 0) +
+                    untagged_counts.get(facet_id, 0))
+                   for facet_id in tagged_facets]
+    else:
+        results = facet_results['queries'].iteritems()
+
     counts = []
-    for query, count in facet_results['queries'].iteritems():
-        tagged_facet = tagged_facets[query]['custom_facet']
+    for key, count in results:
+        tagged_facet = tagged_facets[key]['custom_facet']
         if count > 0 or tagged_facet.always_show:
             counts.append((tagged_facet, count))
     return counts
 
 
-def get_solr_facet(jsids, filters=None, params=None):
-    custom_facets = settings.STANDARD_FACET
+def solr_facet_query(jsids, filters=None, params=None):
+    """
+    Builds the query behind get_solr_facet() without running it.
+
+    Returns a 2-tuple of the tagged facets and the facet queryset, or
+    (None, None) if the site has no standard custom facets.
+
+    """
+    custom_facets = site_settings.STANDARD_FACET
 
     # Short-circuit the function if a site has facets turned on, but either
     # does not have any facets with `show_production` == 1 or has not yet
     # created any facets.
     if not custom_facets:
-        return []
+        return None, None
 
-    tagged_facets, sqs = _build_facet_queries(custom_facets)
+    if getattr(settings, 'CUSTOM_FACET_COUNTS_FROM_INDEX', False):
+        tagged_facets, sqs = _build_facet_field(custom_facets)
+    else:
+        tagged_facets, sqs = _build_facet_queries(custom_facets)
 
     # If this function is called from
     # seo.views.search_views.job_listing_by_slug_tag, it is passed the
@@ -1368,14 +1659,34 @@ def get_solr_facet(jsids, filters=None, params=None):
 
     # Intersect the CustomFacet object's query parameters with those of
     # the site's default facet, if it has one.
-    if settings.DEFAULT_FACET:
-        sqs = sqs_apply_custom_facets(settings.DEFAULT_FACET, sqs)
+    if site_settings.DEFAULT_FACET:
+        sqs = sqs_apply_custom_facets(site_settings.DEFAULT_FACET, sqs)
 
     sqs = _sqs_narrow_by_buid_and_site_package(sqs, buids=jsids)
 
     if params:
         sqs = prepare_sqs_from_search_params(params, sqs=sqs)
 
+    # Only the facet counts are needed.
+    sqs.query.fields = ['django_ct', 'django_id', 'score', 'id']
+    sqs.query.end_offset = 0
+    return tagged_facets, sqs
+
+
+def get_solr_facet(jsids, filters=None, params=None, query=None):
+    """
+    Returns a list of (custom facet, count) tuples for the site's standard
+    custom facets, ordered by count.
+
+    :query: The result of solr_facet_query(), if it was built (and perhaps
+            run) ahead of time.
+
+    """
+    tagged_facets, sqs = query or solr_facet_query(jsids, filters=filters,
+                                                   params=params)
+    if sqs is None:
+        return []
+
     result_counts = _facet_query_result_counts(tagged_facets, sqs)
     result_counts.sort(key=lambda x: -x[1])
     return result_counts
@@ -1396,17 +1707,29 @@ def add_text_to_job(job):
     return job
 
 
-def jobs_and_counts(request, filters, num_jobs):
+def jobs_and_counts(request, filters, num_jobs, fanout=None):
+    """
+    Returns the default jobs and featured jobs querysets for a search
+    results page, with their first `num_jobs` results already fetched, and
+    their combined facet counts.
+
+    Both querysets are fetched with a single grouped Solr request (see
+    search_backend.GroupedSearch) unless settings.GROUP_FEATURED_JOBS is
+    False, in which case they are sent at the same time. Pass in a
+    SearchFanOut to have any other queries added to it sent along with
+    them.
+
+    """
     sort_order = request.GET.get('sort', 'relevance')
 
     sqs = prepare_sqs_from_search_params(request.GET)
     default_jobs = get_jobs(default_sqs=sqs,
-                            custom_facets=settings.DEFAULT_FACET,
-                            exclude_facets=settings.FEATURED_FACET,
-                            jsids=settings.SITE_BUIDS, filters=filters,
+                            custom_facets=site_settings.DEFAULT_FACET,
+                            exclude_facets=site_settings.FEATURED_FACET,
+                            jsids=site_settings.SITE_BUIDS, filters=filters,
                             facet_limit=num_jobs, sort_order=sort_order)
     featured_jobs = get_featured_jobs(default_sqs=sqs, filters=filters,
-                                      jsids=settings.SITE_BUIDS,
+                                      jsids=site_settings.SITE_BUIDS,
                                       facet_limit=num_jobs,
                                       sort_order=sort_order)
 
@@ -1415,10 +1738,20 @@ def jobs_and_counts(request, filters, num_jobs):
     # anything using query results will be working with the same
     # exact version of the query results (and more importantly,
     # the query won't be re-run).
-    default_jobs[:num_jobs]
-    featured_jobs[:num_jobs]
+    if fanout is None:
+        fanout = SearchFanOut()
+    grouped = None
+    if getattr(settings, 'GROUP_FEATURED_JOBS', True):
+        grouped = fanout.grouped([default_jobs, featured_jobs], num_jobs)
+    else:
+        fanout.results(default_jobs, num_jobs)
+        fanout.results(featured_jobs, num_jobs)
+    fanout.run()
 
-    facet_counts = default_jobs.add_facet_count(featured_jobs).get('fields')
+    if grouped is not None:
+        facet_counts = grouped.facet_counts.get('fields')
+    else:
+        facet_counts = default_jobs.add_facet_count(featured_jobs).get('fields')
 
     return default_jobs, featured_jobs, facet_counts
 
@@ -0,0 +1,92 @@
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.runner import DiscoverRunner
+
+from seo.tests.benchmark import (Benchmark, Recording, SyntheticCorpus,
+                                 report, solr_backend)
+from seo_pysolr import Solr
+
+
+class Command(BaseCommand):
+    help = """
+           Benchmarks the search views (search results, ajax job listings
+           and facets, feeds, autocomplete and sitemaps) on a synthetic
+           multi-site corpus, and prints the p50/p95 latency and Solr
+           requests and SQL queries per page of each.
+
+           Sites are created in a test database. Jobs are added to the Solr
+           core at --solr-url and removed again afterwards; with --replay,
+           Solr responses recorded by an earlier --record run are used
+           instead and Solr isn't needed.
+
+           Pages are cached as usual, so run it with settings that use a
+           dummy cache to measure uncached pages.
+           """
+
+    option_list = BaseCommand.option_list + (
+        make_option("--solr-url", dest="solr_url",
+                    help="Solr core to index the synthetic jobs into"),
+        make_option("--sites", type="int", dest="sites", default=5,
+                    help="number of sites"),
+        make_option("--jobs", type="int", dest="jobs", default=200,
+                    help="number of jobs per site"),
+        make_option("--seed", type="int", dest="seed", default=0,
+                    help="seed for the synthetic jobs"),
+        make_option("--concurrency", type="int", dest="concurrency",
+                    default=4, help="number of threads making requests"),
+        make_option("--repeat", type="int", dest="repeat", default=10,
+                    help="number of times each page is requested"),
+        make_option("--view", action="append", dest="views", default=[],
+                    help="only benchmark this view (may be repeated)"),
+        make_option("--record", dest="record", metavar="FILE",
+                    help="record the Solr responses to FILE"),
+        make_option("--replay", dest="replay", metavar="FILE",
+                    help="answer Solr requests from the responses in FILE"),
+    )
+
+    def handle(self, *args, **options):
+        if options['record'] and options['replay']:
+            raise CommandError("--record and --replay can't be combined.")
+        if not options['solr_url'] and not options['replay']:
+            # The synthetic jobs are added to (and removed from) the core,
+            # so it has to be asked for explicitly.
+            raise CommandError("Please provide --solr-url or --replay.")
+        if 'middleware.SolrStatsMiddleware' not in settings.MIDDLEWARE_CLASSES:
+            raise CommandError("middleware.SolrStatsMiddleware is needed to "
+                               "count Solr requests.")
+
+        recording = None
+        if options['replay']:
+            recording = Recording(options['replay'], replay=True)
+        elif options['record']:
+            recording = Recording(options['record'])
+        solr_url = (options['solr_url'] or
+                    settings.HAYSTACK_CONNECTIONS['default']['URL'])
+
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        runner.setup_test_environment()
+        old_config = runner.setup_databases()
+        corpus = SyntheticCorpus(num_sites=options['sites'],
+                                 jobs_per_site=options['jobs'],
+                                 seed=options['seed'])
+        conn = Solr(solr_url)
+        try:
+            corpus.create_sites()
+            if not options['replay']:
+                self.stdout.write("Indexed %s jobs" % corpus.index(conn))
+            urls = [url for url in corpus.urls()
+                    if not options['views'] or url[0] in options['views']]
+            benchmark = Benchmark(urls, concurrency=options['concurrency'],
+                                  repeat=options['repeat'])
+            with solr_backend(solr_url, recording):
+                results = benchmark.run()
+            self.stdout.write(report(results))
+            if options['record']:
+                recording.save()
+        finally:
+            if not options['replay']:
+                corpus.clear(conn)
+            runner.teardown_databases(old_config)
+            runner.teardown_test_environment()
@@ -0,0 +1,57 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from import_pipeline import ImportPipeline
+
+
+class Command(BaseCommand):
+    args = "<buid buid ...>"
+    help = """
+           Imports the feed files for the given business units into Solr,
+           overlapping downloads, parsing and Solr posts, and prints the
+           throughput of each stage.
+           """
+
+    option_list = BaseCommand.option_list + (
+        make_option("--download-workers", type="int", dest="download_workers",
+                    help="number of threads downloading feed files"),
+        make_option("--parse-workers", type="int", dest="parse_workers",
+                    help="number of threads parsing feed files"),
+        make_option("--post-workers", type="int", dest="post_workers",
+                    help="number of threads posting documents to Solr"),
+        make_option("--queue-size", type="int", dest="queue_size",
+                    help="maximum number of items waiting between stages"),
+        make_option("--clear-cache", action="store_true", default=False,
+                    dest="clear_cache",
+                    help="clear each business unit's cache once imported"),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            buids = [int(buid) for buid in args]
+        except ValueError:
+            raise CommandError("BUIDs must be integers.")
+        if not buids:
+            raise CommandError("Please provide at least one BUID.")
+
+        pipeline = ImportPipeline(
+            download_workers=options['download_workers'],
+            parse_workers=options['parse_workers'],
+            post_workers=options['post_workers'],
+            queue_size=options['queue_size'],
+            clear_cache=options['clear_cache'])
+        results = pipeline.run(buids)
+
+        for buid in buids:
+            result = results.get(buid)
+            if isinstance(result, Exception):
+                self.stdout.write("%s: failed (%r)" % (buid, result))
+            elif result is None:
+                self.stdout.write("%s: not finished" % buid)
+            else:
+                self.stdout.write("%s: %s added/updated, %s deleted" %
+                                  (buid, result[0], result[1]))
+        self.stdout.write("Imported %s business units in %.1fs" %
+                          (len(buids), pipeline.elapsed))
+        self.stdout.write(pipeline.summary())
@@ -6,7 +6,7 @@ from django.contrib.auth.models import Group
 from django.contrib.contenttypes import generic
 from django.contrib.flatpages.models import FlatPage
 from django.contrib.sites.models import Site
-from django.contrib.syndication.views import Feed
+from django.contrib.syndication.views import Feed, add_domain
 from django.core.cache import cache
 from django.core.validators import MaxValueValidator, ValidationError
 from django.db import models
@@ -23,7 +23,9 @@ from taggit.managers import TaggableManager
 from moc_coding import models as moc_models
 from registration.models import Invitation
 from social_links import models as social_models
+from seo import solr_cache
 from seo.search_backend import DESearchQuerySet
+from seo.site_context import site_settings
 from myjobs.models import User
 from mypartners.models import Tag
 from universal.helpers import get_domain, get_object_or_none, has_mx_record
@@ -35,8 +37,8 @@ import decimal
 class JobsByBuidManager(models.Manager):
     def get_query_set(self):
         queryset = super(JobsByBuidManager, self).get_query_set()
-        if settings.SITE_BUIDS:
-            return queryset.filter(buid__in=settings.SITE_BUIDS)
+        if site_settings.SITE_BUIDS:
+            return queryset.filter(buid__in=site_settings.SITE_BUIDS)
         else:
             return queryset
 
@@ -44,13 +46,13 @@ class JobsByBuidManager(models.Manager):
 class ConfigBySiteManager(models.Manager):
     def get_query_set(self):
         return super(ConfigBySiteManager, self).get_query_set().filter(
-            seosite__id=settings.SITE_ID)
+            seosite__id=site_settings.SITE_ID)
 
 
 class GoogleAnalyticsBySiteManager(models.Manager):
     def get_query_set(self):
         return super(GoogleAnalyticsBySiteManager, self).get_query_set().filter(
-            seosite__id=settings.SITE_ID)
+            seosite__id=site_settings.SITE_ID)
 
 
 def term_splitter(terms):
@@ -159,7 +161,7 @@ class Redirect(models.Model):
 class CustomFacetQuerySet(QuerySet):
     def prod_facets_for_current_site(self):
         kwargs = {
-            'seositefacet__seosite__id': settings.SITE_ID,
+            'seositefacet__seosite__id': site_settings.SITE_ID,
             'show_production': 1,
         }
         return self.filter(**kwargs)
@@ -218,7 +220,7 @@ class CustomFacet(BaseSavedSearch):
         return '%s' % self.name
 
     def active_site_facet(self):
-        facets = self.seositefacet_set.filter(seosite__id=settings.SITE_ID)
+        facets = self.seositefacet_set.filter(seosite__id=site_settings.SITE_ID)
         return facets.first()
 
     def get_op(self):
@@ -376,6 +378,61 @@ def clear_page_cache(sender, **kwargs):
         config.save()
 
 
+@receiver(post_save, sender=CustomFacet)
+def retag_custom_facet_jobs(sender, instance, **kwargs):
+    """
+    Retags the jobs of the business units shown on the sites a custom facet
+    is a standard facet on, so that their custom facet tags (see
+    import_jobs.tag_custom_facets) reflect the facet's new query.
+
+    """
+    sites = SeoSite.objects.filter(
+        seositefacet__customfacet=instance,
+        seositefacet__facet_type=SeoSiteFacet.STANDARD)
+    update_custom_facet_tags(job_business_units(sites))
+
+
+def update_custom_facet_tags(buids):
+    if not getattr(settings, 'CUSTOM_FACET_COUNTS_FROM_INDEX', False):
+        return
+    # tasks imports this module.
+    from tasks import task_tag_custom_facets
+    for buid in buids:
+        task_tag_custom_facets.delay(buid, clear_cache=True)
+
+
+def job_sites(buid):
+    """
+    The sites that show the jobs of business unit `buid` (see
+    seo.helpers._sqs_narrow_by_buid_and_site_package): the sites it's on,
+    the sites with any of its site packages and, if it has no site packages
+    (so its jobs are on_sites:0), the sites that show every job.
+
+    """
+    packages = list(BusinessUnit.objects.get(id=buid).site_packages
+                                .values_list('pk', flat=True))
+    query = models.Q(business_units=buid)
+    if packages:
+        query |= models.Q(sitepackage__in=packages)
+    else:
+        query |= models.Q(business_units__isnull=True)
+    return SeoSite.objects.filter(query).distinct()
+
+
+def job_business_units(sites):
+    """
+    The ids of the business units whose jobs are shown on any of `sites`,
+    a queryset of SeoSites; the reverse of job_sites().
+
+    """
+    query = (models.Q(seosite__in=sites) |
+             models.Q(site_packages__sites__in=sites))
+    if sites.filter(business_units__isnull=True).exists():
+        query |= models.Q(site_packages__isnull=True)
+    return BusinessUnit.objects.filter(query).values_list(
+        'id', flat=True).distinct()
+
+
 class jobListing (models.Model):
     def __unicode__(self):
         return self.title
@@ -565,7 +622,9 @@ class SeoSite(Site):
         site_cache_keys = ['%s:SeoSite' % site.domain for site in sites]
         buid_cache_keys = ['%s:buids' % key for key in site_cache_keys]
         social_cache_keys = ['%s:social_links' % site.domain for site in sites]
-        cache.delete_many(site_cache_keys + buid_cache_keys + social_cache_keys)
+        bundle_cache_keys = ['%s:site_bundle' % site.domain for site in sites]
+        cache.delete_many(site_cache_keys + buid_cache_keys +
+                          social_cache_keys + bundle_cache_keys)
 
 
     def email_domain_choices(self,):
@@ -637,6 +696,30 @@ class SeoSiteFacet(models.Model):
         verbose_name_plural = "Seo Site Facets"
 
 
+@receiver(post_save, sender=SeoSiteFacet)
+@receiver(pre_delete, sender=SeoSiteFacet)
+def clear_site_facet_cache(sender, **kwargs):
+    """
+    Clear the cached site bundle (see MultiHostMiddleware) of the site a
+    SeoSiteFacet belongs to when the facet changes.
+
+    """
+    obj = kwargs['instance']
+    SeoSite.clear_caches(SeoSite.objects.filter(pk=obj.seosite_id))
+
+
+@receiver(post_save, sender=SeoSiteFacet)
+def retag_site_facet_jobs(sender, instance, **kwargs):
+    """
+    Retags the jobs of the business units a site shows when a standard
+    facet is added to it; see retag_custom_facet_jobs().
+
+    """
+    if instance.facet_type == SeoSiteFacet.STANDARD:
+        update_custom_facet_tags(job_business_units(
+            SeoSite.objects.filter(pk=instance.seosite_id)))
+
+
 class Company(models.Model):
     """
     This model defines companies that come from various job sources (currently
@@ -765,7 +848,7 @@ class Company(models.Model):
     @property
     def has_packages(self):
         return self.sitepackage_set.filter(
-            sites__in=settings.SITE.postajob_site_list()).exists()
+            sites__in=site_settings.SITE.postajob_site_list()).exists()
 
 
 class FeaturedCompany(models.Model):
@@ -1024,6 +1107,10 @@ class Configuration(models.Model):
                                site in sites.all()])
             cache.delete_many(["jobs_count::%s" % site.pk for
                                site in  sites.all()])
+        # The site bundles cached by MultiHostMiddleware include the site's
+        # facets, which are edited alongside its configurations.
+        cache.delete_many(["%s:site_bundle" % site.domain for
+                           site in sites.all()])
 
     def clear_cache(self):
         self.clear_caches([self])
@@ -1222,10 +1309,30 @@ class GoogleAnalytics (models.Model):
 
 
 class JobFeed(Feed):
-    link = ""
-
-    def __init__(self, type):
+    def __init__(self, type, site=None):
         self.type = type
+        # The feed's links are made absolute here, so that Feed.get_feed()
+        # doesn't use the domain of get_current_site(), which reads the
+        # process-wide settings.SITE_ID. The site is looked up now, while
+        # the request's SiteContext is current, as streamed feeds are
+        # written after it's gone.
+        self.site = site or site_settings.SITE
+        self.secure = False
+        self.path = ''
+
+    def get_feed(self, obj, request):
+        self.secure = request.is_secure()
+        self.path = request.path
+        return super(JobFeed, self).get_feed(obj, request)
+
+    def absolute_url(self, url):
+        return add_domain(self.site.domain, url, self.secure)
+
+    def link(self):
+        return self.absolute_url('')
+
+    def feed_url(self):
+        return self.absolute_url(self.path)
 
     def item_title(self, item):
         # Creates a location description string from locations fields if
@@ -1244,11 +1351,11 @@ class JobFeed(Feed):
             # If an item is posted, instead of using the
             # redirect link we use the http://site.jobs/guid/jobs/ link
             # that goes directly to the microsite.
-            return "/%s/job/" % item['guid']
+            return self.absolute_url("/%s/job/" % item['guid'])
 
         else:
             vs = settings.FEED_VIEW_SOURCES.get(self.type, 20)
-            return '/%s%s' % (item['guid'], vs)
+            return self.absolute_url('/%s%s' % (item['guid'], vs))
 
     def item_pubdate(self, item):
         return item['date_new']
@@ -1291,10 +1398,15 @@ class BusinessUnit(models.Model):
 
     @staticmethod
     def clear_cache(buid):
-        """Clears the cache for related sites."""
+        """
+        Clears the cache for related sites, and the cached Solr results
+        for the business unit's jobs.
+
+        """
         sites = SeoSite.objects.filter(business_units=buid).exclude(
             site_tags__site_tag='network')
         SeoSite.clear_caches(sites)
+        solr_cache.invalidate_buids([buid])
 
 
 class Country(models.Model):
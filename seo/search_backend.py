@@ -1,15 +1,22 @@
+import functools
 import operator
+import sys
+import threading
 
+from haystack import connections
 from haystack.backends import log_query, EmptyResults, SQ
 from haystack.backends.solr_backend import SolrEngine, SolrSearchQuery
 from haystack.backends.solr_backend import SolrSearchBackend
 from haystack.constants import ID, DJANGO_CT
+from haystack.models import SearchResult
 from haystack.query import SearchQuerySet
 from haystack.utils import IDENTIFIER_REGEX
 from django.conf import settings
 
-from pysolr import SolrError
+from pysolr import Results, SolrError
+from seo.solr_cache import SolrResultCache
 from seo_pysolr import Solr
+import solr_stats
 
 
 class DESearchQuerySet(SearchQuerySet):
@@ -168,6 +175,204 @@ class DESearchQuerySet(SearchQuerySet):
         return clone
 
 
+class SearchFanOut(object):
+    """
+    Evaluates independent DESearchQuerySets concurrently, so a page that
+    needs several of them waits about as long as the slowest one instead
+    of the sum of all of them.
+
+    Querysets are added with results(), count() or facet_counts(), which
+    return the queryset unchanged, and are all sent to Solr by run(). Each
+    is evaluated on its own thread through the backend's shared pysolr
+    connection (and its requests connection pool), and run() returns once
+    all of them are done. Afterwards the results are cached on the
+    querysets themselves, so slicing, count() and facet_counts() don't
+    query Solr again.
+
+    Only the Solr request runs on the other threads, so querysets should be
+    fully built (including anything that needs the database) before they
+    are added.
+
+    Usage:
+        fanout = SearchFanOut()
+        default_jobs = fanout.results(default_jobs, 20)
+        total_jobs = fanout.count(total_jobs)
+        fanout.run()
+
+    """
+    def __init__(self):
+        self.pending = []
+
+    def results(self, sqs, end):
+        """Fetches the first `end` results of `sqs`."""
+        self.pending.append(functools.partial(operator.getitem, sqs,
+                                              slice(0, end)))
+        return sqs
+
+    def count(self, sqs):
+        """Fetches the number of results for `sqs`."""
+        self.pending.append(sqs.count)
+        return sqs
+
+    def facet_counts(self, sqs):
+        """Fetches the facet counts for `sqs`."""
+        self.pending.append(sqs.facet_counts)
+        return sqs
+
+    def grouped(self, querysets, end):
+        """
+        Fetches the first `end` results of each of `querysets` in a single
+        request if they can be combined (see GroupedSearch), or separately
+        if they can't.
+
+        Returns the GroupedSearch, whose facet_counts are set by run(), or
+        None if the querysets weren't combined. If `end` is 0, the facet
+        counts of querysets that weren't combined are fetched instead, so
+        they can be read from each of them without querying Solr again.
+
+        """
+        search = GroupedSearch(querysets, end)
+        if not search.combinable:
+            for sqs in querysets:
+                if end:
+                    self.results(sqs, end)
+                else:
+                    sqs.query.set_limits(0, 0)
+                    self.facet_counts(sqs)
+            return None
+        self.pending.append(search.run)
+        return search
+
+    def run(self):
+        """
+        Evaluates every queryset added since the last call, re-raising the
+        first exception any of them raised once all of them are done.
+
+        """
+        pending, self.pending = self.pending, []
+        errors = []
+        stats = solr_stats.current()
+        threads = [threading.Thread(target=self._evaluate,
+                                    args=(evaluate, errors, stats))
+                   for evaluate in pending[1:]]
+        for thread in threads:
+            thread.start()
+        # The current thread would only be waiting, so it takes the first.
+        if pending:
+            self._evaluate(pending[0], errors, stats)
+        for thread in threads:
+            thread.join()
+        if errors:
+            exc_type, exc_value, exc_traceback = errors[0]
+            raise exc_type, exc_value, exc_traceback
+
+    @staticmethod
+    def _evaluate(evaluate, errors, stats):
+        try:
+            # Count the request against the view that made it.
+            with solr_stats.collecting(stats):
+                evaluate()
+        except Exception:
+            errors.append(sys.exc_info())
+
+
+class GroupedSearch(object):
+    """
+    Fetches the first results of several DESearchQuerySets that differ
+    only in their narrow queries (such as a site's default and featured
+    jobs) with one Solr request instead of one each.
+
+    The request is the querysets' shared search narrowed to documents
+    matching any of them, with a result group (Solr's group.query) for
+    each queryset's own narrow queries. Each queryset's results and count
+    are cached on it as if it had been sliced. facet_counts is set to the
+    facet counts of the combined search, which are the sums of the
+    querysets' individual facet counts as long as no document matches
+    more than one of them.
+
+    """
+    def __init__(self, querysets, end):
+        self.querysets = querysets
+        self.end = end
+        self.facet_counts = None
+        self.search = self._build_search()
+
+    @property
+    def combinable(self):
+        return self.search is not None
+
+    def _build_search(self):
+        """
+        Returns the (query string, group queries, search kwargs) for the
+        combined request, or None if the querysets can't be combined.
+
+        """
+        if len(self.querysets) < 2:
+            return None
+        for sqs in self.querysets:
+            if not isinstance(sqs, DESearchQuerySet) or sqs._result_cache:
+                return None
+            if (getattr(sqs.query, '_more_like_this', False) or
+                    getattr(sqs.query, '_raw_query', None)):
+                return None
+
+        query_strings = set()
+        params = []
+        narrow_queries = []
+        for sqs in self.querysets:
+            query = sqs.query._clone()
+            query.set_limits(0, self.end)
+            query_strings.add(query.build_query())
+            query_params = query.build_params()
+            narrow_queries.append(set(query_params.pop('narrow_queries', None)
+                                      or []))
+            params.append(query_params)
+        if len(query_strings) > 1 or params.count(params[0]) < len(params):
+            return None
+
+        shared = set.intersection(*narrow_queries)
+        group_queries = [self.group_query(narrow - shared)
+                         for narrow in narrow_queries]
+        if len(set(group_queries)) < len(group_queries):
+            return None
+        kwargs = dict(params[0], narrow_queries=shared)
+        return query_strings.pop(), group_queries, kwargs
+
+    @staticmethod
+    def group_query(narrow_queries):
+        """
+        ANDs narrow queries together. Narrow queries can be pure negative
+        (see DESearchQuerySet.narrow_exclude()), which Solr only accepts at
+        the top level of a query, so those are subtracted from *:*.
+
+        """
+        if not narrow_queries:
+            return '*:*'
+        clauses = []
+        for narrow_query in sorted(narrow_queries):
+            if narrow_query.startswith('NOT '):
+                clauses.append('(*:* %s)' % narrow_query)
+            else:
+                clauses.append('(%s)' % narrow_query)
+        return ' AND '.join(clauses)
+
+    def run(self):
+        query_string, group_queries, kwargs = self.search
+        backend = self.querysets[0].query.backend
+        results = backend.grouped_search(query_string, group_queries,
+                                         **kwargs)
+        for sqs, group_query in zip(self.querysets, group_queries):
+            group = results['groups'][group_query]
+            # The same state SearchQuerySet._fill_cache() leaves behind.
+            sqs.query._results = group['results']
+            sqs.query._hit_count = group['hits']
+            sqs._result_cache = [None] * group['hits']
+            to_cache = sqs.post_process_results(group['results'])
+            sqs._result_cache[:len(to_cache)] = to_cache
+        self.facet_counts = self.querysets[0].query.post_process_facets(
+            results)
+
+
 class DESolrSearchQuery(SolrSearchQuery):
     search_parameters = []
 
@@ -261,6 +466,53 @@ class DESolrSearchQuery(SolrSearchQuery):
         self.query_facets.append(query)
 
 
+class FieldNotInProfile(Exception):
+    """
+    Raised by ProfiledSearchResult when an index field that wasn't fetched
+    is read from a result. Deliberately not an AttributeError, which
+    templates and getattr() with a default would swallow.
+
+    """
+
+
+class ProfiledSearchResult(SearchResult):
+    """
+    A result of a search that only fetched the fields in `profile_fields`
+    from Solr (see seo.helpers.apply_field_profile). Reading any other
+    index field raises FieldNotInProfile instead of quietly returning None.
+
+    """
+    profile = None
+    profile_fields = frozenset()
+
+    def __getattr__(self, attr):
+        if attr not in self.profile_fields and attr in index_fields():
+            raise FieldNotInProfile("'%s' isn't in the '%s' field profile" %
+                                    (attr, self.profile))
+        return super(ProfiledSearchResult, self).__getattr__(attr)
+
+
+_profiled_result_classes = {}
+
+
+def index_fields():
+    return connections['default'].get_unified_index().all_searchfields()
+
+
+def profiled_result_class(profile, fields):
+    """
+    Returns a ProfiledSearchResult subclass for the field profile named
+    `profile`, which fetches `fields`.
+
+    """
+    key = (profile, frozenset(fields))
+    if key not in _profiled_result_classes:
+        _profiled_result_classes[key] = type(
+            'ProfiledSearchResult_%s' % profile, (ProfiledSearchResult,),
+            {'profile': profile, 'profile_fields': key[1]})
+    return _profiled_result_classes[key]
+
+
 class DESolrSearchBackend(SolrSearchBackend):
     def __init__(self, connection_alias, **connection_options):
         """
@@ -277,15 +529,10 @@ class DESolrSearchBackend(SolrSearchBackend):
                          timeout=self.timeout)
 
     @log_query
-    def search(self, query_string, sort_by=None, start_offset=0, end_offset=None,
-               fields='', highlight=False, facets=None, date_facets=None,
-               query_facets=None, narrow_queries=None, spelling_query=None,
-               within=None, dwithin=None, distance_point=None,
-               limit_to_registered_models=None, result_class=None,
-               facet_mincount=None, facet_limit=None, facet_prefix=None,
-               facet_sort=None, facet_offset=None, bf=None, **kwargs):
+    def search(self, query_string, **kwargs):
         """
-        Overrides both search() and build_search_kwargs().
+        Overrides both search() and build_search_kwargs(); see the latter
+        for the arguments.
 
         """
 
@@ -294,6 +541,95 @@ class DESolrSearchBackend(SolrSearchBackend):
                 'results': [],
                 'hits': 0,
             }
+        search_kwargs = self.build_search_kwargs(query_string, **kwargs)
+
+        params = dict(search_kwargs, q=query_string)
+        try:
+            with solr_stats.source('DESolrSearchBackend.search'):
+                raw_results = SolrResultCache().get(
+                    params,
+                    lambda: self.conn.search(query_string, **search_kwargs))
+        except (IOError, SolrError), e:
+            if not self.silently_fail:
+                raise
+
+            self.log.error("Failed to query Solr using '%s': %s", query_string, e)
+            raw_results = EmptyResults()
+
+        return self._process_results(raw_results,
+                                     highlight=kwargs.get('highlight', False),
+                                     result_class=kwargs.get('result_class'))
+
+    @log_query
+    def grouped_search(self, query_string, group_queries, **kwargs):
+        """
+        Runs a search for the documents matching any of `group_queries`,
+        with a result group (Solr's group.query) for each of them. Every
+        group gets the start and end offsets passed in; the rest of the
+        arguments are the ones search() accepts.
+
+        Returns a dictionary with the processed results of each group
+        ('groups', keyed by group query) and the facet counts of the whole
+        search ('facets').
+
+        """
+        search_kwargs = self.build_search_kwargs(query_string, **kwargs)
+        search_kwargs['fq'] = search_kwargs.get('fq', []) + [
+            ' OR '.join('(%s)' % group_query for group_query in group_queries)]
+        search_kwargs.update({
+            'group': 'true',
+            'group.query': list(group_queries),
+            'group.offset': search_kwargs.get('start', 0),
+            'group.limit': search_kwargs.get('rows', 10),
+        })
+        search_kwargs['q'] = query_string
+
+        try:
+            with solr_stats.source('DESolrSearchBackend.grouped_search'):
+                raw_results = SolrResultCache().get(
+                    search_kwargs, lambda: self.conn.decoder.decode(
+                        self.conn._select(search_kwargs)))
+        except (IOError, SolrError), e:
+            if not self.silently_fail:
+                raise
+
+            self.log.error("Failed to query Solr using '%s': %s", query_string, e)
+            raw_results = {}
+
+        highlight = kwargs.get('highlight', False)
+        result_class = kwargs.get('result_class')
+        grouped = raw_results.get('grouped', {})
+        groups = {}
+        for group_query in group_queries:
+            doclist = grouped.get(group_query, {}).get('doclist', {})
+            group_results = Results(doclist.get('docs', []),
+                                    doclist.get('numFound', 0),
+                                    highlighting=raw_results.get('highlighting'))
+            groups[group_query] = self._process_results(
+                group_results, highlight=highlight, result_class=result_class)
+
+        facet_results = self._process_results(
+            Results([], 0, facets=raw_results.get('facet_counts')))
+        return {
+            'groups': groups,
+            'facets': facet_results.get('facets', {}),
+        }
+
+    def build_search_kwargs(self, query_string, sort_by=None, start_offset=0,
+                            end_offset=None, fields='', highlight=False,
+                            facets=None, date_facets=None, query_facets=None,
+                            narrow_queries=None, spelling_query=None,
+                            within=None, dwithin=None, distance_point=None,
+                            limit_to_registered_models=None,
+                            result_class=None, facet_mincount=None,
+                            facet_limit=None, facet_prefix=None,
+                            facet_sort=None, facet_offset=None, bf=None,
+                            **kwargs):
+        """
+        Returns the parameters of the Solr request for a search. Takes the
+        same arguments as search().
+
+        """
         kwargs = {
             'fl': '* score',
             'mlt': 'false'
@@ -448,17 +784,7 @@ class DESolrSearchBackend(SolrSearchBackend):
         #     # kwargs['fl'] += ' _dist_:geodist()'
         #     pass
 
-        try:
-            raw_results = self.conn.search(query_string, **kwargs)
-        except (IOError, SolrError), e:
-            if not self.silently_fail:
-                raise
-
-            self.log.error("Failed to query Solr using '%s': %s", query_string, e)
-            raw_results = EmptyResults()
-
-        return self._process_results(raw_results, highlight=highlight,
-                                     result_class=result_class)
+        return kwargs
 
     def build_schema(self, fields):
         content_field_name = ''
@@ -121,12 +121,20 @@ class JobIndex(indexes.SearchIndex, indexes.Indexable):
     title_slab = indexes.CharField(faceted=True)
     title_slug = indexes.CharField(model_attr='titleSlug')
     uid = indexes.IntegerField(model_attr='uid')
+    # Digest of the feed data for a job, used by import_jobs.update_solr to
+    # skip re-indexing jobs that haven't changed.
+    content_hash = StringField(indexed=False, null=True)
     guid = ExactStringField(model_attr='guid')
     zipcode = indexes.CharField(model_attr='zipcode', null=True)
 
     # Fields for post-a-job
     is_posted = indexes.BooleanField()
     on_sites = MultiValueIntegerField()
+    # The ids of the standard custom facets the job matches; set after each
+    # import by import_jobs.tag_custom_facets(), which also sets
+    # custom_facets_tagged.
+    custom_facets = MultiValueIntegerField(null=True)
+    custom_facets_tagged = indexes.BooleanField(null=True)
     apply_info = StringField(indexed=False)
 
     def get_model(self):
@@ -0,0 +1,134 @@
+"""
+The configuration of the site the current request is for.
+
+MultiHostMiddleware used to store the current site's configuration
+directly on django.conf.settings, which every thread (or greenlet) in the
+process shares, so two requests for different sites being handled at the
+same time would see each other's configuration. Instead, the middleware
+builds a SiteContext for each request, attaches it to the request and
+makes it the current context for the thread handling it.
+
+Code that needs the current site's configuration should read it from
+`site_settings`, which looks like django.conf.settings but answers the
+site-specific names (SITE, SITE_BUIDS, DEFAULT_FACET, ...) from the
+current SiteContext:
+
+    from seo.site_context import site_settings
+
+    buids = site_settings.SITE_BUIDS
+
+Outside of a request (celery tasks, management commands, tests that set
+up settings.SITE themselves) there is no current context, and the values
+are read from django.conf.settings as before.
+
+"""
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+# The settings that used to be written by MultiHostMiddleware for every
+# request. All of them are attributes of a SiteContext.
+SITE_SETTINGS = (
+    'SITE',
+    'SITE_ID',
+    'SITE_NAME',
+    'SITE_BUIDS',
+    'SITE_TAGS',
+    'SITE_TITLE',
+    'SITE_HEADING',
+    'SITE_DESCRIPTION',
+    'ATS_SOURCE_CODES',
+    'GA_CAMPAIGN',
+    'COMMITMENTS',
+    'VIEW_SOURCE',
+    'DEFAULT_FACET',
+    'FEATURED_FACET',
+    'STANDARD_FACET',
+    'SITE_PACKAGES',
+    'CACHE_MIDDLEWARE_KEY_PREFIX',
+)
+
+# threading.local is greenlet-local once gevent has monkey patched the
+# threading module.
+_local = threading.local()
+
+
+class SiteContext(object):
+    """
+    The site-specific configuration for one request. Any value not passed
+    in defaults to the value of the setting with the same name.
+
+    """
+    def __init__(self, **values):
+        for name in SITE_SETTINGS:
+            if name in values:
+                value = values.pop(name)
+            else:
+                value = getattr(settings, name, None)
+            setattr(self, name, value)
+        if values:
+            raise TypeError("Unexpected site settings: %s" %
+                            ", ".join(values))
+
+    def apply_to_settings(self):
+        """
+        Copies this context onto django.conf.settings, for code (such as
+        django.contrib.sites and flatpages) that can only read settings.
+
+        """
+        for name in SITE_SETTINGS:
+            setattr(settings, name, getattr(self, name))
+
+
+def get_site_context():
+    """
+    Returns the SiteContext for the request being handled by this thread,
+    or one built from django.conf.settings if there isn't one.
+
+    """
+    context = getattr(_local, 'context', None)
+    if context is None:
+        context = SiteContext()
+    return context
+
+
+def set_site_context(context):
+    _local.context = context
+
+
+def clear_site_context():
+    _local.context = None
+
+
+@contextmanager
+def using_site_context(context):
+    """
+    Makes `context` the current SiteContext until the block exits, for
+    code outside of a request (or inside one) working on another site.
+
+    """
+    previous = getattr(_local, 'context', None)
+    _local.context = context
+    try:
+        yield context
+    finally:
+        _local.context = previous
+
+
+class SiteSettings(object):
+    """
+    A stand-in for django.conf.settings whose site-specific values come
+    from the current SiteContext.
+
+    """
+    def __getattr__(self, name):
+        if name in SITE_SETTINGS:
+            context = getattr(_local, 'context', None)
+            if context is not None:
+                return getattr(context, name)
+        return getattr(settings, name)
+
+
+site_settings = SiteSettings()
@@ -1,15 +1,29 @@
 import datetime
+import gzip
+import logging
 import math
+import os
+from StringIO import StringIO
 from slugify import slugify
 from solrsitemap import SolrSitemap
 
 from django.conf import settings
-from django.contrib.sites.models import Site
 from django.core.exceptions import ImproperlyConfigured
+from django.core.paginator import EmptyPage, PageNotAnInteger
 from django.core.urlresolvers import NoReverseMatch, reverse
+from django.template import loader
+from django.utils.encoding import smart_str
 
+from middleware import site_bundle
 from seo.search_backend import DESearchQuerySet
-from seo.helpers import sqs_apply_custom_facets
+from seo.helpers import FIELD_PROFILES, sqs_apply_custom_facets
+from seo.site_context import SiteContext, site_settings, using_site_context
+
+
+logger = logging.getLogger(__name__)
+
+# Number of days of jobs the sitemap index links to.
+SITEMAP_HISTORY_DAYS = 30
 
 
 class DESolrSitemap(SolrSitemap):
@@ -36,7 +50,7 @@ class DESolrSitemap(SolrSitemap):
         self.limit = 2000
         self.fields = fields or []
         self.fields.extend(self.required_fields)
-        self.buids = settings.SITE_BUIDS
+        self.buids = site_settings.SITE_BUIDS
         self.buid_str = " OR ".join([str(i) for i in self.buids])
         super(DESolrSitemap, self).__init__(queryclass=queryclass, **kwargs)
         
@@ -46,7 +60,7 @@ class DESolrSitemap(SolrSitemap):
         if self.buids:
             sqs = sqs.narrow("buid:(%s)" % self.buid_str)
 
-        sqs = sqs_apply_custom_facets(settings.DEFAULT_FACET, sqs)
+        sqs = sqs_apply_custom_facets(site_settings.DEFAULT_FACET, sqs)
 
         if self.fields:
             sqs = sqs.fields(self.fields)
@@ -98,14 +112,12 @@ class DESolrSitemap(SolrSitemap):
 
     def get_urls(self, site=None):
         if site is None:
-            if Site._meta.installed:
-                try:
-                    site = Site.objects.get_current()
-                except Site.DoesNotExist:
-                    pass
+            # Not Site.objects.get_current(), which reads the process-wide
+            # settings.SITE_ID rather than the current request's site.
+            site = site_settings.SITE
             if site is None:
                 raise ImproperlyConfigured("""In order to use Sitemaps you must\
-                                            either use the sites framework or\
+                                            either have a current site or\
                                             pass in a Site or RequestSite\
                                             object in your view code.""")
 
@@ -263,3 +275,180 @@ class DateSitemap(DESolrSitemap):
         lastnight = datetime.datetime(*date_val[0:3])
         tonight = lastnight + oneday
         return [lastnight, tonight]
+
+
+def sitemap_index_dates(today=None):
+    """
+    Returns the dates the sitemap index covers, newest first: the
+    SITEMAP_HISTORY_DAYS days ending yesterday.
+
+    """
+    today = today or datetime.date.today()
+    yesterday = today - datetime.timedelta(days=1)
+    return [yesterday - datetime.timedelta(days=i)
+            for i in xrange(SITEMAP_HISTORY_DAYS)]
+
+
+def sitemap_index_pages(today=None):
+    """
+    Returns a list of (date, number of pages) for the dates in the sitemap
+    index, newest first.
+
+    """
+    dates = sitemap_index_dates(today)
+    #The latest date/time in sitemaps is yesterday, midnight (time.max)
+    latest_datetime = datetime.datetime.combine(dates[0], datetime.time.max)
+    earliest_day = dates[-1] - datetime.timedelta(days=1)
+    datecounts = DateSitemap().numpages(startdate=earliest_day,
+                                        enddate=latest_datetime)
+    return [(date.isoformat(), datecounts.get(date.isoformat(), 0))
+            for date in dates]
+
+
+def render_sitemap_index(domain, protocol='http', today=None, pages=None):
+    """
+    Renders the sitemap index for the current site, which instructs the
+    crawler how to get to every other page.
+
+    Inputs:
+    :domain: The domain the sitemap urls are on.
+    :protocol: 'http' or 'https'.
+    :pages: The result of sitemap_index_pages(); looked up if not given.
+
+    """
+    if pages is None:
+        pages = sitemap_index_pages(today)
+
+    #List of tuples: (sitemap url, lastmod date)
+    sites_dates = []
+    for date, count in pages:
+        sitemap_url = reverse('sitemap_date', kwargs={'jobdate': date})
+        sites_dates.append(('%s://%s%s' % (protocol, domain, sitemap_url),
+                            date))
+        for page in xrange(2, count + 1):
+            sites_dates.append(('%s://%s%s?p=%s' % (protocol, domain,
+                                                    sitemap_url, page),
+                                date))
+
+    return loader.render_to_string('sitemaps/sitemap_index_lastmod.xml',
+                                   {'sitemaps': sites_dates})
+
+
+def render_sitemap(jobdate, page=1, site=None):
+    """
+    Renders one page of the sitemap of the jobs from `jobdate` (a
+    'YYYY-MM-DD' string) for the current site.
+
+    Raises EmptyPage or PageNotAnInteger if there is no such page.
+
+    """
+    sitemap = DateSitemap(page=page, fields=list(FIELD_PROFILES['sitemap']),
+                          jobdate=jobdate)
+    urls = sitemap.get_urls(site=site)
+    return smart_str(loader.render_to_string('sitemap.xml', {'urlset': urls}))
+
+
+# Pre-generated sitemaps
+#
+# Crawlers fetch the sitemaps of every site daily, and generating them
+# means a date facet for the index and a 2000 row query for every page.
+# When settings.SITEMAP_SHARD_DIR is set, write_site_sitemaps() renders
+# them all after each import (see tasks.task_generate_sitemaps) and stores
+# them gzipped in SITEMAP_SHARD_DIR/<domain>/, where the sitemap views
+# look for them before generating them live.
+
+def index_shard_name(protocol, today=None):
+    """
+    The index links to the days up to yesterday, so a stored index is only
+    good for the day it was generated on.
+
+    """
+    today = today or datetime.date.today()
+    return 'sitemap-index-%s-%s' % (protocol, today.isoformat())
+
+
+def date_shard_name(jobdate, page=1):
+    return 'sitemap-%s-%s' % (jobdate, page)
+
+
+def shard_path(domain, name):
+    return os.path.join(settings.SITEMAP_SHARD_DIR, domain,
+                        '%s.xml.gz' % name)
+
+
+def read_shard(domain, name):
+    """
+    Returns the gzipped contents of a stored sitemap, or None if there
+    isn't one (or pre-generated sitemaps are turned off).
+
+    """
+    if not getattr(settings, 'SITEMAP_SHARD_DIR', None):
+        return None
+    try:
+        with open(shard_path(domain, name), 'rb') as shard:
+            return shard.read()
+    except IOError:
+        return None
+
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj=StringIO(data)).read()
+
+
+def write_shards(domain, shards):
+    """
+    Stores `shards`, a dictionary of shard name -> xml, as the sitemaps of
+    `domain`, replacing all of the ones stored before.
+
+    Each file is written to a temporary file and renamed into place, so a
+    view never reads a partly written sitemap.
+
+    """
+    directory = os.path.join(settings.SITEMAP_SHARD_DIR, domain)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    filenames = set()
+    for name, xml in shards.items():
+        path = shard_path(domain, name)
+        tmp_path = '%s.tmp.%s' % (path, os.getpid())
+        with open(tmp_path, 'wb') as tmp:
+            # A fixed mtime keeps unchanged sitemaps byte-for-byte the same.
+            with gzip.GzipFile(filename='', mode='wb', fileobj=tmp,
+                               mtime=0) as compressed:
+                compressed.write(smart_str(xml))
+        os.rename(tmp_path, path)
+        filenames.add(os.path.basename(path))
+
+    for filename in os.listdir(directory):
+        if filename.endswith('.xml.gz') and filename not in filenames:
+            os.remove(os.path.join(directory, filename))
+
+
+def write_site_sitemaps(site, today=None):
+    """
+    Generates and stores every sitemap of `site`: today's index, for http
+    and https, and each page of the sitemap of each day in it.
+
+    Returns the number of sitemaps stored.
+
+    """
+    today = today or datetime.date.today()
+    with using_site_context(SiteContext(**site_bundle(site.domain))):
+        pages = sitemap_index_pages(today)
+        shards = {}
+        for protocol in ['http', 'https']:
+            shards[index_shard_name(protocol, today)] = render_sitemap_index(
+                site.domain, protocol=protocol, pages=pages)
+        for jobdate, count in pages:
+            # The index links to the first page of a day with no jobs too.
+            for page in xrange(1, max(count, 1) + 1):
+                try:
+                    xml = render_sitemap(jobdate, page=page, site=site)
+                except (EmptyPage, PageNotAnInteger):
+                    continue
+                shards[date_shard_name(jobdate, page)] = xml
+
+    write_shards(site.domain, shards)
+    logger.info("Stored %s sitemaps for %s", len(shards), site.domain)
+    return len(shards)
@@ -0,0 +1,177 @@
+"""
+A cache of raw Solr responses shared by every site.
+
+The page cache (seo.decorators.custom_cache_page) is keyed by host and
+configuration revision, so the many network sites that share the same
+business units each run the same Solr queries, and every page expiry
+sends all of them to Solr at once. SolrResultCache sits under the search
+backend instead, keyed by a hash of the final Solr parameters, so an
+identical query is answered once for all of the sites asking it.
+
+Entries are fresh for SOLR_RESULT_CACHE_TTL seconds. After that they are
+kept for another SOLR_RESULT_CACHE_STALE_TTL seconds, during which they
+are still served while a single worker (whichever takes the entry's lock)
+refreshes them on a background thread.
+
+Clearing a business unit's caches (BusinessUnit.clear_cache(), and so
+task_clear_bu_cache) calls invalidate_buids(), which expires every entry
+for a query filtered on that business unit, along with every entry for a
+query that isn't filtered on business units at all.
+
+"""
+import hashlib
+import logging
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'solr_results'
+# The generation of queries that aren't filtered on any business unit.
+ALL_BUIDS = '*'
+
+BUID_CLAUSE = re.compile(r'\bbuid:(?:\(([\d\sOR]+)\)|(\d+))')
+
+
+def query_buids(params):
+    """
+    Returns the set of business unit ids the fq and q parameters of a Solr
+    request filter on, or None if they don't mention any.
+
+    """
+    queries = params.get('fq', [])
+    if not isinstance(queries, (list, tuple)):
+        queries = [queries]
+    queries = list(queries) + [params.get('q', '')]
+    buids = set()
+    for query in queries:
+        for group, single in BUID_CLAUSE.findall(query):
+            buids.update(re.findall(r'\d+', group or single))
+    return buids or None
+
+
+def generation_key(buid):
+    return '%s:generation:%s' % (KEY_PREFIX, buid)
+
+
+def invalidate_buids(buids):
+    """
+    Expires the cached results of queries filtered on any of `buids`, and
+    of queries that aren't filtered on business units.
+
+    """
+    result_cache = SolrResultCache()
+    if not result_cache.enabled:
+        return
+    now = time.time()
+    generations = dict((generation_key(buid), now) for buid in buids)
+    generations[generation_key(ALL_BUIDS)] = now
+    cache.set_many(generations, result_cache.timeout)
+
+
+class SolrResultCache(object):
+    """
+    Caches the result of calling fetch() for a dictionary of Solr request
+    parameters.
+
+    Usage:
+        results = SolrResultCache().get(params, fetch)
+
+    """
+    def __init__(self, ttl=None, stale_ttl=None, lock_timeout=None):
+        self.ttl = (ttl if ttl is not None else
+                    getattr(settings, 'SOLR_RESULT_CACHE_TTL', 0))
+        self.stale_ttl = (stale_ttl if stale_ttl is not None else
+                          getattr(settings, 'SOLR_RESULT_CACHE_STALE_TTL', 0))
+        self.lock_timeout = (lock_timeout if lock_timeout is not None else
+                             getattr(settings, 'SOLR_RESULT_CACHE_LOCK_TIMEOUT',
+                                     30))
+
+    @property
+    def enabled(self):
+        return bool(self.ttl)
+
+    @property
+    def timeout(self):
+        """How long an entry is kept for, stale or not."""
+        return self.ttl + self.stale_ttl
+
+    @staticmethod
+    def key(params):
+        """
+        A hash of `params` that doesn't depend on the order of the
+        parameters, or of the values of list parameters (fq, facet.field,
+        ...), none of which change what Solr returns.
+
+        """
+        normalized = []
+        for name, value in sorted(params.items()):
+            if isinstance(value, (list, tuple)):
+                value = sorted(value)
+            normalized.append((name, value))
+        digest = hashlib.md5(repr(normalized)).hexdigest()
+        return '%s:%s' % (KEY_PREFIX, digest)
+
+    def generation_keys(self, params):
+        buids = query_buids(params)
+        if buids is None:
+            return [generation_key(ALL_BUIDS)]
+        return sorted(generation_key(buid) for buid in buids)
+
+    def get(self, params, fetch):
+        """
+        Returns the cached results for `params`, calling fetch() to get
+        them if there aren't any, or on a background thread if the cached
+        ones are stale.
+
+        """
+        if not self.enabled:
+            return fetch()
+
+        key = self.key(params)
+        generation_keys = self.generation_keys(params)
+        values = cache.get_many([key] + generation_keys)
+        generations = [values.get(generation) for generation in
+                       generation_keys]
+        entry = values.get(key)
+
+        if entry is None or entry['generations'] != generations:
+            return self.refresh(key, generations, fetch)
+
+        if entry['fresh_until'] < time.time():
+            if cache.add('%s:lock' % key, 1, self.lock_timeout):
+                thread = threading.Thread(
+                    target=self.refresh_in_background,
+                    name="solr-cache-refresh",
+                    args=(key, generations, fetch))
+                thread.daemon = True
+                thread.start()
+        return entry['results']
+
+    def refresh(self, key, generations, fetch):
+        """
+        Calls fetch() and caches what it returns. The business unit
+        generations are the ones read before fetching, so that an
+        invalidation while Solr is being queried isn't lost.
+
+        """
+        results = fetch()
+        cache.set(key, {
+            'results': results,
+            'generations': generations,
+            'fresh_until': time.time() + self.ttl,
+        }, self.timeout)
+        return results
+
+    def refresh_in_background(self, key, generations, fetch):
+        try:
+            self.refresh(key, generations, fetch)
+        except Exception:
+            logger.exception("Unable to refresh cached Solr results %s", key)
+        finally:
+            cache.delete('%s:lock' % key)
@@ -17,6 +17,7 @@ from django.utils.translation import ugettext
 from django.http import QueryDict
 
 from seo.models import CustomPage, Company, GoogleAnalytics, SiteTag
+from seo.site_context import site_settings
 from universal.helpers import get_object_or_none, update_url_param
 
 
@@ -295,7 +296,7 @@ def custom_page_navigation(context):
 
     if html is None:
         links = CustomPage.objects.filter(
-            sites=settings.SITE_ID).values_list('url', 'title')
+            sites=site_settings.SITE_ID).values_list('url', 'title')
         html = "".join(["<a href='%s'>%s</a>" % (url, title) 
                         for (url, title) in links])
         cache.set(cache_key, html, timeout)
@@ -344,7 +345,7 @@ def flatpage_site_heading(context):
     Returns site heading for pages where the context variable isn't loaded
 
     """
-    return context.get('site_heading', settings.SITE_HEADING)
+    return context.get('site_heading', site_settings.SITE_HEADING)
 
 
 @register.assignment_tag(takes_context=True)
@@ -353,7 +354,7 @@ def flatpage_site_tags(context):
     Returns site tags for pages where the context variable isn't loaded
 
     """
-    return context.get('site_tags', settings.SITE_TAGS)
+    return context.get('site_tags', site_settings.SITE_TAGS)
 
 
 @register.assignment_tag(takes_context=True)
@@ -362,7 +363,7 @@ def flatpage_site_description(context):
     Returns site description for pages where the context variable isn't loaded
 
      """
-    return context.get('site_description', settings.SITE_DESCRIPTION)
+    return context.get('site_description', site_settings.SITE_DESCRIPTION)
 
 
 @register.assignment_tag(takes_context=True)
@@ -377,7 +378,7 @@ def flatpage_site_title(context, *args, **kwargs):
     related to the "as" renaming we do in seo_base.html.
 
     """
-    return context.get('site_title', settings.SITE_TITLE)
+    return context.get('site_title', site_settings.SITE_TITLE)
 
 
 def get_ga_context():
@@ -392,9 +393,9 @@ def get_ga_context():
     ga.html and footer.html rendered with manual context variable.
     
     """
-    site_id = settings.SITE_ID   
+    site_id = site_settings.SITE_ID   
     ga = GoogleAnalytics.objects.filter(seosite=site_id)
-    view_source = settings.VIEW_SOURCE
+    view_source = site_settings.VIEW_SOURCE
     build_num = settings.BUILD
     return {
         'google_analytics': ga,
@@ -437,10 +438,10 @@ def view_all_jobs_label(view_all_jobs_detail):
     label = ugettext("View All Jobs")
     # time to build the new string. This assumes each word is capitalized
     if view_all_jobs_detail:
-        cos = settings.SITE.business_units.all()
+        cos = site_settings.SITE.business_units.all()
         if cos:
             # strip "Jobs" from the end
-            label = settings.SITE_TITLE.replace("Jobs", "")
+            label = site_settings.SITE_TITLE.replace("Jobs", "")
             for company in cos:
                 # strip any phrases that match the company title. This will
                 # leave only phrases from the title that reflect the desired
@@ -533,17 +534,17 @@ def make_pixel_qs(request, job=None):
     Returns:
     :safe_qs: Encoded, and marked safe query string
     """
-    current_site = settings.SITE
+    current_site = site_settings.SITE
     commitments = current_site.special_commitments.all().values_list('commit',
                                                                      flat=True)
 
-    vs = settings.VIEW_SOURCE
+    vs = site_settings.VIEW_SOURCE
     if vs:
         vs = vs.view_source
     else:
         vs = 88
     qd = QueryDict('', mutable=True)
-    qd.setlist('st', settings.SITE_TAGS)
+    qd.setlist('st', site_settings.SITE_TAGS)
     qd.setlist('sc', commitments)
     qs = {'d': current_site.domain,
           'jvs': vs}
@@ -0,0 +1,395 @@
+"""
+A benchmark of the search request path.
+
+SyntheticCorpus creates a set of sites, each with its own business unit
+and company, and a reproducible corpus of jobs for them. Benchmark
+requests the search views of every site through the Django test client,
+from several threads at once, and reports for each view the median and
+95th percentile latency and the number of Solr requests and SQL queries a
+page takes. See the benchmark_search management command.
+
+The Solr requests made through Haystack go to a real Solr core or, with a
+Recording, are answered from the responses recorded against one on an
+earlier run. Replaying measures the Django side of the request path on
+its own, without needing Solr.
+
+"""
+import datetime
+import hashlib
+import json
+import logging
+import math
+import Queue
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.test.client import Client
+from django.test.utils import CaptureQueriesContext
+from haystack import connections
+from pysolr import SolrError
+
+from seo.search_backend import DESolrEngine, DESolrSearchBackend
+from seo.tests import factories
+from seo_pysolr import Solr
+from transform import transform_for_postajob
+import solr_stats
+
+
+logger = logging.getLogger(__name__)
+
+TITLES = ['Retail Associate', 'Registered Nurse', 'Software Engineer',
+          'Truck Driver', 'Accountant', 'Warehouse Worker',
+          'Customer Service Representative', 'Electrician',
+          'Financial Analyst', 'Pharmacist', 'Store Manager',
+          'Maintenance Technician']
+LOCATIONS = [('Indianapolis', 'Indiana', 'IN'), ('Chicago', 'Illinois', 'IL'),
+             ('Austin', 'Texas', 'TX'), ('Denver', 'Colorado', 'CO'),
+             ('Seattle', 'Washington', 'WA'), ('Columbus', 'Ohio', 'OH'),
+             ('Nashville', 'Tennessee', 'TN'), ('Phoenix', 'Arizona', 'AZ')]
+
+# Synthetic business units are numbered from here, well clear of real ones,
+# so that they can be removed from a shared Solr core afterwards.
+FIRST_BUID = 900000
+
+# Solr date literals, plain or url encoded. They depend on the time of the
+# run, so they are left out of recorded request keys.
+SOLR_DATE = re.compile(r'\d{4}-\d\d-\d\dT\d\d(?::|%3A)\d\d(?::|%3A)\d\d'
+                       r'(?:\.\d+)?Z')
+
+
+class SyntheticCorpus(object):
+    """
+    `num_sites` sites with `jobs_per_site` jobs each. The same seed always
+    gives the same sites and jobs, dated relative to the day of the run.
+
+    """
+    def __init__(self, num_sites=5, jobs_per_site=200, seed=0):
+        self.num_sites = num_sites
+        self.jobs_per_site = jobs_per_site
+        self.seed = seed
+        self.sites = []
+
+    @property
+    def buids(self):
+        return [FIRST_BUID + i for i in xrange(self.num_sites)]
+
+    def create_sites(self):
+        """Creates the sites, with a business unit and company each."""
+        configuration = factories.ConfigurationFactory(status=2)
+        for i, buid in enumerate(self.buids):
+            name = 'Benchmark Company %d' % i
+            business_unit = factories.BusinessUnitFactory(id=buid, title=name)
+            company = factories.CompanyFactory(id=buid, name=name)
+            company.job_source_ids.add(business_unit)
+            domain = 'benchmark-%d.jobs' % i
+            site = factories.SeoSiteFactory(domain=domain, name=domain)
+            site.business_units.add(business_unit)
+            site.configurations.add(configuration)
+            self.sites.append((site, company))
+        return self.sites
+
+    def jobs(self):
+        """Yields the Solr documents for every site's jobs."""
+        rng = random.Random(self.seed)
+        now = datetime.datetime.now().replace(microsecond=0)
+        for site, company in self.sites:
+            buid = site.business_units.all()[0].id
+            for n in xrange(self.jobs_per_site):
+                yield self.job(rng, now, buid, company, n)
+
+    def job(self, rng, now, buid, company, n):
+        title = rng.choice(TITLES)
+        city, state, state_short = rng.choice(LOCATIONS)
+        date_new = now - datetime.timedelta(days=rng.randint(0, 29),
+                                            seconds=rng.randint(0, 86399))
+        uid = buid * 100000 + n
+        guid = hashlib.md5(str(uid)).hexdigest().upper()
+        job = transform_for_postajob({
+            'id': uid,
+            'city': city,
+            'company': company.id,
+            'country': 'United States',
+            'country_short': 'USA',
+            'date_new': str(date_new),
+            'date_updated': str(date_new),
+            'description': '%s needed in %s, %s.' % (title, city, state),
+            'guid': guid,
+            'link': 'http://my.jobs/%s' % guid,
+            'on_sites': '',
+            'state': state,
+            'state_short': state_short,
+            'reqid': 'BENCH%06d' % n,
+            'title': title,
+            'uid': uid,
+            'zipcode': '',
+        })
+        # transform_for_postajob() makes post-a-job documents; these are
+        # meant to look like imported ones.
+        job.update({'id': 'seo.joblisting.%s' % uid, 'django_id': uid,
+                    'buid': buid, 'is_posted': False})
+        return job
+
+    def index(self, conn, chunk_size=500):
+        jobs = list(self.jobs())
+        for start in xrange(0, len(jobs), chunk_size):
+            conn.add(jobs[start:start + chunk_size])
+        return len(jobs)
+
+    def clear(self, conn):
+        conn.delete(q='buid:(%s)' % ' OR '.join(str(buid) for buid in
+                                                self.buids))
+
+    def urls(self):
+        """
+        Returns a list of (view name, host, path) for the pages
+        benchmarked on every site.
+
+        """
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        urls = []
+        for site, company in self.sites:
+            title_slug = TITLES[0].lower().replace(' ', '-')
+            urls.extend((name, site.domain, path) for name, path in [
+                ('search_by_results_and_slugs',
+                 '/%s/jobs-in/' % title_slug),
+                ('search_by_results_and_slugs', '/jobs/?q=Nurse'),
+                ('ajax_get_jobs', '/ajax/joblisting/?offset=20&num_items=20'),
+                ('ajax_get_facets', '/ajax/titles/?offset=0&num_items=10'),
+                ('ajax_get_facets', '/ajax/cities/?offset=0&num_items=10'),
+                ('syndication_feed', '/feed/rss?num_items=100'),
+                ('syndication_feed', '/feed/json?num_items=100'),
+                ('solr_ac', '/ajax/ac/?lookup=title&term=Reg'),
+                ('solr_ac', '/ajax/ac/?lookup=location&term=Ind'),
+                ('new_sitemap_index', '/sitemap.xml'),
+                ('new_sitemap', '/sitemap-%s.xml' % yesterday.isoformat()),
+            ])
+        return urls
+
+
+class RecordingMiss(SolrError):
+    pass
+
+
+class Recording(object):
+    """
+    Solr responses keyed by request. When `replay` is True, the responses
+    are loaded from `path` and requests are answered from them; otherwise
+    the responses to the requests made are kept, to be written to `path`
+    by save().
+
+    """
+    def __init__(self, path, replay=False):
+        self.path = path
+        self.replay = replay
+        self.responses = {}
+        self.lock = threading.Lock()
+        if replay:
+            with open(path) as recording:
+                self.responses = json.load(recording)
+
+    @staticmethod
+    def key(method, path, body):
+        return SOLR_DATE.sub('<date>', '%s %s %s' % (method.upper(), path,
+                                                     body or ''))
+
+    def response(self, method, path, body):
+        try:
+            return self.responses[self.key(method, path, body)]
+        except KeyError:
+            raise RecordingMiss("No recorded response for %s %s" %
+                                (method.upper(), path))
+
+    def add(self, method, path, body, content):
+        with self.lock:
+            self.responses[self.key(method, path, body)] = content
+
+    def save(self):
+        with open(self.path, 'w') as recording:
+            json.dump(self.responses, recording, indent=1, sort_keys=True)
+
+
+_recording = None
+
+
+class RecordedSolr(Solr):
+    """
+    A Solr client that records its responses in the current Recording, or
+    answers from it if it is being replayed.
+
+    """
+    def _send_request(self, method, path='', body=None, headers=None,
+                      files=None):
+        recording = _recording
+        if recording is None:
+            return super(RecordedSolr, self)._send_request(
+                method, path, body=body, headers=headers, files=files)
+        if recording.replay:
+            start_time = time.time()
+            content = recording.response(method, path, body)
+            solr_stats.record(method.lower(), self._create_full_url(path),
+                              body or '', time.time() - start_time, content)
+            return content
+        content = super(RecordedSolr, self)._send_request(
+            method, path, body=body, headers=headers, files=files)
+        recording.add(method, path, body, content)
+        return content
+
+
+class RecordedSolrSearchBackend(DESolrSearchBackend):
+    def __init__(self, connection_alias, **connection_options):
+        super(RecordedSolrSearchBackend, self).__init__(connection_alias,
+                                                        **connection_options)
+        self.conn = RecordedSolr(connection_options['URL'],
+                                 auth=self.conn.auth, timeout=self.timeout)
+
+
+class RecordedSolrEngine(DESolrEngine):
+    backend = RecordedSolrSearchBackend
+
+
+@contextmanager
+def solr_backend(url, recording=None):
+    """
+    Points the default Haystack connection at `url`, recording its
+    responses in, or replaying them from, `recording` if one is given.
+
+    """
+    global _recording
+    options = settings.HAYSTACK_CONNECTIONS['default']
+    old_options = dict(options)
+    options['ENGINE'] = 'seo.tests.benchmark.RecordedSolrEngine'
+    options['URL'] = url
+    connections.reload('default')
+    _recording = recording
+    try:
+        yield
+    finally:
+        _recording = None
+        options.clear()
+        options.update(old_options)
+        connections.reload('default')
+
+
+def percentile(values, percent):
+    """The nearest-rank percentile of a non-empty list of numbers."""
+    values = sorted(values)
+    rank = int(math.ceil(percent / 100.0 * len(values))) - 1
+    return values[max(0, rank)]
+
+
+class ViewResult(object):
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.solr_queries = []
+        self.sql_queries = []
+        self.errors = 0
+
+    def add(self, latency, solr_queries, sql_queries, status_code):
+        self.latencies.append(latency)
+        self.solr_queries.append(solr_queries)
+        self.sql_queries.append(sql_queries)
+        if status_code >= 400:
+            self.errors += 1
+
+    @property
+    def requests(self):
+        return len(self.latencies)
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'p50_ms': percentile(self.latencies, 50) * 1000,
+            'p95_ms': percentile(self.latencies, 95) * 1000,
+            'solr_per_page': (float(sum(self.solr_queries)) /
+                              len(self.solr_queries)),
+            'sql_per_page': (float(sum(self.sql_queries)) /
+                             len(self.sql_queries)),
+        }
+
+
+class Benchmark(object):
+    """
+    Requests each of `urls` (see SyntheticCorpus.urls()) `repeat` times
+    from `concurrency` threads, each with its own test client.
+
+    Solr requests are counted by middleware.SolrStatsMiddleware, which
+    must be installed.
+
+    """
+    def __init__(self, urls, concurrency=4, repeat=10):
+        self.urls = urls
+        self.concurrency = concurrency
+        self.repeat = repeat
+        self.results = {}
+        self.lock = threading.Lock()
+
+    def run(self):
+        """Returns a dictionary of view name -> ViewResult."""
+        requests = Queue.Queue()
+        for _ in xrange(self.repeat):
+            for url in self.urls:
+                requests.put(url)
+
+        # A single worker runs on this thread, so that it sees the data
+        # created in an uncommitted transaction (as in a TestCase).
+        if self.concurrency <= 1:
+            self.work(requests)
+        else:
+            threads = [threading.Thread(target=self.work, args=(requests,),
+                                        name='benchmark-%d' % i)
+                       for i in xrange(self.concurrency)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        return self.results
+
+    def work(self, requests):
+        client = Client()
+        try:
+            while True:
+                try:
+                    name, host, path = requests.get_nowait()
+                except Queue.Empty:
+                    return
+                self.request(client, name, host, path)
+        finally:
+            if threading.current_thread().name.startswith('benchmark-'):
+                connection.close()
+
+    def request(self, client, name, host, path):
+        with CaptureQueriesContext(connection) as queries:
+            start_time = time.time()
+            response = client.get(path, HTTP_HOST=host)
+            if response.streaming:
+                ''.join(response.streaming_content)
+            latency = time.time() - start_time
+        stats = solr_stats.last_request()
+        solr_queries = stats.totals()['queries'] if stats else 0
+        if response.status_code >= 400:
+            logger.warning("%s %s returned %s", host, path,
+                           response.status_code)
+        with self.lock:
+            result = self.results.setdefault(name, ViewResult(name))
+            result.add(latency, solr_queries, len(queries),
+                       response.status_code)
+
+
+def report(results):
+    """Formats the results of Benchmark.run() as a table."""
+    lines = ['%-30s %8s %6s %9s %9s %10s %9s' % (
+        'view', 'requests', 'errors', 'p50 ms', 'p95 ms', 'solr/page',
+        'sql/page')]
+    for name in sorted(results):
+        lines.append('%(name)-30s %(requests)8d %(errors)6d %(p50_ms)9.1f '
+                     '%(p95_ms)9.1f %(solr_per_page)10.1f '
+                     '%(sql_per_page)9.1f' %
+                     dict(results[name].as_dict(), name=name))
+    return '\n'.join(lines)
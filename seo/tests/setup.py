@@ -1,4 +1,5 @@
 import os.path
+import threading
 from contextlib import contextmanager
 from haystack import connections as haystack_connections
 
@@ -18,11 +19,23 @@ import solr_settings
 
 
 class TestDESolrSearchBackend(DESolrSearchBackend):
+    # Searches can run concurrently (see search_backend.SearchFanOut).
+    counter_lock = threading.Lock()
+
+    def count_query(self):
+        with self.counter_lock:
+            counter = getattr(settings, 'SOLR_QUERY_COUNTER', 0)
+            settings.SOLR_QUERY_COUNTER = counter + 1
+
     def search(self, *args, **kwargs):
-        counter = getattr(settings, 'SOLR_QUERY_COUNTER', 0)
-        settings.SOLR_QUERY_COUNTER = counter + 1
+        self.count_query()
         return super(TestDESolrSearchBackend, self).search(*args, **kwargs)
 
+    def grouped_search(self, *args, **kwargs):
+        self.count_query()
+        return super(TestDESolrSearchBackend, self).grouped_search(*args,
+                                                                   **kwargs)
+
 
 class TestDESolrEngine(DESolrEngine):
     backend = TestDESolrSearchBackend
@@ -0,0 +1,52 @@
+import os
+import tempfile
+
+from django.conf import settings
+
+from seo.tests.benchmark import (Benchmark, Recording, SyntheticCorpus,
+                                 percentile, solr_backend)
+from setup import DirectSEOBase
+
+
+class BenchmarkTestCase(DirectSEOBase):
+    def test_percentile(self):
+        values = range(10, 0, -1)
+        self.assertEqual(percentile(values, 50), 5)
+        self.assertEqual(percentile(values, 95), 10)
+        self.assertEqual(percentile([3], 95), 3)
+
+    def test_record_and_replay(self):
+        """
+        Replaying a recording answers the same Solr requests as were made
+        when it was recorded, without Solr having the jobs any more.
+
+        """
+        corpus = SyntheticCorpus(num_sites=1, jobs_per_site=20)
+        corpus.create_sites()
+        self.assertEqual(corpus.index(self.conn), 20)
+        urls = [url for url in corpus.urls()
+                if url[0] in ['ajax_get_jobs', 'solr_ac']]
+        solr_url = settings.HAYSTACK_CONNECTIONS['default']['URL']
+
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            recording = Recording(path)
+            with solr_backend(solr_url, recording):
+                recorded = Benchmark(urls, concurrency=1, repeat=2).run()
+            recording.save()
+            corpus.clear(self.conn)
+            self.assertEqual(self.conn.search(q='*:*').hits, 0)
+
+            with solr_backend(solr_url, Recording(path, replay=True)):
+                replayed = Benchmark(urls, concurrency=1, repeat=2).run()
+        finally:
+            os.remove(path)
+
+        self.assertEqual(sorted(recorded), ['ajax_get_jobs', 'solr_ac'])
+        for name, result in recorded.items():
+            self.assertEqual(result.requests, 4)
+            self.assertEqual(result.errors, 0)
+            self.assertTrue(all(result.solr_queries))
+            self.assertEqual(replayed[name].errors, 0)
+            self.assertEqual(replayed[name].solr_queries, result.solr_queries)
@@ -7,8 +7,10 @@ from django.conf import settings
 
 from seo import helpers
 from seo.models import CustomFacet
+from seo.search_backend import FieldNotInProfile
 from seo.tests import factories
-from setup import DirectSEOBase
+from seo.tests.solr_settings import SOLR_FIXTURE
+from setup import DirectSEOBase, patch_settings
 
 
 class SeoHelpersTestCase(DirectSEOBase):
@@ -43,6 +45,67 @@ class SeoHelpersTestCase(DirectSEOBase):
         # The count should be 0.
         self.assertEqual(result_counts[0][1], 0)
 
+    def test_get_solr_facet_from_index(self):
+        """
+        With CUSTOM_FACET_COUNTS_FROM_INDEX, custom facet counts come from
+        the custom facet ids jobs are tagged with at import time.
+
+        """
+        site_facet = factories.SeoSiteFacetFactory()
+        settings.SITE_ID = site_facet.seosite.pk
+        settings.SITE = site_facet.seosite
+        custom_facet = site_facet.customfacet
+        other_facet = factories.CustomFacetFactory(name="Other facet",
+                                                   always_show=True)
+        settings.STANDARD_FACET = [custom_facet, other_facet]
+        job = dict(SOLR_FIXTURE[0], custom_facets=[custom_facet.pk],
+                   custom_facets_tagged=True)
+        self.conn.add([job])
+
+        with patch_settings(CUSTOM_FACET_COUNTS_FROM_INDEX=True):
+            result_counts = helpers.get_solr_facet([job['buid']])
+        self.assertEqual(result_counts, [(custom_facet, 1), (other_facet, 0)])
+
+    def test_get_solr_facet_untagged_jobs(self):
+        """
+        With CUSTOM_FACET_COUNTS_FROM_INDEX, jobs that haven't been tagged
+        with custom facets (such as post-a-job jobs) are still counted.
+
+        """
+        custom_facet = factories.CustomFacetFactory(title='Retail Associate')
+        site_facet = factories.SeoSiteFacetFactory(customfacet=custom_facet)
+        settings.SITE_ID = site_facet.seosite.pk
+        settings.SITE = site_facet.seosite
+        settings.STANDARD_FACET = [custom_facet]
+        tagged_job = dict(SOLR_FIXTURE[0], custom_facets=[custom_facet.pk],
+                          custom_facets_tagged=True)
+        self.conn.add([tagged_job, SOLR_FIXTURE[1]])
+
+        with patch_settings(CUSTOM_FACET_COUNTS_FROM_INDEX=True):
+            result_counts = helpers.get_solr_facet([tagged_job['buid']])
+        self.assertEqual(result_counts, [(custom_facet, 2)])
+
+    def test_get_jobs_field_profile(self):
+        """
+        get_jobs() only fetches the fields in its field profile, and in
+        strict mode reading any other index field from a result raises.
+
+        """
+        self.conn.add([SOLR_FIXTURE[0]])
+
+        with patch_settings(SOLR_FIELD_PROFILE_STRICT=True):
+            job = helpers.get_jobs(jsids=[SOLR_FIXTURE[0]['buid']],
+                                   profile='feed')[0]
+        self.assertEqual(job.title, SOLR_FIXTURE[0]['title'])
+        self.assertRaises(FieldNotInProfile, getattr, job, 'html_description')
+        # Attributes that aren't index fields behave as usual.
+        self.assertIsNone(job.not_a_field)
+
+        with patch_settings(SOLR_FIELD_PROFILE_STRICT=False):
+            job = helpers.get_jobs(jsids=[SOLR_FIXTURE[0]['buid']],
+                                   profile='feed')[0]
+        self.assertIsNone(job.html_description)
+
     def test_featured_default_jobs(self):
         """
         Requests the number and offsets for featured and default jobs
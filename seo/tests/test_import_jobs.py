@@ -1,15 +1,20 @@
 # -*- coding: utf-8 -*-
 import os
+import tempfile
 
 from django.conf import settings
+from mock import patch
 
 from seo_pysolr import Solr
 from import_jobs import (DATA_DIR, add_company, remove_expired_jobs, update_solr, get_jobs_from_zipfile,
-    filter_current_jobs)
+    filter_current_jobs, content_hash, ZIP_SPOOL_SIZE)
 
 from seo.models import BusinessUnit, Company
-from seo.tests.factories import BusinessUnitFactory, CompanyFactory
-from setup import DirectSEOBase
+from seo.tests.factories import (BusinessUnitFactory, CompanyFactory,
+                                 CustomFacetFactory, SeoSiteFacetFactory,
+                                 SeoSiteFactory)
+from setup import DirectSEOBase, patch_settings
+import tasks
 
 
 class ImportJobsTestCase(DirectSEOBase):
@@ -37,6 +42,79 @@ class ImportJobsTestCase(DirectSEOBase):
         update_solr(self.buid_id)
         self.assertFalse(os.access(self.filepath, os.F_OK))
 
+    def test_differential_update(self):
+        """
+        Test that a second import of an unchanged feed file doesn't re-send
+        any jobs to Solr.
+
+        """
+        added, deleted = update_solr(self.buid_id, delete_feed=False)
+        self.assertTrue(added)
+        self.assertTrue(all('content_hash' in doc for doc in
+                            self.solr.search('*:*', fl='content_hash').docs))
+
+        self.assertEqual(update_solr(self.buid_id, download=False), (0, 0))
+
+    def test_custom_facet_tags(self):
+        """
+        Once an import's jobs are committed, they are tagged with the ids of
+        the standard custom facets they match, without the import counting
+        them as changed.
+
+        """
+        with patch_settings(CUSTOM_FACET_COUNTS_FROM_INDEX=True):
+            update_solr(self.buid_id, delete_feed=False)
+            self.solr.commit()
+            title = self.solr.search('*:*', fl='title',
+                                     rows=1).docs[0]['title']
+            site = SeoSiteFactory()
+            site.business_units.add(self.businessunit)
+            facet = CustomFacetFactory(title=title)
+            SeoSiteFacetFactory(seosite=site, customfacet=facet)
+
+            with patch('tasks.task_tag_custom_facets.apply_async') as tag:
+                self.assertEqual(update_solr(self.buid_id, download=False),
+                                 (0, 0))
+            # The feed file is handed over to the tagging task.
+            self.assertFalse(os.access(self.filepath, os.F_OK))
+            self.solr.commit()
+            tasks.task_tag_custom_facets(*tag.call_args[1]['args'],
+                                         **tag.call_args[1]['kwargs'])
+        self.solr.commit()
+        matching = self.solr.search(facet.saved_querystring, rows=0).hits
+        self.assertGreater(matching, 0)
+        self.assertEqual(
+            self.solr.search('custom_facets:%s' % facet.id, rows=0).hits,
+            matching)
+        self.assertEqual(
+            self.solr.search('-custom_facets_tagged:true', rows=0).hits, 0)
+        self.assertFalse(os.access(tag.call_args[1]['args'][1], os.F_OK))
+
+    def test_custom_facet_tags_off(self):
+        """
+        Without CUSTOM_FACET_COUNTS_FROM_INDEX, imports neither commit nor
+        tag jobs with custom facets.
+
+        """
+        site = SeoSiteFactory()
+        site.business_units.add(self.businessunit)
+        SeoSiteFacetFactory(seosite=site,
+                            customfacet=CustomFacetFactory(title='Engineer'))
+
+        with patch.object(Solr, 'commit') as commit, \
+                patch('tasks.task_tag_custom_facets.apply_async') as tag:
+            update_solr(self.buid_id)
+        self.assertFalse(commit.called)
+        self.assertFalse(tag.called)
+        self.assertFalse(os.access(self.filepath, os.F_OK))
+
+    def test_content_hash_ignores_salted_date(self):
+        job = {'uid': '1', 'title': 'Trombonist', 'salted_date': 1}
+        salted_job = dict(job, salted_date=2)
+        self.assertEqual(content_hash(job), content_hash(salted_job))
+        self.assertNotEqual(content_hash(job),
+                            content_hash(dict(job, title='Tubist')))
+
     def test_subsidiary_rename(self):
         company1 = CompanyFactory()
         company1.save()
@@ -148,6 +226,16 @@ class ImportJobsTestCase(DirectSEOBase):
             ids = [d['id'] for d in self.solr.search('*:*').docs]
             self.assertTrue([5, 6, 7, 8, 9, 10] not in ids)
 
+    def test_export_pages_with_cursor(self):
+        buid = 12345
+        jobs = [{'id': 'seo.%s' % i, 'buid': buid} for i in range(10)]
+        self.solr.add(jobs)
+        self.solr.commit()
+
+        # A page size smaller than the result set forces several requests.
+        docs = list(self.solr.export(fq="buid:%s" % buid, rows=3))
+        self.assertItemsEqual(docs, [{'id': job['id']} for job in jobs])
+
 
 class LoadETLTestCase(DirectSEOBase):
     def setUp(self):
@@ -178,6 +266,32 @@ class LoadETLTestCase(DirectSEOBase):
                          "it's expected to return %s.  Instead it returned %s" % (38, len(filtered_jobs)))
         
     
+    def test_zipfile_not_extracted(self):
+        """Test that jobs are read without extracting the zipfile."""
+        guid = "ce2ca701-eeca-4c13-96ba-e6bde9cb7060"
+        temp_files = set(os.listdir(tempfile.gettempdir()))
+        extract_error = AssertionError("The zipfile was extracted")
+        with open(self.zipfile) as zf, \
+                patch('zipfile.ZipFile.extractall',
+                      side_effect=extract_error), \
+                patch('zipfile.ZipFile.extract', side_effect=extract_error), \
+                patch('tempfile.SpooledTemporaryFile',
+                      wraps=tempfile.SpooledTemporaryFile) as spooled:
+            jobs = get_jobs_from_zipfile(zf, guid)
+            first_job = next(jobs)
+            # The download is spooled in memory, not written to disk.
+            spool = spooled.call_args
+            self.assertEqual(spooled.call_count, 1)
+            self.assertEqual(spool[1]['max_size'], ZIP_SPOOL_SIZE)
+            # Abandoning the generator part of the way through should clean
+            # up after it.
+            jobs.close()
+
+        self.assertEqual(first_job.tag.split('}')[-1],
+                         'ProcessPositionOpening')
+        self.assertFalse(os.path.exists(os.path.join('/tmp', '0', guid)))
+        self.assertEqual(set(os.listdir(tempfile.gettempdir())), temp_files)
+
     def test_businessunit_ignore_includeinindex(self):
         """Test that filtering on the include_in_index bit can be overridden on a per business unit basis."""
         # Set ignore_includeinindex on the test BusinessUnit
@@ -0,0 +1,77 @@
+import threading
+import time
+
+from import_pipeline import ImportPipeline
+from setup import DirectSEOBase
+
+
+class FakeUpdate(object):
+    def __init__(self, buid, num_chunks):
+        self.buid = buid
+        self.num_chunks = num_chunks
+        self.posted = []
+        self.finished_after = None
+
+    def add_chunks(self):
+        for i in range(self.num_chunks):
+            yield [{'uid': i}]
+
+
+class FakePipeline(ImportPipeline):
+    """
+    An ImportPipeline whose stages don't touch the network, the database
+    or Solr.
+
+    """
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('download', False)
+        super(FakePipeline, self).__init__(*args, **kwargs)
+        self.updates = {}
+        self.lock = threading.Lock()
+        self.concurrent_posts = 0
+        self.max_concurrent_posts = 0
+
+    def parse(self, buid, filepath, conn):
+        if buid == 'bad':
+            raise ValueError("bad feed")
+        update = FakeUpdate(buid, num_chunks=buid)
+        self.updates[buid] = update
+        return update
+
+    def post(self, tracker, update_chunk, conn):
+        with self.lock:
+            self.concurrent_posts += 1
+            self.max_concurrent_posts = max(self.max_concurrent_posts,
+                                            self.concurrent_posts)
+        time.sleep(0.01)
+        tracker.update.posted.append(update_chunk)
+        with self.lock:
+            self.concurrent_posts -= 1
+
+    def finish(self, tracker, conn):
+        update = tracker.update
+        update.finished_after = len(update.posted)
+        self.results[tracker.buid] = (len(update.posted), 0)
+
+
+class ImportPipelineTestCase(DirectSEOBase):
+    def test_every_feed_is_posted_then_finished(self):
+        pipeline = FakePipeline(post_workers=3, queue_size=2)
+        results = pipeline.run([0, 1, 5, 10])
+
+        self.assertEqual(results, {0: (0, 0), 1: (1, 0), 5: (5, 0),
+                                   10: (10, 0)})
+        for buid, update in pipeline.updates.items():
+            # Finishing a feed only happens once all of its chunks are in.
+            self.assertEqual(update.finished_after, buid)
+        self.assertLessEqual(pipeline.max_concurrent_posts, 3)
+        self.assertEqual(pipeline.stats['post'].docs, 16)
+        self.assertEqual(pipeline.stats['parse'].items, 4)
+
+    def test_failed_feed_does_not_stop_others(self):
+        pipeline = FakePipeline()
+        results = pipeline.run(['bad', 2])
+
+        self.assertIsInstance(results['bad'], ValueError)
+        self.assertEqual(results[2], (2, 0))
+        self.assertEqual(pipeline.stats['parse'].errors, 1)
@@ -1,10 +1,12 @@
 import django.core.cache
 import django.utils.cache
+from django.contrib.auth.models import AnonymousUser
+from django.test.client import RequestFactory
 
 from mock import patch, Mock
 
 import middleware
-from seo import cache, models
+from seo import cache, models, solr_cache
 from seo.tests.setup import DirectSEOTestCase, patch_settings
 from seo.tests import factories
 from seo.views import search_views as views
@@ -28,7 +30,8 @@ class LocalCacheTestCase(DirectSEOTestCase):
                               cache,
                               views,
                               seo_extras,
-                              middleware]
+                              middleware,
+                              solr_cache]
         self.cache_patches = []
         for module in self.cache_modules:
             self.cache_patches.append(patch.object(module, 'cache',
@@ -221,3 +224,72 @@ class LocalCacheTestCase(DirectSEOTestCase):
             self.assertNotEqual(response.context, None)
             self.assertTrue(len(response.context['default_jobs']) > 0)
             self.assertNotEqual(response.content.find('Yet Another Header'), -1)
+
+    def test_cached_site_bundle(self):
+        """
+        Once a site's bundle is cached, MultiHostMiddleware doesn't query
+        the database, and changing one of the site's facets clears it.
+
+        """
+        site = factories.SeoSiteFactory(domain=u'oranges.jobs')
+        site.business_units.add(self.businessunit)
+        site_facet = factories.SeoSiteFacetFactory(
+            seosite=site, facet_type=models.SeoSiteFacet.DEFAULT)
+
+        def process_request():
+            request = RequestFactory().get('/', HTTP_HOST=site.domain)
+            request.user = AnonymousUser()
+            middleware.MultiHostMiddleware().process_request(request)
+            return request.site_context
+
+        context = process_request()
+        self.assertEqual(context.SITE_BUIDS, [self.businessunit.id])
+        self.assertEqual([facet.pk for facet in context.DEFAULT_FACET],
+                         [site_facet.customfacet.pk])
+
+        with self.assertNumQueries(0):
+            context = process_request()
+        self.assertEqual(context.SITE_ID, site.id)
+        self.assertEqual(context.DEFAULT_FACET[0].boolean_operation,
+                         site_facet.boolean_operation)
+
+        site_facet.facet_type = models.SeoSiteFacet.FEATURED
+        site_facet.save()
+        context = process_request()
+        self.assertEqual(context.DEFAULT_FACET, [])
+        self.assertEqual([facet.pk for facet in context.FEATURED_FACET],
+                         [site_facet.customfacet.pk])
+
+    def test_solr_result_cache(self):
+        """
+        Cached Solr results are shared between identical queries, served
+        while stale and refreshed in the background, and expired when one
+        of the business units they're filtered on is cleared.
+
+        """
+        result_cache = solr_cache.SolrResultCache(ttl=60, stale_ttl=60)
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            return len(calls)
+
+        params = {'q': '*:*', 'fq': ['buid:(1 OR 2)', 'country:USA']}
+        same_params = {'fq': ['country:USA', 'buid:(1 OR 2)'], 'q': '*:*'}
+        other_buid = {'q': '*:*', 'fq': ['buid:3']}
+        self.assertEqual(result_cache.get(params, fetch), 1)
+        self.assertEqual(result_cache.get(same_params, fetch), 1)
+        self.assertEqual(result_cache.get(other_buid, fetch), 2)
+
+        stale = solr_cache.SolrResultCache(ttl=-1, stale_ttl=120)
+        stale.get({'q': 'stale'}, fetch)
+        with patch.object(solr_cache.threading, 'Thread') as thread:
+            self.assertEqual(stale.get({'q': 'stale'}, fetch), 3)
+            self.assertEqual(stale.get({'q': 'stale'}, fetch), 3)
+        # Only one refresh is started while the first holds the lock.
+        self.assertEqual(thread.call_count, 1)
+
+        with patch_settings(SOLR_RESULT_CACHE_TTL=60):
+            task_clear_bu_cache(2)
+        self.assertEqual(result_cache.get(params, fetch), 4)
+        self.assertEqual(result_cache.get(other_buid, fetch), 2)
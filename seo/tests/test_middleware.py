@@ -1,10 +1,18 @@
 import datetime
 
 from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.test.client import RequestFactory
+from mock import patch
 
 from seo.tests.factories import (SeoSiteFactory, SeoSiteRedirectFactory)
+from middleware import MultiHostMiddleware, SolrStatsMiddleware
 from seo.models import BusinessUnit, SeoSite
-from setup import DirectSEOBase
+from seo.site_context import (SiteContext, get_site_context,
+                              set_site_context, site_settings)
+from setup import DirectSEOBase, patch_settings
+import solr_stats
 
 
 class SiteRedirectMiddlewareTestCase(DirectSEOBase):
@@ -88,3 +96,98 @@ class MultiHostMiddlewareTestCase(DirectSEOBase):
         self.assertEqual(settings.SITE_ID, 1)
         self.assertEqual(settings.SITE_NAME, site.name)
         self.assertEqual(len(settings.SITE_BUIDS), site.business_units.all().count())
+
+    def test_site_context(self):
+        """
+        The site configuration is attached to the request, and is only the
+        current site context while that request is being handled.
+
+        """
+        request = RequestFactory().get('/', HTTP_HOST=self.test_site.domain)
+        request.user = AnonymousUser()
+        middleware = MultiHostMiddleware()
+        middleware.process_request(request)
+        context = request.site_context
+        self.assertIs(get_site_context(), context)
+        self.assertEqual(context.SITE_ID, self.test_site.id)
+        self.assertEqual(context.SITE_NAME, self.test_site.name)
+        self.assertEqual(context.CACHE_MIDDLEWARE_KEY_PREFIX,
+                         self.test_site.domain)
+
+        middleware.process_response(request, HttpResponse())
+        # Outside of a request, site_settings falls back to settings.
+        self.assertIsNot(get_site_context(), context)
+        self.assertEqual(site_settings.SITE_NAME, settings.SITE_NAME)
+
+    def test_site_settings(self):
+        """
+        site_settings reads site-specific values from the current context
+        and everything else from settings.
+
+        """
+        set_site_context(SiteContext(SITE_NAME=u'context name'))
+        try:
+            self.assertEqual(site_settings.SITE_NAME, u'context name')
+            self.assertEqual(site_settings.SITE_ID, settings.SITE_ID)
+            self.assertEqual(site_settings.DEBUG, settings.DEBUG)
+        finally:
+            set_site_context(None)
+        self.assertEqual(site_settings.SITE_NAME, settings.SITE_NAME)
+        self.assertRaises(TypeError, SiteContext, NOT_A_SITE_SETTING=1)
+
+
+def solr_view(request):
+    return HttpResponse()
+
+
+class SolrStatsMiddlewareTestCase(DirectSEOBase):
+    def test_request_stats(self):
+        """
+        The Solr queries made while a view runs are counted against it, and
+        summarized in a response header in debug mode.
+
+        """
+        solr_stats.reset_counters()
+        request = RequestFactory().get('/')
+        middleware = SolrStatsMiddleware()
+        middleware.process_request(request)
+        middleware.process_view(request, solr_view, (), {})
+        self.conn.search('*:*')
+        with patch_settings(DEBUG=True):
+            response = middleware.process_response(request, HttpResponse())
+
+        self.assertTrue(response['X-Solr-Queries'].startswith('count=1 '))
+        view = 'seo.tests.test_middleware.solr_view'
+        self.assertEqual(solr_stats.counters()[view]['queries'], 1)
+
+        # Queries made outside of a view aren't counted against one.
+        self.conn.search('*:*')
+        self.assertEqual(solr_stats.counters()[view]['queries'], 1)
+
+    def test_slow_query_log(self):
+        with patch_settings(SOLR_SLOW_QUERY_MS=0):
+            with patch.object(solr_stats.logger, 'warning') as warning:
+                self.conn.search('title:slow')
+        self.assertEqual(warning.call_count, 1)
+        url = warning.call_args[0][6]
+        self.assertIn('q=title%3Aslow', url)
+
+    def test_slow_query_log_body(self):
+        """
+        Long request bodies, such as those of updates, are cut short in the
+        slow query log but kept whole in the request's stats.
+
+        """
+        body = '<add>%s</add>' % ('x' * 10000)
+        stats = solr_stats.start_request('view')
+        try:
+            with patch_settings(SOLR_SLOW_QUERY_MS=0):
+                with patch.object(solr_stats.logger, 'warning') as warning:
+                    solr_stats.record('post', '/solr/update/', body, 1.0, '')
+        finally:
+            solr_stats.finish_request()
+        logged = warning.call_args[0][7]
+        self.assertTrue(logged.startswith(
+            body[:solr_stats.SLOW_QUERY_BODY_LENGTH]))
+        self.assertLess(len(logged), len(body))
+        self.assertEqual(stats.queries[0]['body'], body)
@@ -1,8 +1,11 @@
+from mock import patch
+
 from seo.models import User
 
+from postajob.tests.factories import SitePackageFactory
 from seo.tests import factories
-from seo.models import Company
-from setup import DirectSEOBase
+from seo.models import Company, SeoSite, job_business_units, job_sites
+from setup import DirectSEOBase, patch_settings
 
 
 class SignalsTestCase(DirectSEOBase):
@@ -42,6 +45,42 @@ class SignalsTestCase(DirectSEOBase):
         company = Company.objects.get(id=self.company.id)
         self.assertEqual(company.canonical_microsite, 'http://nuckconsultants.jobs')
 
+    def test_retag_custom_facet_jobs(self):
+        """
+        Adding a standard facet to a site retags the jobs of every business
+        unit it shows, including through site packages or by showing every
+        job, without re-importing them.
+
+        """
+        plain_bu = factories.BusinessUnitFactory(id=101)
+        packaged_bu = factories.BusinessUnitFactory(id=102)
+        site_bu = factories.BusinessUnitFactory(id=103)
+        package_site = factories.SeoSiteFactory(id=51, domain='package.jobs')
+        package_site.business_units.add(site_bu)
+        package = SitePackageFactory()
+        package.sites.add(package_site)
+        packaged_bu.site_packages.add(package)
+
+        # self.site has no business units, so it shows every job that isn't
+        # only on site packages.
+        self.assertIn(self.site, job_sites(plain_bu.id))
+        self.assertNotIn(self.site, job_sites(packaged_bu.id))
+        self.assertEqual(list(job_sites(packaged_bu.id)), [package_site])
+        self.assertNotIn(package_site, job_sites(plain_bu.id))
+        buids = job_business_units(SeoSite.objects.filter(pk=self.site.pk))
+        self.assertIn(plain_bu.id, buids)
+        self.assertNotIn(packaged_bu.id, buids)
+
+        with patch_settings(CUSTOM_FACET_COUNTS_FROM_INDEX=True), \
+                patch('tasks.task_tag_custom_facets.delay') as tag, \
+                patch('tasks.task_update_solr.delay') as update:
+            factories.SeoSiteFacetFactory(seosite=package_site)
+        self.assertFalse(update.called)
+        self.assertEqual(sorted(call[0][0] for call in tag.call_args_list),
+                         [packaged_bu.id, site_bu.id])
+        self.assertTrue(all(call[1] == {'clear_cache': True}
+                            for call in tag.call_args_list))
+
 
 class AdminSignalsTestCase(SignalsTestCase):
 
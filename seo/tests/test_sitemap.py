@@ -1,12 +1,21 @@
 # -*- coding: utf-8 -*-
 import datetime
+import os
+import shutil
+import tempfile
 
 from django.conf import settings
+from django.core.cache import get_cache
+from mock import patch
 
 from seo_pysolr import Solr
 from seo.models import SeoSite
+from seo.sitemap import (date_shard_name, gunzip, index_shard_name,
+                         shard_path, write_shards, write_site_sitemaps)
+from seo.tests import factories
 from seo.tests.solr_settings import SOLR_FIXTURE
-from setup import DirectSEOBase
+from setup import DirectSEOBase, patch_settings
+import tasks
 
 
 class SitemapTestCase(DirectSEOBase):
@@ -19,6 +28,21 @@ class SitemapTestCase(DirectSEOBase):
         resp = self.client.get("/sitemap.xml")
         self.assertEqual(resp.status_code, 200)
         
+    def test_request_site_sitemaps(self):
+        """
+        Sitemaps link to the site the request is for, even when its
+        configuration isn't copied onto settings.
+
+        """
+        site = factories.SeoSiteFactory(domain='sitemaps.jobs')
+        dt = datetime.date.today().isoformat()
+        with patch_settings(SITE_CONTEXT_MIRROR_SETTINGS=False):
+            resp = self.client.get("/sitemap.xml", HTTP_HOST=site.domain)
+            self.assertIn('http://%s/' % site.domain, resp.content)
+            resp = self.client.get("/sitemap-" + dt + ".xml",
+                                   HTTP_HOST=site.domain)
+            self.assertIn('<loc>http://%s/' % site.domain, resp.content)
+
     def test_no_buid_sitemap(self):
         """
         Test to verify that a sitemap is generated with sites that have no
@@ -71,6 +95,77 @@ class SitemapTestCase(DirectSEOBase):
         self.assertEqual(resp.status_code, 200)
         self.assertTrue("<url>" in resp.content)
         
+    def test_stored_sitemaps(self):
+        """
+        Sitemaps stored by write_site_sitemaps() are served as they were
+        stored, gzipped if the client accepts that, and sitemaps that
+        aren't stored are generated as usual.
+
+        """
+        site = SeoSite.objects.get(pk=1)
+        site.business_units = []
+        site.save()
+        live_index = self.client.get("/sitemap.xml").content
+
+        shard_dir = tempfile.mkdtemp()
+        try:
+            with patch_settings(SITEMAP_SHARD_DIR=shard_dir):
+                write_site_sitemaps(site)
+                self.assertTrue(os.path.exists(
+                    shard_path(site.domain, index_shard_name('https'))))
+
+                resp = self.client.get("/sitemap.xml",
+                                       HTTP_ACCEPT_ENCODING='gzip')
+                self.assertEqual(resp['Content-Encoding'], 'gzip')
+                self.assertEqual(gunzip(resp.content), live_index)
+                resp = self.client.get("/sitemap.xml")
+                self.assertFalse(resp.has_header('Content-Encoding'))
+                self.assertEqual(resp.content, live_index)
+
+                # Stored sitemaps are served without asking Solr, and
+                # storing a site's sitemaps replaces all of its old ones.
+                dt = datetime.date.today().isoformat()
+                write_shards(site.domain, {date_shard_name(dt): '<urlset/>'})
+                resp = self.client.get("/sitemap-" + dt + ".xml")
+                self.assertEqual(resp.content, '<urlset/>')
+                # Other sites don't get this site's stored sitemaps, even
+                # when the request's site isn't copied onto settings.
+                other_site = factories.SeoSiteFactory(domain='other.jobs')
+                with patch_settings(SITE_CONTEXT_MIRROR_SETTINGS=False):
+                    resp = self.client.get("/sitemap-" + dt + ".xml",
+                                           HTTP_HOST=other_site.domain)
+                self.assertNotEqual(resp.content, '<urlset/>')
+                resp = self.client.get("/sitemap.xml")
+                self.assertEqual(resp.content, live_index)
+        finally:
+            shutil.rmtree(shard_dir)
+
+    def test_generate_sitemaps_coalesced(self):
+        """
+        A site's sitemaps are only queued for regeneration once for all the
+        imports that finish before that regeneration starts.
+
+        """
+        site = SeoSite.objects.get(pk=1)
+        site.business_units = []
+        site.save()
+        cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        with patch_settings(SITEMAP_SHARD_DIR=tempfile.gettempdir()), \
+                patch('tasks.cache', cache), \
+                patch('tasks.task_generate_site_sitemaps.apply_async') as \
+                generate:
+            tasks.task_generate_sitemaps(SOLR_FIXTURE[0]['buid'])
+            queued = [call[1]['args'] for call in generate.call_args_list]
+            self.assertIn([site.pk], queued)
+            tasks.task_generate_sitemaps(SOLR_FIXTURE[0]['buid'] + 1)
+            self.assertEqual(generate.call_count, len(queued))
+
+            with patch('tasks.write_site_sitemaps'):
+                tasks.task_generate_site_sitemaps(site.pk)
+            tasks.task_generate_sitemaps(SOLR_FIXTURE[0]['buid'])
+            self.assertEqual(generate.call_count, len(queued) + 1)
+            self.assertEqual(generate.call_args[1]['args'], [site.pk])
+
     def tearDown(self):
         super(SitemapTestCase, self).tearDown()
         self.conn.delete("*:*")
@@ -1,10 +1,18 @@
+import threading
+
+import pysolr
+import requests
 from django.conf import settings
 from django.core.urlresolvers import reverse
+from django.test import TestCase
+from mock import Mock, patch
 
 from seo.models import SeoSite
+from seo.search_backend import DESearchQuerySet, GroupedSearch, SearchFanOut
 from seo.tests import factories
 from seo.tests.solr_settings import SOLR_FIXTURE
-from setup import DirectSEOTestCase
+from seo_pysolr import Solr, pool_stats
+from setup import DirectSEOTestCase, patch_settings
 from universal.helpers import build_url
 
 
@@ -125,4 +133,101 @@ class QueryCountTests(DirectSEOTestCase):
 
         # Confirm we've actually reached a description page
         # by checking for the title in the response.
-        self.assertIn(title, resp.content)
\ No newline at end of file
+        self.assertIn(title, resp.content)
+
+
+class SearchFanOutTests(TestCase):
+    class FakeQuerySet(object):
+        def __init__(self, wait_for=None, ready=None, error=None):
+            self.wait_for = wait_for
+            self.ready = ready or threading.Event()
+            self.error = error
+            self.counted = False
+            self.overlapped = False
+
+        def count(self):
+            self.ready.set()
+            if self.wait_for is not None:
+                # Only set if the other query is running at the same time.
+                self.overlapped = self.wait_for.wait(5) or False
+            if self.error:
+                raise self.error
+            self.counted = True
+            return 1
+
+    def test_queries_run_concurrently(self):
+        first = self.FakeQuerySet()
+        second = self.FakeQuerySet(wait_for=first.ready)
+        first.wait_for = second.ready
+
+        fanout = SearchFanOut()
+        self.assertIs(fanout.count(first), first)
+        fanout.count(second)
+        fanout.run()
+
+        self.assertTrue(first.counted and second.counted)
+        self.assertTrue(first.overlapped and second.overlapped)
+        self.assertEqual(fanout.pending, [])
+
+    def test_errors_are_raised_after_all_queries_finish(self):
+        failing = self.FakeQuerySet(error=ValueError("Solr is down"))
+        working = self.FakeQuerySet()
+
+        fanout = SearchFanOut()
+        fanout.count(working)
+        fanout.count(failing)
+        self.assertRaises(ValueError, fanout.run)
+        self.assertTrue(working.counted)
+
+    def test_grouped_facet_counts(self):
+        """
+        Querysets that can't be grouped have their facet counts fetched by
+        the fan-out when no results are wanted from them.
+
+        """
+        sqs = DESearchQuerySet().facet('title')
+        fanout = SearchFanOut()
+        self.assertIsNone(fanout.grouped([sqs], 0))
+        self.assertEqual(fanout.pending, [sqs.facet_counts])
+        self.assertEqual(sqs.query.end_offset, 0)
+
+    def test_group_query(self):
+        self.assertEqual(GroupedSearch.group_query(set()), '*:*')
+        self.assertEqual(
+            GroupedSearch.group_query(set(['buid:1', 'NOT uid:(2 OR 3)'])),
+            '(*:* NOT uid:(2 OR 3)) AND (buid:1)')
+
+
+class SolrPoolTests(TestCase):
+    url = 'http://127.0.0.1:8983/solr/seo'
+
+    def test_clients_share_a_pool(self):
+        first, second = Solr(self.url), Solr(self.url)
+        self.assertIs(first.session, second.session)
+
+        requests_before = pool_stats()['http://127.0.0.1:8983']['requests']
+        first.search('*:*')
+        second.search('*:*')
+        self.assertEqual(
+            pool_stats()['http://127.0.0.1:8983']['requests'],
+            requests_before + 2)
+
+    def test_connection_errors_are_retried(self):
+        conn = Solr(self.url)
+        response = Mock(status_code=200,
+                        content='{"response": {"numFound": 0, "docs": []}}')
+        errors = [requests.exceptions.ConnectionError(), response]
+        with patch_settings(SOLR_RETRIES=1, SOLR_RETRY_BACKOFF=0):
+            with patch.object(conn.session, 'get',
+                              side_effect=errors) as get:
+                self.assertEqual(conn.search('*:*').hits, 0)
+        self.assertEqual(get.call_count, 2)
+
+    def test_update_timeouts_are_not_retried(self):
+        conn = Solr(self.url)
+        timeout = requests.exceptions.Timeout()
+        with patch_settings(SOLR_RETRIES=1, SOLR_RETRY_BACKOFF=0):
+            with patch.object(conn.session, 'post',
+                              side_effect=timeout) as post:
+                self.assertRaises(pysolr.SolrError, conn.add, [{'id': '1'}])
+        self.assertEqual(post.call_count, 1)
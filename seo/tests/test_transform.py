@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
 import datetime
+import os
 
 from django.conf import settings
 
-from transform import transform_for_postajob
-from seo.tests.factories import CompanyFactory
+from import_jobs import get_jobs_from_zipfile
+from transform import (TransformContext, hr_xml_to_json, make_redirects,
+                       transform_for_postajob)
+from moc_coding.helpers import MocIndex
+from seo.models import Country, Redirect
+from seo.tests.factories import BusinessUnitFactory, CompanyFactory
 from setup import DirectSEOBase
 
 
@@ -109,3 +114,50 @@ class TransformJobs(DirectSEOBase):
 
             for key in temp_result.keys():
                 self.assertEqual(cleaned_job[key], temp_result[key])
+
+    def test_hr_xml_to_json_with_context(self):
+        guid = "ce2ca701-eeca-4c13-96ba-e6bde9cb7060"
+        zip_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'data', 'ActiveDirectory_%s.zip' % guid)
+        with open(zip_path) as zf:
+            xml_jobs = list(get_jobs_from_zipfile(zf, guid))
+        Country.objects.get_or_create(abbrev='USA', name='United States')
+        business_unit = BusinessUnitFactory(id=1234)
+        CompanyFactory(name='Acme Incorporated').job_source_ids.add(
+            business_unit)
+
+        expected = [hr_xml_to_json(xml, business_unit) for xml in xml_jobs]
+
+        context = TransformContext(business_unit, moc_index=MocIndex.build())
+        with self.assertNumQueries(0):
+            jobs = [hr_xml_to_json(xml, business_unit, context=context)
+                    for xml in xml_jobs]
+
+        ignored = ['salted_date']
+        for job, expected_job in zip(jobs, expected):
+            for field in ignored:
+                job.pop(field)
+                expected_job.pop(field)
+            self.assertEqual(job, expected_job)
+
+        redirects = make_redirects(jobs, context)
+        self.assertEqual(len(redirects), len(jobs))
+        self.assertEqual(Redirect.objects.filter(buid=1234).count(),
+                         len(set(r.guid for r in redirects)))
+
+        # Nothing changed, so the second time around nothing is written.
+        with self.assertNumQueries(0):
+            links = [r.make_link() for r in make_redirects(jobs, context)]
+        self.assertEqual(links, [r.make_link() for r in redirects])
+
+        # Changed links are written with one query per batch.
+        for i, job in enumerate(jobs):
+            job['link'] = 'http://example.com/job/%s' % i
+        changed = len(set(r.guid for r in redirects))
+        with self.assertNumQueries((changed + 1) // 2):
+            make_redirects(jobs, context, batch_size=2)
+        urls = dict((redirect.guid, job['link'])
+                    for redirect, job in zip(redirects, jobs))
+        for guid, url in urls.items():
+            self.assertEqual(Redirect.objects.get(guid=guid).url, url)
+
@@ -4,7 +4,9 @@ from copy import deepcopy
 import default_settings
 import itertools
 import json
+import re
 from StringIO import StringIO
+import time
 
 from django.contrib.auth.models import AnonymousUser
 from django.conf import settings
@@ -14,7 +16,7 @@ from django.contrib.redirects.models import Redirect
 from django.template import Template, Context
 from django.template import RequestContext as TemplateContext
 from django.test.client import RequestFactory
-from django.utils.http import urlquote
+from django.utils.http import http_date, urlquote
 from django.core.urlresolvers import reverse
 
 from BeautifulSoup import BeautifulSoup
@@ -32,6 +34,7 @@ from postajob.models import SitePackage
 from postajob.tests.factories import (JobFactory, JobLocationFactory,
                                       SitePackageFactory)
 from seo import helpers
+from seo.filters import FacetListWidget
 from seo.tests.setup import (connection, DirectSEOBase, DirectSEOTestCase,
                              patch_settings)
 from seo.models import (BusinessUnit, Company, Configuration, CustomPage,
@@ -876,6 +879,52 @@ class SeoSiteTestCase(DirectSEOTestCase):
         featured_jobs = resp.context['featured_jobs']
         self.assertEqual(len(featured_jobs), 1)
 
+    def test_grouped_featured_jobs(self):
+        """
+        Fetching default and featured jobs with one grouped request should
+        give the same jobs, counts and facets as fetching them separately.
+
+        """
+        group = factories.GroupFactory()
+        site = factories.SeoSiteFactory(group=group)
+        featured_job = self.solr_docs[1]
+
+        default_cf = factories.CustomFacetFactory(
+            name="Default Facet",
+            querystring=u'id:({i1} OR {i2})'.format(
+                i1=self.solr_docs[0]['id'],
+                i2=self.solr_docs[1]['id']),
+            group=group)
+        featured_cf = factories.CustomFacetFactory(
+            name="Featured Facet",
+            querystring='uid:%s' % featured_job['uid'],
+            group=group)
+        factories.SeoSiteFacetFactory(customfacet=default_cf, seosite=site,
+                                      facet_type=SeoSiteFacet.DEFAULT)
+        factories.SeoSiteFacetFactory(customfacet=featured_cf, seosite=site,
+                                      facet_type=SeoSiteFacet.FEATURED)
+
+        def search_results(group_featured_jobs):
+            with patch_settings(GROUP_FEATURED_JOBS=group_featured_jobs):
+                resp = self.client.get('/jobs/',
+                                       HTTP_HOST='buckconsultants.jobs')
+            self.assertEqual(resp.status_code, 200)
+            context = resp.context
+            # Facets with equal counts can come back in either order.
+            facets = sorted((widget.widget_type, sorted(widget.items))
+                            for widget in context['widgets']
+                            if type(widget) is FacetListWidget)
+            return ([str(job.uid) for job in context['default_jobs']],
+                    [str(job.uid) for job in context['featured_jobs']],
+                    context['count_heading'],
+                    facets)
+
+        separate = search_results(False)
+        grouped = search_results(True)
+        self.assertEqual(grouped, separate)
+        self.assertEqual(len(grouped[0]), 1)
+        self.assertEqual(grouped[1], [featured_job['uid']])
+
     def test_default_custom_facets_homepage(self):
         """
         Tests that custom facets are applied to ajax_get_jobs when viewing all
@@ -1864,6 +1913,117 @@ class SeoViewsTestCase(DirectSEOTestCase):
                     next_link = next_link.get('href')
             self.assertEqual(num_pages, 2)
 
+    def test_syndicate_feed_streaming(self):
+        """
+        Feeds of more than FEED_STREAM_MIN_ITEMS jobs are streamed a chunk
+        of jobs at a time, with the same content as when they're built in
+        one go.
+
+        """
+        site = SeoSite.objects.get(id=1)
+        site.business_units = [self.buid_id]
+        site.save()
+        # Streamed RSS and Atom feeds take their build date from the first
+        # chunk of jobs rather than all of them.
+        strip_dates = lambda content: re.sub(
+            r'<(lastBuildDate|updated)>[^<]*<', '', content)
+
+        with connection(connections_info=solr_settings.HAYSTACK_CONNECTIONS):
+            for feed_type in ['xml', 'indeed', 'json', 'jsonp', 'rss',
+                              'atom']:
+                url = '/feed/%s' % feed_type
+                resp = self.client.get(url)
+                self.assertFalse(resp.streaming)
+                expected = resp.content
+
+                with patch_settings(FEED_STREAM_MIN_ITEMS=0,
+                                    FEED_STREAM_CHUNK_SIZE=1):
+                    resp = self.client.get(url)
+                self.assertEqual(resp.status_code, 200)
+                self.assertTrue(resp.streaming)
+                content = ''.join(resp.streaming_content)
+                self.assertEqual(strip_dates(content), strip_dates(expected))
+
+    def test_syndicate_feed_conditional_get(self):
+        """
+        A feed whose jobs haven't changed since the client last fetched it
+        gets a 304.
+
+        """
+        site = SeoSite.objects.get(id=1)
+        site.business_units = [self.buid_id]
+        site.save()
+
+        with connection(connections_info=solr_settings.HAYSTACK_CONNECTIONS):
+            resp = self.client.get('/feed/xml')
+            self.assertEqual(resp.status_code, 200)
+            etag = resp['ETag']
+
+            resp = self.client.get('/feed/xml', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(resp.status_code, 304)
+            # The same jobs in a different format are a different feed.
+            resp = self.client.get('/feed/json', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(resp.status_code, 200)
+
+            self.conn.delete(id=self.solr_docs[0]['id'])
+            resp = self.client.get('/feed/xml', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotEqual(resp['ETag'], etag)
+
+    def test_syndicate_feed_site_links(self):
+        """
+        RSS and Atom feed links point to the site the request is for, even
+        when its configuration isn't copied onto settings, including the
+        links in the chunks of a streamed feed written after the request
+        was handled.
+
+        """
+        site = factories.SeoSiteFactory(domain='feedlinks.jobs')
+        site.business_units = [self.buid_id]
+        site.save()
+        links = ['http://%s/%s' % (site.domain, doc['guid'])
+                 for doc in self.solr_docs[:2]]
+
+        with connection(connections_info=solr_settings.HAYSTACK_CONNECTIONS):
+            for feed_type in ['rss', 'atom']:
+                with patch_settings(SITE_CONTEXT_MIRROR_SETTINGS=False):
+                    resp = self.client.get('/feed/%s' % feed_type,
+                                           HTTP_HOST=site.domain)
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn(links[0], resp.content)
+
+                with patch_settings(SITE_CONTEXT_MIRROR_SETTINGS=False,
+                                    FEED_STREAM_MIN_ITEMS=0,
+                                    FEED_STREAM_CHUNK_SIZE=1):
+                    resp = self.client.get('/feed/%s' % feed_type,
+                                           HTTP_HOST=site.domain)
+                    # Another request has been handled since.
+                    self.client.get('/feed/%s' % feed_type)
+                    content = ''.join(resp.streaming_content)
+                self.assertTrue(resp.streaming)
+                for link in links:
+                    self.assertIn(link, content)
+
+    def test_syndicate_feed_if_modified_since(self):
+        """
+        Feeds don't answer If-Modified-Since with a 304, as removing a job
+        from a feed doesn't make any of its jobs newer.
+
+        """
+        site = SeoSite.objects.get(id=1)
+        site.business_units = [self.buid_id]
+        site.save()
+
+        with connection(connections_info=solr_settings.HAYSTACK_CONNECTIONS):
+            resp = self.client.get('/feed/xml')
+            self.assertEqual(resp.status_code, 200)
+            self.assertFalse(resp.has_header('Last-Modified'))
+
+            self.conn.delete(id=self.solr_docs[0]['id'])
+            resp = self.client.get('/feed/xml', HTTP_IF_MODIFIED_SINCE=(
+                http_date(time.time() + 60 * 60 * 24)))
+            self.assertEqual(resp.status_code, 200)
+
     def test_syndicate_feed_offset_larger_than_num_records(self):
         """Validate that when the offset is greater than the number of records,
         we return an empty document.
@@ -332,6 +332,37 @@ class JobFeedTestCase(DirectSEOBase):
         """
         result = DEv2JobFeed(self.invalid_feed, jsid=0)
 
+    def test_stream_matches_parse(self):
+        """
+        Test that streaming mode yields the same jobs as parsing the whole
+        feed file at once.
+
+        """
+        parsed = DEv2JobFeed('seo/tests/data/dseo_feed_0.xml', jsid=0)
+        streamed = DEv2JobFeed('seo/tests/data/dseo_feed_0.xml', jsid=0,
+                               stream=True)
+        self.assertFalse(streamed.errors)
+        self.assertEqual(streamed.job_source_name, parsed.job_source_name)
+        self.assertEqual(streamed.crawled_date, parsed.crawled_date)
+        self.assertEqual(streamed.jobparse(), parsed.jobparse())
+
+        parsed_jobs = parsed.solr_jobs()
+        streamed_jobs = list(streamed.iter_solr_jobs())
+        self.assertEqual(len(streamed_jobs), len(parsed_jobs))
+        for streamed_job, parsed_job in zip(streamed_jobs, parsed_jobs):
+            self.assertEqual(streamed_job['uid'], parsed_job['uid'])
+            self.assertEqual(streamed_job['title'], parsed_job['title'])
+            self.assertEqual(streamed_job['html_description'],
+                             parsed_job['html_description'])
+
+    def test_stream_invalid_feed(self):
+        """
+        Test that schema validation still happens in streaming mode.
+
+        """
+        result = DEv2JobFeed(self.invalid_feed, jsid=0, stream=True)
+        self.assertTrue(result.errors)
+
     def test_no_onets(self):
         result = DEv2JobFeed(self.no_onet_feed, jsid=0)
         jobs = result.solr_jobs()
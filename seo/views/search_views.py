@@ -1,9 +1,11 @@
 import datetime
+import hashlib
 import itertools
 import json
 import logging
 from lxml import etree
 import operator
+import re
 from fsm.views import FSMView
 import urllib
 import json as simplejson
@@ -13,7 +15,6 @@ from urlparse import urlparse, urlunparse
 from django.conf import settings
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.sites.models import Site
-from django.contrib.syndication.views import Feed
 from django.contrib.humanize.templatetags.humanize import intcomma
 from django.core import urlresolvers
 from django.core.paginator import EmptyPage, PageNotAnInteger
@@ -21,16 +22,19 @@ from django.core.urlresolvers import reverse
 from django.db.models import Q
 from django.http import (HttpResponse, Http404, HttpResponseNotFound,
                          HttpResponseRedirect, HttpResponseServerError,
-                         QueryDict)
+                         QueryDict, StreamingHttpResponse)
 from django.contrib.auth.decorators import login_required
 from django.core.cache import cache
 from django.shortcuts import get_object_or_404, redirect, render_to_response
 from django.template import RequestContext, loader
 from django.template.defaultfilters import safe
+from django.utils.cache import patch_vary_headers
 from django.utils.decorators import method_decorator
 from django.utils.encoding import smart_str, iri_to_uri
 from django.utils.feedgenerator import Atom1Feed
+from django.utils.http import quote_etag
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
 
 from slugify import slugify
 
@@ -47,8 +51,10 @@ from myblocks.models import SearchResultBlock, Page
 from myblocks import context_tools
 from seo.templatetags.seo_extras import facet_text, smart_truncate
 from seo.breadbox import Breadbox
-from seo.cache import get_custom_facets, get_site_config, get_total_jobs_count
-from seo.search_backend import DESearchQuerySet
+from seo.cache import (cache_page_prefix, get_custom_facets, get_site_config,
+                       get_total_jobs_count, prefetch_custom_facets,
+                       prefetch_total_jobs_count)
+from seo.search_backend import DESearchQuerySet, SearchFanOut
 from seo import helpers
 from seo.filters import FacetListWidget
 from seo.forms.admin_forms import UploadJobFileForm
@@ -56,7 +62,8 @@ from seo.models import (BusinessUnit, Company, Configuration, Country,
                         GoogleAnalytics, JobFeed, SeoSite, SiteTag)
 from seo.decorators import (sns_json_message, custom_cache_page, protected_site,
                             home_page_check)
-from seo.sitemap import DateSitemap
+from seo.site_context import site_settings
+from seo import sitemap
 from seo.templatetags.seo_extras import filter_carousel
 from transform import hr_xml_to_json
 
@@ -75,16 +82,18 @@ items down to what we actually need.
 """
 LOG = logging.getLogger('views')
 
+ACCEPTS_GZIP = re.compile(r'\bgzip\b')
+
 
 def find_page(request, page_type):
     page = None
     if request.user.is_authenticated() and request.user.is_staff:
-        page = Page.objects.filter(sites=settings.SITE,
+        page = Page.objects.filter(sites=site_settings.SITE,
                                    status=Page.STAGING,
                                    page_type=page_type).first()
 
     if not page:
-        page = Page.objects.filter(sites=settings.SITE,
+        page = Page.objects.filter(sites=site_settings.SITE,
                                    status=Page.PRODUCTION,
                                    page_type=page_type).first()
 
@@ -145,14 +154,14 @@ def ajax_geolocation_facet(request):
     sqs = helpers.prepare_sqs_from_search_params(request.GET)
     sqs = sqs.facet("lat_long_%s_slab" % facet_field_type, limit=-1)
     default_jobs = helpers.get_jobs(default_sqs=sqs,
-                                    custom_facets=settings.DEFAULT_FACET,
-                                    exclude_facets=settings.FEATURED_FACET,
-                                    jsids=settings.SITE_BUIDS,
+                                    custom_facets=site_settings.DEFAULT_FACET,
+                                    exclude_facets=site_settings.FEATURED_FACET,
+                                    jsids=site_settings.SITE_BUIDS,
                                     filters=filters,
                                     facet_limit=num_items,
                                     sort_order=sort_order)
     featured_jobs = helpers.get_featured_jobs(default_sqs=sqs,
-                                              jsids=settings.SITE_BUIDS,
+                                              jsids=site_settings.SITE_BUIDS,
                                               filters=filters,
                                               facet_limit=num_items,
                                               sort_order=sort_order)
@@ -216,16 +225,16 @@ def ajax_get_facets(request, filter_path, facet_type):
         items = []
     else:
         default_jobs = helpers.get_jobs(default_sqs=sqs,
-                                        custom_facets=settings.DEFAULT_FACET,
-                                        exclude_facets=settings.FEATURED_FACET,
-                                        jsids=settings.SITE_BUIDS,
+                                        custom_facets=site_settings.DEFAULT_FACET,
+                                        exclude_facets=site_settings.FEATURED_FACET,
+                                        jsids=site_settings.SITE_BUIDS,
                                         filters=filters,
                                         facet_limit=num_items,
                                         facet_offset=offset,
                                         sort_order=sort_order)
 
         featured_jobs = helpers.get_featured_jobs(default_sqs=sqs,
-                                                  jsids=settings.SITE_BUIDS,
+                                                  jsids=site_settings.SITE_BUIDS,
                                                   filters=filters,
                                                   facet_limit=num_items,
                                                   facet_offset=offset,
@@ -293,19 +302,21 @@ def ajax_get_jobs(request, filter_path):
         num_items = int(GET.get(u'num_items', DEFAULT_PAGE_SIZE))
     except ValueError:
         num_items = DEFAULT_PAGE_SIZE
-    custom_facets = settings.DEFAULT_FACET
+    custom_facets = site_settings.DEFAULT_FACET
     sqs = helpers.prepare_sqs_from_search_params(GET)
     sort_order = request.REQUEST.get('sort', 'relevance')
     default_jobs = helpers.get_jobs(default_sqs=sqs,
                                     custom_facets=custom_facets,
-                                    exclude_facets=settings.FEATURED_FACET,
-                                    jsids=settings.SITE_BUIDS,
+                                    exclude_facets=site_settings.FEATURED_FACET,
+                                    jsids=site_settings.SITE_BUIDS,
                                     filters=filters,
-                                    sort_order=sort_order)
+                                    sort_order=sort_order,
+                                    profile='ajax_listing')
     featured_jobs = helpers.get_featured_jobs(default_sqs=sqs,
-                                              jsids=settings.SITE_BUIDS,
+                                              jsids=site_settings.SITE_BUIDS,
                                               filters=filters,
-                                              sort_order=sort_order)
+                                              sort_order=sort_order,
+                                              profile='ajax_listing')
     (num_featured_jobs, num_default_jobs, featured_offset, default_offset) = \
         helpers.featured_default_jobs(featured_jobs.count(),
                                       default_jobs.count(),
@@ -322,7 +333,7 @@ def ajax_get_jobs(request, filter_path):
 
     # Build the site commitment string
     sitecommit_str = helpers.\
-        make_specialcommit_string(settings.COMMITMENTS.all())
+        make_specialcommit_string(site_settings.COMMITMENTS.all())
     data_dict = {
         'default_jobs':
             default_jobs[default_offset:default_offset+num_default_jobs],
@@ -332,7 +343,7 @@ def ajax_get_jobs(request, filter_path):
         'filters': filters,
         'title_term': request.GET.get('q', '\*'),
         'site_commitments_string': sitecommit_str,
-        'site_tags': settings.SITE_TAGS
+        'site_tags': site_settings.SITE_TAGS
     }
 
     return render_to_response('listing_items.html',
@@ -374,13 +385,13 @@ def job_detail_by_title_slug_job_id(request, job_id, title_slug=None,
 
     search_type = 'guid' if len(job_id) > 31 else 'uid'
     try:
-        the_job = DESearchQuerySet().narrow("%s:(%s)" % (search_type,
-                                                         job_id))[0]
+        sqs = DESearchQuerySet().narrow("%s:(%s)" % (search_type, job_id))
+        the_job = helpers.apply_field_profile(sqs, 'job_detail')[0]
     except IndexError:
         return dseo_404(request)
     else:
-        if settings.SITE_BUIDS and the_job.buid not in settings.SITE_BUIDS:
-            if the_job.on_sites and not (set(settings.SITE_PACKAGES) & set(the_job.on_sites)):
+        if site_settings.SITE_BUIDS and the_job.buid not in site_settings.SITE_BUIDS:
+            if the_job.on_sites and not (set(site_settings.SITE_PACKAGES) & set(the_job.on_sites)):
                 return redirect('home')
 
     breadbox_path = helpers.job_breadcrumbs(the_job,
@@ -445,7 +456,7 @@ def job_detail_by_title_slug_job_id(request, job_id, title_slug=None,
     if (title_slug == the_job.title_slug and
             location_slug == slugify(the_job.location)) \
             and not search_type == 'uid':
-        ga = settings.SITE.google_analytics.all()
+        ga = site_settings.SITE.google_analytics.all()
         host = 'foo'
         link_query = ""
         jobs_count = get_total_jobs_count()
@@ -458,16 +469,16 @@ def job_detail_by_title_slug_job_id(request, job_id, title_slug=None,
             url = urlparse(the_job.link)
             path = url.path.replace("/", "")
             # use the override view source
-            if settings.VIEW_SOURCE:
-                path = "%s%s" % (path[:32], settings.VIEW_SOURCE.view_source)
+            if site_settings.VIEW_SOURCE:
+                path = "%s%s" % (path[:32], site_settings.VIEW_SOURCE.view_source)
 
         # add any ats source code name value pairs
-        ats = settings.ATS_SOURCE_CODES.all()
+        ats = site_settings.ATS_SOURCE_CODES.all()
         if ats:
             link_query += "&".join(["%s" % code for code in ats])
 
         # build the google analytics query string
-        gac = settings.GA_CAMPAIGN
+        gac = site_settings.GA_CAMPAIGN
         gac_data = {
             "campaign_source": "utm_source",
             "campaign_medium": "utm_medium",
@@ -490,7 +501,7 @@ def job_detail_by_title_slug_job_id(request, job_id, title_slug=None,
 
         # Build the site commitment string
         sitecommit_str = helpers.make_specialcommit_string(
-            settings.COMMITMENTS.all())
+            site_settings.COMMITMENTS.all())
 
         data_dict = {
             'the_job': the_job,
@@ -498,11 +509,11 @@ def job_detail_by_title_slug_job_id(request, job_id, title_slug=None,
             'company': company_data,
             'og_img': co.og_img if co else co,
             'google_analytics': ga,
-            'site_name': settings.SITE_NAME,
-            'site_title': settings.SITE_TITLE,
-            'site_heading': settings.SITE_HEADING,
-            'site_tags': settings.SITE_TAGS,
-            'site_description': settings.SITE_DESCRIPTION,
+            'site_name': site_settings.SITE_NAME,
+            'site_title': site_settings.SITE_TITLE,
+            'site_heading': site_settings.SITE_HEADING,
+            'site_tags': site_settings.SITE_TAGS,
+            'site_description': site_settings.SITE_DESCRIPTION,
             'site_commitments_string': sitecommit_str,
             'host': host,
             'site_config': site_config,
@@ -511,7 +522,7 @@ def job_detail_by_title_slug_job_id(request, job_id, title_slug=None,
             'crumbs': breadbox_path,
             'pg_title': pg_title,
             'build_num': settings.BUILD,
-            'view_source': settings.VIEW_SOURCE,
+            'view_source': site_settings.VIEW_SOURCE,
             'search_url': '/jobs/',
             'title_term': request.GET.get('q', '\*'),
             'moc_term': request.GET.get('moc', '\*'),
@@ -631,8 +642,8 @@ def job_listing_nav_redirect(request, home=None, cc3=None):
     filters = helpers.build_filter_dict(path_part)
     url = 'location'
     sort_order = request.REQUEST.get('sort', 'relevance')
-    jobs = helpers.get_jobs(custom_facets=settings.DEFAULT_FACET,
-                            jsids=settings.SITE_BUIDS,
+    jobs = helpers.get_jobs(custom_facets=site_settings.DEFAULT_FACET,
+                            jsids=site_settings.SITE_BUIDS,
                             filters=filters, sort_order=sort_order)
     facet_counts = jobs.facet_counts()['fields']
 
@@ -658,8 +669,8 @@ def job_listing_nav_redirect(request, home=None, cc3=None):
         redirect_kwargs['title_slug'] = '/'.join(slug.split('/')[0:-1])
     elif home == 'facet':
         url = 'location_facet'
-        custom_facets = helpers.get_solr_facet(settings.SITE_ID,
-                                               settings.SITE_BUIDS,
+        custom_facets = helpers.get_solr_facet(site_settings.SITE_ID,
+                                               site_settings.SITE_BUIDS,
                                                filters)
         # This needs to be changed to get_object_or_404
         country = Country.objects.get(abbrev=cc3)
@@ -673,6 +684,58 @@ def job_listing_nav_redirect(request, home=None, cc3=None):
     return redirect(url, permanent=True, **redirect_kwargs)
 
 
+def _feed_jobs(request, filter_path):
+    """
+    Returns the search for a syndication feed request and the parameters
+    it was made with, as a dictionary of filters, jobs, num_items, offset
+    and days_ago. Kept on the request, so that the conditional GET checks
+    and the view share one search.
+
+    """
+    if not hasattr(request, '_feed_jobs'):
+        request._feed_jobs = helpers.feed_jobs(filter_path, request.GET)
+    return request._feed_jobs
+
+
+def _feed_freshness(request, filter_path, feed_type):
+    """
+    Returns the number of jobs in a feed and the newest date_updated of
+    any of them, both from a single Solr request for its most recently
+    updated job.
+
+    """
+    if not hasattr(request, '_feed_freshness'):
+        feed = _feed_jobs(request, filter_path)
+        latest = helpers.recent_jobs(feed['jobs'], feed['days_ago'])._clone()
+        latest.query.clear_order_by()
+        latest = latest.order_by('-date_updated_exact')
+        newest = latest[:1]
+        request._feed_freshness = (latest.count(),
+                                   newest[0].date_updated if newest else None)
+    return request._feed_freshness
+
+
+def feed_etag(request, filter_path, feed_type):
+    """
+    A feed's ETag changes whenever a job in it is updated, added or
+    removed, or the site's configuration changes.
+
+    """
+    count, newest = _feed_freshness(request, filter_path, feed_type)
+    return hashlib.md5("%s|%s|%s|%s" % (
+        cache_page_prefix(request), request.get_full_path(), count,
+        newest)).hexdigest()
+
+
+# syndication_feed sets its own ETag header, so that the page cache keeps
+# it with the response and @condition (which doesn't replace it) never
+# serves a cached feed with the validator of newer jobs than it lists.
+#
+# There's deliberately no Last-Modified: the newest date_updated of a feed's
+# jobs doesn't change when jobs are removed from it, when jobs with older
+# dates are added to it or when the site's configuration changes, so
+# If-Modified-Since requests would get a 304 for a feed that has changed.
+@condition(etag_func=feed_etag)
 @custom_cache_page
 def syndication_feed(request, filter_path, feed_type):
     """
@@ -684,7 +747,12 @@ def syndication_feed(request, filter_path, feed_type):
     :feed_type: format of the feed. json|rss|xml|atom|indeed
 
     Returns:
-    HttpResponse Object which is the feed.
+    HttpResponse Object which is the feed. Feeds of more than
+    settings.FEED_STREAM_MIN_ITEMS jobs are streamed, a page of
+    settings.FEED_STREAM_CHUNK_SIZE jobs at a time.
+
+    Requests with an If-None-Match header for a feed that hasn't changed
+    get a 304 for the cost of one Solr request.
 
     GET Parameters (all optional):
     :num_items: Number of job listings to return; Default: 500,
@@ -696,46 +764,13 @@ def syndication_feed(request, filter_path, feed_type):
         this many days ago; Default: 0 (any date)
 
     """
-    filters = helpers.build_filter_dict(filter_path)
-    date_sort = 'True'
-    max_items, num_items, offset, days_ago = 1000, 500, 0, 0
-    if request.GET:
-        sqs = helpers.prepare_sqs_from_search_params(request.GET)
-        #Leave num_items and offset at defaults if they're not in QueryDict
-        date_sort = request.GET.get(u'date_sort', date_sort)
-        try:
-            new_num_items = request.GET.get(u'num_items')
-            num_items = int(new_num_items)
-        except (ValueError, TypeError, UnicodeEncodeError):
-            pass
-        try:
-            new_offset = request.GET.get(u'offset', offset)
-            offset = int(new_offset)
-        except (ValueError, TypeError, UnicodeEncodeError):
-            pass
-        try:
-            new_days_ago = request.GET.get(u'days_ago', days_ago)
-            days_ago = int(new_days_ago)
-        except (ValueError, TypeError, UnicodeEncodeError):
-            pass
-
-    else:
-        sqs = helpers._sqs_narrow_by_buid_and_site_package(
-            helpers.sqs_apply_custom_facets(settings.DEFAULT_FACET))
-    sort_order = 'new' if date_sort == 'True' else 'relevance'
-    jobs = helpers.get_jobs(default_sqs=sqs,
-                            custom_facets=settings.DEFAULT_FACET,
-                            jsids=settings.SITE_BUIDS,
-                            filters=filters, sort_order=sort_order)
+    feed = _feed_jobs(request, filter_path)
+    filters, jobs, offset = feed['filters'], feed['jobs'], feed['offset']
 
     job_count = jobs.count()
-    num_items = min(num_items, max_items, job_count)
-    jobs[:num_items]
+    num_items = min(feed['num_items'], job_count)
 
-    if days_ago:
-        now = datetime.datetime.utcnow()
-        start_date = now - datetime.timedelta(days=days_ago)
-        jobs = jobs.filter(date_new__gte=start_date)
+    jobs = helpers.recent_jobs(jobs, feed['days_ago'])
 
     try:
         j = jobs[0]
@@ -747,10 +782,14 @@ def syndication_feed(request, filter_path, feed_type):
     else:
         buid_last_written = datetime.datetime.now()
 
-    qs = jobs.values('city', 'company', 'country', 'country_short',
-                     'date_new', 'description', 'location', 'reqid', 'state',
-                     'state_short', 'title', 'uid', 'guid',
-                     'is_posted')[offset:offset+num_items]
+    values = jobs.values(*helpers.FEED_ITEM_FIELDS)
+    stream = num_items > getattr(settings, 'FEED_STREAM_MIN_ITEMS', 100)
+    if stream:
+        chunks = helpers.search_chunks(
+            values, offset, offset+num_items,
+            getattr(settings, 'FEED_STREAM_CHUNK_SIZE', 100))
+    else:
+        qs = values[offset:offset+num_items]
 
     self_link = ExtraValue(name="link", content="",
                            attributes={'href': request.build_absolute_uri(),
@@ -776,44 +815,57 @@ def syndication_feed(request, filter_path, feed_type):
         links.append(next_link)
 
     if feed_type == 'json':
-        response = HttpResponse(helpers.make_json(qs, request.get_host()),
-                                content_type='application/json')
+        if stream:
+            response = StreamingHttpResponse(
+                helpers.make_json_chunks(chunks, request.get_host()),
+                content_type='application/json')
+        else:
+            response = HttpResponse(helpers.make_json(qs, request.get_host()),
+                                    content_type='application/json')
     elif feed_type == 'jsonp':
         callback_name = request.GET.get('callback', 'direct_jsonp_callback')
-        data = helpers.make_json(qs, request.get_host())
-        output = callback_name + "(" + data + ")"
-        response = HttpResponse(output, content_type='application/javascript')
-    elif feed_type == 'xml':
-        # return xml data for page's jobs
-        # consider trimming non-essential feilds from job document
-        s = XMLExtraValuesSerializer(
-            publisher=settings.SITE_NAME,
-            extra_values=links,
-            publisher_url="http://%s" % request.get_host(),
-            last_build_date=buid_last_written)
-        data = s.serialize(qs)
-        response = HttpResponse(data, content_type='application/xml')
-    elif feed_type == 'indeed':
-        # format xml feed per Indeed's xml feed specifications
-        # here: http://www.indeed.com/intl/en/xmlinfo.html
-        s = XMLExtraValuesSerializer(
-            feed_type=feed_type,
-            use_cdata=True,
-            extra_values=links,
-            publisher=settings.SITE_NAME,
-            publisher_url="http://%s" % request.get_host(),
-            last_build_date=buid_last_written,
-            field_mapping={'date_new': 'date',
-                           'uid': 'referencenumber'})
-        data = s.serialize(qs)
-        response = HttpResponse(data, content_type='application/xml')
+        if stream:
+            data = helpers.make_json_chunks(chunks, request.get_host())
+            output = itertools.chain([callback_name + "("], data, [")"])
+            response = StreamingHttpResponse(
+                output, content_type='application/javascript')
+        else:
+            data = helpers.make_json(qs, request.get_host())
+            output = callback_name + "(" + data + ")"
+            response = HttpResponse(output,
+                                    content_type='application/javascript')
+    elif feed_type in ('xml', 'indeed'):
+        if feed_type == 'xml':
+            # return xml data for page's jobs
+            # consider trimming non-essential feilds from job document
+            s = XMLExtraValuesSerializer(
+                publisher=site_settings.SITE_NAME,
+                extra_values=links,
+                publisher_url="http://%s" % request.get_host(),
+                last_build_date=buid_last_written)
+        else:
+            # format xml feed per Indeed's xml feed specifications
+            # here: http://www.indeed.com/intl/en/xmlinfo.html
+            s = XMLExtraValuesSerializer(
+                feed_type=feed_type,
+                use_cdata=True,
+                extra_values=links,
+                publisher=site_settings.SITE_NAME,
+                publisher_url="http://%s" % request.get_host(),
+                last_build_date=buid_last_written,
+                field_mapping={'date_new': 'date',
+                               'uid': 'referencenumber'})
+        if stream:
+            response = StreamingHttpResponse(s.serialize_chunks(chunks),
+                                             content_type='application/xml')
+        else:
+            data = s.serialize(qs)
+            response = HttpResponse(data, content_type='application/xml')
 
     else:
         # return rss or atom for this page's jobs
-        if feed_type != 'atom':
-            feed_type = 'rss'
-        rss = JobFeed(feed_type)
-        rss.items = qs
+        rss = JobFeed('atom' if feed_type == 'atom' else 'rss')
+        rss.items = [] if stream else qs
 
         selected = helpers.get_bread_box_headings(filters, jobs)
         rss.description = ''
@@ -830,10 +882,16 @@ def syndication_feed(request, filter_path, feed_type):
         if feed_type == 'atom':
             rss.feed_type = Atom1Feed
 
-        data = Feed.get_feed(rss, jobs, request)
-        response = HttpResponse(content_type=data.mime_type)
-        data.write(response, 'utf-8')
+        if stream:
+            response = StreamingHttpResponse(
+                helpers.stream_feed(rss, jobs, request, chunks),
+                content_type=rss.feed_type.mime_type)
+        else:
+            data = rss.get_feed(jobs, request)
+            response = HttpResponse(content_type=data.mime_type)
+            data.write(response, 'utf-8')
 
+    response['ETag'] = quote_etag(feed_etag(request, filter_path, feed_type))
     return response
 
 
@@ -878,10 +936,40 @@ def ajax_filter_carousel(request):
     sqs = (helpers.prepare_sqs_from_search_params(request.GET) if query_path
            else None)
 
+    fanout = SearchFanOut()
+    facet_query = None
+    if site_config.browse_facet_show:
+        facet_query = prefetch_custom_facets(request, fanout, filters=filters,
+                                             query_string=query_path)
+
+    default_jobs = helpers.get_jobs(default_sqs=sqs,
+                                    custom_facets=site_settings.DEFAULT_FACET,
+                                    exclude_facets=site_settings.FEATURED_FACET,
+                                    jsids=site_settings.SITE_BUIDS, filters=filters,
+                                    facet_limit=num_jobs, sort_order=sort_order)
+
+    featured_jobs = helpers.get_featured_jobs(default_sqs=sqs,
+                                              filters=filters,
+                                              jsids=site_settings.SITE_BUIDS,
+                                              facet_limit=num_jobs,
+                                              sort_order=sort_order)
+    grouped = None
+    if getattr(settings, 'GROUP_FEATURED_JOBS', True):
+        grouped = fanout.grouped([default_jobs, featured_jobs], 0)
+    else:
+        fanout.facet_counts(default_jobs)
+        fanout.facet_counts(featured_jobs)
+    fanout.run()
+    if grouped is not None:
+        facet_counts = grouped.facet_counts.get('fields')
+    else:
+        facet_counts = default_jobs.add_facet_count(featured_jobs).get('fields')
+
     custom_facet_counts = []
     if site_config.browse_facet_show:
         cf_count_tup = get_custom_facets(request, filters=filters,
-                                         query_string=query_path)
+                                         query_string=query_path,
+                                         query=facet_query)
 
         if not filters['facet_slug']:
             custom_facet_counts = cf_count_tup
@@ -892,19 +980,6 @@ def ajax_filter_carousel(request):
                                    in cf_count_tup
                                    if facet not in active_facets]
 
-    default_jobs = helpers.get_jobs(default_sqs=sqs,
-                                    custom_facets=settings.DEFAULT_FACET,
-                                    exclude_facets=settings.FEATURED_FACET,
-                                    jsids=settings.SITE_BUIDS, filters=filters,
-                                    facet_limit=num_jobs, sort_order=sort_order)
-
-    featured_jobs = helpers.get_featured_jobs(default_sqs=sqs,
-                                              filters=filters,
-                                              jsids=settings.SITE_BUIDS,
-                                              facet_limit=num_jobs,
-                                              sort_order=sort_order)
-    facet_counts = default_jobs.add_facet_count(featured_jobs).get('fields')
-
     widgets = helpers.get_widgets(request, site_config, facet_counts,
                                   custom_facet_counts, filters=filters)
 
@@ -1056,9 +1131,9 @@ def home_page(request):
     custom_facet_counts = []
 
     num_jobs = site_config.num_job_items_to_show * 2
-    default_jobs = helpers.get_jobs(custom_facets=settings.DEFAULT_FACET,
-                                    exclude_facets=settings.FEATURED_FACET,
-                                    jsids=settings.SITE_BUIDS)
+    default_jobs = helpers.get_jobs(custom_facets=site_settings.DEFAULT_FACET,
+                                    exclude_facets=site_settings.FEATURED_FACET,
+                                    jsids=site_settings.SITE_BUIDS)
     jobs_count = get_total_jobs_count()
 
     featured_jobs = helpers.get_featured_jobs()
@@ -1067,7 +1142,7 @@ def home_page(request):
         featured_jobs.count(), default_jobs.count(),
         num_jobs, site_config.percent_featured)
 
-    featured = settings.SITE.featured_companies.all()
+    featured = site_settings.SITE.featured_companies.all()
     # Because we're getting the featured company information from the SQL
     # database instead of Solr, we need to append the generated feature
     # slabs to the rest of the counts.
@@ -1087,7 +1162,7 @@ def home_page(request):
         cust_facets = get_custom_facets(request)
         custom_facet_counts = helpers.combine_groups(cust_facets)
 
-    ga = settings.SITE.google_analytics.all()
+    ga = site_settings.SITE.google_analytics.all()
 
     home_page_template = site_config.home_page_template
 
@@ -1096,7 +1171,7 @@ def home_page(request):
     billboard_templates = ['home_page/home_page_billboard.html',
                            'home_page/home_page_billboard_icons_top.html']
     if home_page_template in billboard_templates:
-        billboard_images = (settings.SITE.billboard_images.all())
+        billboard_images = (site_settings.SITE.billboard_images.all())
         company_images = helpers.company_thumbnails(featured) if featured else \
             helpers.company_thumbnails(members)
         company_images_json = json.dumps(company_images, ensure_ascii=False)
@@ -1117,11 +1192,11 @@ def home_page(request):
         'base_path': request.path,
         'facet_blurb': False,
         'google_analytics': ga,
-        'site_name': settings.SITE_NAME,
-        'site_title': settings.SITE_TITLE,
-        'site_heading': settings.SITE_HEADING,
-        'site_tags': settings.SITE_TAGS,
-        'site_description': settings.SITE_DESCRIPTION,
+        'site_name': site_settings.SITE_NAME,
+        'site_title': site_settings.SITE_TITLE,
+        'site_heading': site_settings.SITE_HEADING,
+        'site_tags': site_settings.SITE_TAGS,
+        'site_description': site_settings.SITE_DESCRIPTION,
         'host': str(request.META.get("HTTP_HOST", "localhost")),
         'site_config': site_config,
         'build_num': settings.BUILD,
@@ -1130,7 +1205,7 @@ def home_page(request):
         'billboard_images': billboard_images,
         'featured': str(bool(featured)).lower(),
         'filters': {},
-        'view_source': settings.VIEW_SOURCE}
+        'view_source': site_settings.VIEW_SOURCE}
 
     return render_to_response(home_page_template, data_dict,
                               context_instance=RequestContext(request))
@@ -1162,8 +1237,8 @@ def company_listing(request, alpha=None, group=None):
     """
     site_config = get_site_config(request)
     jobs_count = get_total_jobs_count()
-    custom_facets = settings.DEFAULT_FACET
-    featured = SeoSite.objects.get(id=settings.SITE_ID).\
+    custom_facets = site_settings.DEFAULT_FACET
+    featured = SeoSite.objects.get(id=site_settings.SITE_ID).\
                featured_companies.all()
 
     if group == 'featured':
@@ -1229,11 +1304,11 @@ def company_listing(request, alpha=None, group=None):
 
     data_dict = {
         'site_config': site_config,
-        'site_name': settings.SITE_NAME,
-        'site_title': settings.SITE_TITLE,
-        'site_heading': settings.SITE_HEADING,
-        'site_tags': settings.SITE_TAGS,
-        'site_description': settings.SITE_DESCRIPTION,
+        'site_name': site_settings.SITE_NAME,
+        'site_title': site_settings.SITE_TITLE,
+        'site_heading': site_settings.SITE_HEADING,
+        'site_tags': site_settings.SITE_TAGS,
+        'site_description': site_settings.SITE_DESCRIPTION,
         'company_data': company_data,
         'column_count': column_count,
         'total_jobs_count': jobs_count,
@@ -1242,7 +1317,7 @@ def company_listing(request, alpha=None, group=None):
         'featured': str(bool(featured)).lower(),
         'group': group,
         'build_num' : settings.BUILD,
-        'view_source' : settings.VIEW_SOURCE
+        'view_source' : site_settings.VIEW_SOURCE
     }
 
     return render_to_response('all_companies_page.html', data_dict,
@@ -1257,7 +1332,7 @@ def solr_ac(request):
     sqs = DESearchQuerySet().facet_mincount(1).facet_sort("count").facet_limit(15)
     sqs = helpers._sqs_narrow_by_buid_and_site_package(sqs)
     # filter `sqs` by default facet, if one exists.
-    sqs = helpers.sqs_apply_custom_facets(settings.DEFAULT_FACET, sqs=sqs)
+    sqs = helpers.sqs_apply_custom_facets(site_settings.DEFAULT_FACET, sqs=sqs)
 
     callback = request.GET.get('callback')
     if lookup_type == 'location':
@@ -1366,76 +1441,61 @@ def send_sns_confirm(response):
                 LOG.info("Skipping update_solr for %s because it is not in the allowed buids list." % buid)
 
 
+def _sitemap_shard_response(request, domain, name):
+    """
+    Returns a response with the pre-generated sitemap `name` for `domain`,
+    still gzipped if the client accepts that, or None if there isn't one.
+
+    """
+    shard = sitemap.read_shard(domain, name)
+    if shard is None:
+        return None
+    if ACCEPTS_GZIP.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+        response = HttpResponse(shard, content_type='application/xml')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(sitemap.gunzip(shard),
+                                content_type='application/xml')
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
+
+
 def new_sitemap_index(request):
     """
     Generates the sitemap index page, which instructs the crawler how to
     get to every other page.
 
     """
-    today = datetime.date.today()
-    yesterday = today - datetime.timedelta(days=1)
-    midnight = datetime.time.max
-    #The latest date/time in sitemaps is yesterday, midnight (time.max)
-    latest_datetime = datetime.datetime.combine(yesterday, midnight)
-    # Number of days to go back from today.
-    history = 30
-    # Populate a list of datetime.datetime objects representing today's date
-    # as well as one for each day going back 'history' days.
-    dates = [latest_datetime - datetime.timedelta(days=i) for i in xrange(history)]
-    earliest_day = (latest_datetime - datetime.timedelta(days=history)).date()
-    datecounts = DateSitemap().numpages(startdate=earliest_day,
-                                        enddate=latest_datetime)
-    sitemaps = {}
-
-    for date in dates:
-        dt = datetime.date(*date.timetuple()[0:3]).isoformat()
-        sitemaps[dt] = {'sitemap': DateSitemap(), 'count': datecounts[dt]}
-    current_site = Site.objects.get_current()
+    current_site = site_settings.SITE
     protocol = request.is_secure() and 'https' or 'http'
-
-    #List of tuples: (sitemap url, lastmod date)
-    sites_dates = []
-    for date in sorted(sitemaps.keys(), reverse=True):
-        pages = sitemaps[date]['count']
-        sitemap_url = urlresolvers.reverse('sitemap_date',
-                                           kwargs={'jobdate': date})
-        sites_dates.append(('%s://%s%s' % (protocol, current_site.domain,
-                                           sitemap_url),
-                            date))
-        if pages > 1:
-            for page in xrange(2, pages+1):
-                sites_dates.append(('%s://%s%s?p=%s' % (protocol,
-                                                        current_site.domain,
-                                                        sitemap_url, page),
-                                    date))
-
-    xml = loader.render_to_string('sitemaps/sitemap_index_lastmod.xml',
-                                  {'sitemaps': sites_dates})
-    return HttpResponse(xml, content_type='application/xml')
+    response = _sitemap_shard_response(request, current_site.domain,
+                                       sitemap.index_shard_name(protocol))
+    if response is None:
+        xml = sitemap.render_sitemap_index(current_site.domain,
+                                           protocol=protocol)
+        response = HttpResponse(xml, content_type='application/xml')
+    return response
 
 
 def new_sitemap(request, jobdate=None):
     page = request.GET.get("p", 1)
-    fields = ['title', 'location', 'uid', 'guid']
-    sitemaps = {
-        jobdate: DateSitemap(page=page, fields=fields, jobdate=jobdate)
-    }
-    maps, urls = [], []
     if jobdate:
-        if jobdate not in sitemaps:
-            raise Http404("No sitemap available for job date: %r" % jobdate)
-        maps.append(sitemaps[jobdate])
-    else:
-        maps = sitemaps.values()
-
-    for site in maps:
         try:
-            urls.extend(site.get_urls())
-        except EmptyPage:
-            raise Http404("Page %s empty" % page)
-        except PageNotAnInteger:
-            raise Http404("No page '%s'" % page)
-    xml = smart_str(loader.render_to_string('sitemap.xml', {'urlset': urls}))
+            name = sitemap.date_shard_name(jobdate, int(page))
+        except ValueError:
+            pass
+        else:
+            response = _sitemap_shard_response(
+                request, site_settings.SITE.domain, name)
+            if response is not None:
+                return response
+
+    try:
+        xml = sitemap.render_sitemap(jobdate, page=page)
+    except EmptyPage:
+        raise Http404("Page %s empty" % page)
+    except PageNotAnInteger:
+        raise Http404("No page '%s'" % page)
     return HttpResponse(xml, content_type='application/xml')
 
 
@@ -1608,13 +1668,13 @@ def dseo_404(request, the_job=None, job_detail=False):
         'domain': 'http://' + request.get_host(),
         'jobdata': {},
         'referer': request.META.get('HTTP_REFERER'),
-        'site_name': settings.SITE_NAME,
-        'site_title': settings.SITE_TITLE,
-        'site_heading': settings.SITE_HEADING,
-        'site_tags': settings.SITE_TAGS,
-        'site_description': settings.SITE_DESCRIPTION,
+        'site_name': site_settings.SITE_NAME,
+        'site_title': site_settings.SITE_TITLE,
+        'site_heading': site_settings.SITE_HEADING,
+        'site_tags': site_settings.SITE_TAGS,
+        'site_description': site_settings.SITE_DESCRIPTION,
         'build_num': settings.BUILD,
-        'view_source': settings.VIEW_SOURCE
+        'view_source': site_settings.VIEW_SOURCE
     }
 
     if job_detail and the_job:
@@ -1652,13 +1712,13 @@ def dseo_500(request):
         'path': request.path,
         'domain': 'http://%s' % request.get_host(),
         'referer': request.META.get('HTTP_REFERER'),
-        'site_name': settings.SITE_NAME,
-        'site_title': settings.SITE_TITLE,
-        'site_heading': settings.SITE_HEADING,
-        'site_tags': settings.SITE_TAGS,
-        'site_description': settings.SITE_DESCRIPTION,
+        'site_name': site_settings.SITE_NAME,
+        'site_title': site_settings.SITE_TITLE,
+        'site_heading': site_settings.SITE_HEADING,
+        'site_tags': site_settings.SITE_TAGS,
+        'site_description': site_settings.SITE_DESCRIPTION,
         'build_num': settings.BUILD,
-        'view_source': settings.VIEW_SOURCE
+        'view_source': site_settings.VIEW_SOURCE
     }
     return HttpResponseServerError(loader.render_to_string(
                                    'dseo_500.html', data_dict,
@@ -1682,15 +1742,28 @@ def search_by_results_and_slugs(request, *args, **kwargs):
         sort_order = 'relevance'
 
     facet_blurb_facet = None
-    ga = settings.SITE.google_analytics.all()
-    sitecommit_str = helpers.make_specialcommit_string(settings.COMMITMENTS.all())
+    ga = site_settings.SITE.google_analytics.all()
+    sitecommit_str = helpers.make_specialcommit_string(site_settings.COMMITMENTS.all())
     site_config = get_site_config(request)
     num_jobs = int(site_config.num_job_items_to_show) * 2
 
+    # The custom facet counts and total job count (unless they're cached)
+    # are fetched from Solr along with the jobs.
+    fanout = SearchFanOut()
+    facet_query = None
+    if site_config.browse_facet_show:
+        facet_query = prefetch_custom_facets(request, fanout, filters=filters,
+                                             query_string=query_path)
+    total_jobs_sqs = prefetch_total_jobs_count(fanout)
+
+    default_jobs, featured_jobs, facet_counts = helpers.jobs_and_counts(
+        request, filters, num_jobs, fanout=fanout)
+
     custom_facet_counts = []
     if site_config.browse_facet_show:
         cf_count_tup = get_custom_facets(request, filters=filters,
-                                         query_string=query_path)
+                                         query_string=query_path,
+                                         query=facet_query)
 
         if not filters['facet_slug']:
             custom_facet_counts = cf_count_tup
@@ -1706,9 +1779,6 @@ def search_by_results_and_slugs(request, *args, **kwargs):
             if len(active_facets) == 1 and active_facets[0].blurb:
                 facet_blurb_facet = active_facets[0]
 
-    default_jobs, featured_jobs, facet_counts = helpers.jobs_and_counts(
-        request, filters, num_jobs)
-
     total_featured_jobs = featured_jobs.count()
     total_default_jobs = default_jobs.count()
 
@@ -1763,21 +1833,21 @@ def search_by_results_and_slugs(request, *args, **kwargs):
         'moc_id_term': moc_id_term if moc_id_term else '\*',
         'moc_term': moc_term,
         'num_filters': len([k for (k, v) in filters.iteritems() if v]),
-        'total_jobs_count': get_total_jobs_count(),
+        'total_jobs_count': get_total_jobs_count(total_jobs_sqs),
         'results_heading': results_heading,
         'search_url': request.path,
-        'site_commitments': settings.COMMITMENTS,
+        'site_commitments': site_settings.COMMITMENTS,
         'site_commitments_string': sitecommit_str,
         'site_config': site_config,
-        'site_description': settings.SITE_DESCRIPTION,
-        'site_heading': settings.SITE_HEADING,
-        'site_name': settings.SITE_NAME,
-        'site_tags': settings.SITE_TAGS,
-        'site_title': settings.SITE_TITLE,
+        'site_description': site_settings.SITE_DESCRIPTION,
+        'site_heading': site_settings.SITE_HEADING,
+        'site_name': site_settings.SITE_NAME,
+        'site_tags': site_settings.SITE_TAGS,
+        'site_title': site_settings.SITE_TITLE,
         'sort_fields': helpers.sort_fields,
         'sort_order': sort_order,
         'title_term': q_term if q_term else '\*',
-        'view_source': settings.VIEW_SOURCE,
+        'view_source': site_settings.VIEW_SOURCE,
         'widgets': widgets,
     }
 
@@ -1795,10 +1865,10 @@ class SearchResults(FallbackBlockView):
     def set_page(self, request):
         if request.user.is_authenticated() and request.user.is_staff:
             no_results_pages = Page.objects.filter(page_type=Page.NO_RESULTS,
-                                                   sites=settings.SITE)
+                                                   sites=site_settings.SITE)
         else:
             no_results_pages = Page.objects.filter(page_type=Page.NO_RESULTS,
-                                                   sites=settings.SITE,
+                                                   sites=site_settings.SITE,
                                                    status=Page.PRODUCTION)
 
         if no_results_pages.exists():
@@ -1819,7 +1889,7 @@ def urls_redirect(request, guid, vsid=None, debug=None):
     if debug is None:
         debug = ''
 
-    site = getattr(settings, 'SITE', None)
+    site = getattr(site_settings, 'SITE', None)
     if site is None:
         site = Site.objects.get(domain='www.my.jobs')
     qs = QueryDict(request.META['QUERY_STRING'], mutable=True)
@@ -7,6 +7,7 @@ from django.views.generic import View, RedirectView
 
 from seo.forms import settings_forms
 from seo.models import SeoSite
+from seo.site_context import site_settings
 from universal.views import RequestFormViewBase
 
 
@@ -60,7 +61,7 @@ def secure_redirect(request, page):
     Redirects to the correct path on secure.my.jobs if this is not a network
     site, or 404 if it is.
     """
-    if settings.SITE.site_tags.filter(site_tag='network').exists():
+    if site_settings.SITE.site_tags.filter(site_tag='network').exists():
         return RedirectView.as_view(
             url='https://secure.my.jobs/%s' % page)(request)
     else:
@@ -1,19 +1,160 @@
+import threading
+import time
+import urlparse
+from contextlib import contextmanager
+
 import pysolr
 import requests
-import time
+from django.conf import settings
+
+import solr_stats
+
+
+# Connection pools shared by every Solr client in the process, keyed by
+# scheme and host.
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PoolStats(object):
+    """
+    Thread-safe counters of how long requests waited for a connection.
+
+    """
+    def __init__(self):
+        self.requests = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, wait):
+        with self.lock:
+            self.requests += 1
+            self.wait_time += wait
+            self.max_wait = max(self.max_wait, wait)
+            # Anything over a millisecond means the pool was exhausted.
+            if wait > 0.001:
+                self.waits += 1
+
+    def as_dict(self):
+        with self.lock:
+            return {'requests': self.requests, 'waits': self.waits,
+                    'wait_time': self.wait_time, 'max_wait': self.max_wait}
+
+
+class SolrPool(object):
+    """
+    A requests session keeping up to `size` connections to one Solr host
+    alive, and allowing at most that many requests to it at a time.
+
+    """
+    def __init__(self, size):
+        self.size = size
+        self.session = requests.Session()
+        self.session.stream = False
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                pool_maxsize=size,
+                                                pool_block=True)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.slots = threading.BoundedSemaphore(size)
+        self.stats = PoolStats()
+
+    @contextmanager
+    def connection(self):
+        start = time.time()
+        self.slots.acquire()
+        self.stats.record(time.time() - start)
+        try:
+            yield self.session
+        finally:
+            self.slots.release()
+
+
+def get_pool(url):
+    """
+    Returns the process-wide SolrPool for the host of `url`, sized by
+    settings.SOLR_POOL_SIZE.
+
+    """
+    parts = urlparse.urlsplit(url)
+    key = '%s://%s' % (parts.scheme, parts.netloc)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = SolrPool(getattr(settings, 'SOLR_POOL_SIZE', 10))
+        return _pools[key]
+
+
+def pool_stats():
+    """
+    Returns a dictionary of {host: pool wait statistics}.
+
+    """
+    with _pools_lock:
+        pools = _pools.items()
+    return dict((key, pool.stats.as_dict()) for key, pool in pools)
+
+
+def core_timeout(url):
+    """
+    The timeout for requests to the core at `url`, from
+    settings.SOLR_TIMEOUTS (keyed by core name), or 60 seconds.
+
+    """
+    core = urlparse.urlsplit(url).path.rstrip('/').split('/')[-1]
+    return getattr(settings, 'SOLR_TIMEOUTS', {}).get(core, 60)
 
 
 class Solr(pysolr.Solr):
-    def __init__(self, url, decoder=None, timeout=60, auth=None):
+    """
+    A pysolr client that sends its requests through the connection pool
+    shared by every client for the same host, retrying (with exponential
+    backoff) requests that couldn't connect, or reads that timed out.
+
+    Creating one is cheap; there's no need to hold on to it.
+
+    """
+    def __init__(self, url, decoder=None, timeout=None, auth=None):
+        if timeout is None:
+            timeout = core_timeout(url)
         super(Solr, self).__init__(url, decoder, timeout)
         self.auth = auth
+        self.pool = get_pool(url)
+        self.session = self.pool.session
+
+    def export(self, q='*:*', fl='id', rows=1000, **kwargs):
+        """
+        Yields every document matching ``q`` (and any filters passed in
+        ``kwargs``), fetching ``rows`` documents per request.
+
+        Pages with Solr's ``cursorMark`` rather than ``start``, so each
+        request costs the same no matter how deep into the results it is.
+        ``fl`` should be kept to the handful of fields the caller needs.
+
+        """
+        params = {'q': q, 'fl': fl, 'rows': rows, 'sort': 'id asc',
+                  'cursorMark': '*', 'facet': 'false', 'mlt': 'false'}
+        params.update(kwargs)
+        while True:
+            result = self.decoder.decode(self._select(params))
+            for doc in result['response']['docs']:
+                yield doc
+            cursor_mark = result.get('nextCursorMark')
+            # Solr returns the cursorMark it was sent once every matching
+            # document has been returned.
+            if not cursor_mark or cursor_mark == params['cursorMark']:
+                return
+            params['cursorMark'] = cursor_mark
 
     def _send_request(self, method, path='', body=None, headers=None,
                       files=None):
         """
         Copy and paste of the base (pysolr version 3.2.0) _send_request()
         method except for the resp = requests_method() line, which
-        passes along the auth information.
+        passes along the auth information, is sent through the connection
+        pool and is retried up to settings.SOLR_RETRIES times, and the
+        call to solr_stats.record().
 
         """
         url = self._create_full_url(path)
@@ -38,30 +179,47 @@ class Solr(pysolr.Solr):
             err = "Unable to send HTTP method '{0}.".format(method)
             raise pysolr.SolrError(err)
 
-        try:
-            bytes_body = body
-
-            if bytes_body is not None:
-                bytes_body = pysolr.force_bytes(body)
-
-            resp = requests_method(url, data=bytes_body, headers=headers,
-                                   files=files, timeout=self.timeout,
-                                   auth=self.auth)
-        except requests.exceptions.Timeout as err:
-            error_message = "Connection to server '%s' timed out: %s"
-            self.log.error(error_message, url, err, exc_info=True)
-            raise pysolr.SolrError(error_message % (url, err))
-        except requests.exceptions.ConnectionError as err:
-            error_message = "Failed to connect to server at '%s', are you " \
-                            "sure that URL is correct? Checking it in a " \
-                            "browser might help: %s"
-            params = (url, err)
-            self.log.error(error_message, *params, exc_info=True)
-            raise pysolr.SolrError(error_message % params)
+        bytes_body = body
+
+        if bytes_body is not None:
+            bytes_body = pysolr.force_bytes(body)
+
+        retries = getattr(settings, 'SOLR_RETRIES', 2)
+        backoff = getattr(settings, 'SOLR_RETRY_BACKOFF', 0.1)
+        attempt = 0
+        while True:
+            try:
+                with self.pool.connection():
+                    resp = requests_method(url, data=bytes_body,
+                                           headers=headers, files=files,
+                                           timeout=self.timeout,
+                                           auth=self.auth)
+                break
+            except requests.exceptions.Timeout as err:
+                # Only reads are safe to send again once Solr may have
+                # started on them.
+                if method != 'get' or attempt >= retries:
+                    error_message = "Connection to server '%s' timed out: %s"
+                    self.log.error(error_message, url, err, exc_info=True)
+                    raise pysolr.SolrError(error_message % (url, err))
+            except requests.exceptions.ConnectionError as err:
+                if attempt >= retries:
+                    error_message = "Failed to connect to server at '%s', " \
+                                    "are you sure that URL is correct? " \
+                                    "Checking it in a browser might help: %s"
+                    params = (url, err)
+                    self.log.error(error_message, *params, exc_info=True)
+                    raise pysolr.SolrError(error_message % params)
+            self.log.warning("Retrying '%s' (%s), attempt %s of %s", url,
+                             method, attempt + 1, retries)
+            time.sleep(backoff * 2 ** attempt)
+            attempt += 1
 
         end_time = time.time()
         self.log.info("Finished '%s' (%s) with body '%s' in %0.3f seconds.",
                       url, method, log_body[:10], end_time - start_time)
+        solr_stats.record(method, url, log_body, end_time - start_time,
+                          resp.content)
 
         if int(resp.status_code) != 200:
             error_message = self._extract_error(resp)
@@ -97,6 +97,24 @@ class ExtraValuesSerializer(Serializer):
     def build_link_name(self, link):
         name = "link href={l} rel={rel}".format(l=link.url, rel=link.rel)
 
+    def handle_header(self):
+        self.handle_item('publisher', self.publisher)
+        self.handle_item('publisherurl', self.publisher_url)
+        self.handle_item('lastBuildDate', self.last_build_date)
+        for value in self.extra_values:
+            self.handle_item(value.name, value.content, value.attributes)
+
+    def handle_object(self, obj):
+        self.start_object(obj)
+        for key, value in obj.iteritems():
+            # The is_posted field is used only for building the
+            # url and should not actually show up in the
+            # final results.
+            if key != 'is_posted':
+                self.handle_item(key, value)
+        self.handle_item_url(obj)
+        self.end_object(obj)
+
     def serialize(self, queryset, **options):
         """
         Serialize a queryset.
@@ -107,25 +125,42 @@ class ExtraValuesSerializer(Serializer):
         #self.selected_fields = fields
         self.use_natural_keys = options.get("use_natural_keys", False)
         self.start_serialization()
-        self.handle_item('publisher', self.publisher)
-        self.handle_item('publisherurl', self.publisher_url)
-        self.handle_item('lastBuildDate', self.last_build_date)
-        for value in self.extra_values:
-            self.handle_item(value.name, value.content, value.attributes)
-
+        self.handle_header()
         for obj in queryset:
-            self.start_object(obj)
-            for key, value in obj.iteritems():
-                # The is_posted field is used only for building the
-                # url and should not actually show up in the
-                # final results.
-                if key != 'is_posted':
-                    self.handle_item(key, value)
-            self.handle_item_url(obj)
-            self.end_object(obj)
+            self.handle_object(obj)
         self.end_serialization()
         return self.getvalue()
 
+    def serialize_chunks(self, chunks, **options):
+        """
+        Serializes the objects in each of `chunks` (iterables of objects,
+        such as pages of search results) in turn, yielding the output
+        written since the last chunk after each of them, so that a large
+        feed can be streamed without ever being held in memory.
+
+        """
+        self.options = options
+        self.stream = StringIO()
+        self.use_natural_keys = options.get("use_natural_keys", False)
+        self.start_serialization()
+        self.handle_header()
+        for chunk in chunks:
+            for obj in chunk:
+                self.handle_object(obj)
+            yield self.flush()
+        self.end_serialization()
+        yield self.flush()
+
+    def flush(self):
+        """
+        Returns the output written to the stream so far and empties it.
+
+        """
+        value = self.stream.getvalue()
+        self.stream.seek(0)
+        self.stream.truncate()
+        return value
+
 
 class XMLExtraValuesSerializer(ExtraValuesSerializer):
     """ 
@@ -184,6 +219,11 @@ class XMLExtraValuesSerializer(ExtraValuesSerializer):
         self.indent(1)
         self.xml.endElement("job")
 
+    def flush(self):
+        # The XML generator buffers its output until the end of a line.
+        self.xml._flush()
+        return super(XMLExtraValuesSerializer, self).flush()
+
     def finish_handle_item(self, field_name, value, attributes=None):
         self.indent(2)
         if attributes:
@@ -210,14 +250,20 @@ class JSONExtraValuesSerializer(ExtraValuesSerializer):
         super(JSONExtraValuesSerializer, self).__init__(**kwargs)
 
     def start_serialization(self):
-        self._current = {} 
-        self.objects = []
+        # Objects are written as they're handled, rather than as one list
+        # at the end, so that serialize_chunks() can stream them.
+        self._current = {}
+        self._first = True
+        self.stream.write('[')
 
     def start_object(self, obj):
         self._current = {}
 
     def end_object(self, obj):
-        self.objects.append(self._current)
+        if not self._first:
+            self.stream.write(', ')
+        self._first = False
+        json.dump(self._current, self.stream, **self.options)
         self._current = None
 
     def finish_handle_item(self, field_name, value, attributes=None):
@@ -232,7 +278,7 @@ class JSONExtraValuesSerializer(ExtraValuesSerializer):
             self._current[field_name] = unicode(value)
 
     def end_serialization(self):
-        json.dump(self.objects, self.stream, **self.options)
+        self.stream.write(']')
 
     def getvalue(self):
         if callable(getattr(self.stream, 'getvalue', None)):
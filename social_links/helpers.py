@@ -1,8 +1,8 @@
-from django.conf import settings
+from seo.site_context import site_settings
 
 
 def get_microsite_carousel(site_id):
-    mc = settings.SITE.microsite_carousel
+    mc = site_settings.SITE.microsite_carousel
     if mc is None or not mc.is_active:
         mc = None
     return mc
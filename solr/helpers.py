@@ -1,16 +1,17 @@
-import pysolr
-
 from copy import deepcopy
 from django.conf import settings
 from django.core import mail
 
+import seo_pysolr
+import solr_stats
+
 
 class Solr(object):
     def __init__(self, solr_location=settings.SOLR['all']):
         if hasattr(mail, 'outbox'):
             solr_location = settings.TEST_SOLR_INSTANCE['current']
         self.location = solr_location
-        self.solr = pysolr.Solr(self.location)
+        self.solr = seo_pysolr.Solr(self.location)
         self.q = '(*:*)'
         self.params = {
             'fq': [],
@@ -186,7 +187,8 @@ class Solr(object):
             del kwargs['q']
         clone.params.update(kwargs)
 
-        return clone.solr.search(q=clone.q, **clone.params)
+        with solr_stats.source('solr.helpers.Solr.search'):
+            return clone.solr.search(q=clone.q, **clone.params)
 
     def delete(self):
         """
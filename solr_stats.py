@@ -0,0 +1,189 @@
+"""
+Counts the Solr requests each view makes.
+
+Every request seo_pysolr.Solr sends to Solr is recorded with its wall
+time, the QTime Solr reported for it, the size of the response and the
+code that made it (see `source()`). SolrStatsMiddleware collects the
+records made while a view runs into a RequestStats, adds them to
+per-view totals (see `counters()`) and, when DEBUG is on, summarizes them
+in an X-Solr-Queries response header.
+
+Requests slower than settings.SOLR_SLOW_QUERY_MS are logged with their
+parameters, whether or not they were made by a view. Request bodies (which
+for update requests can be megabytes of documents) are cut short in the
+log; RequestStats keeps them whole.
+
+"""
+import logging
+import re
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+QTIME = re.compile(r'"QTime":\s*(\d+)')
+# The number of characters of a request body logged for a slow request.
+SLOW_QUERY_BODY_LENGTH = 2000
+
+_local = threading.local()
+_counters = {}
+_counters_lock = threading.Lock()
+
+
+class RequestStats(object):
+    """
+    The Solr requests made on behalf of one view. Thread-safe, so that
+    requests made on other threads for it (see
+    seo.search_backend.SearchFanOut) can be added to it.
+
+    """
+    def __init__(self, view=None):
+        self.view = view
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def add(self, query):
+        with self.lock:
+            self.queries.append(query)
+
+    def totals(self):
+        with self.lock:
+            queries = list(self.queries)
+        return {
+            'queries': len(queries),
+            'wall_time': sum(query['wall_time'] for query in queries),
+            'qtime': sum(query['qtime'] or 0 for query in queries),
+            'bytes': sum(query['bytes'] for query in queries),
+        }
+
+    def header(self):
+        """The value of the X-Solr-Queries header."""
+        return ("count=%(queries)d wall=%(wall_time).3fs qtime=%(qtime)dms "
+                "bytes=%(bytes)d" % self.totals())
+
+
+def start_request(view=None):
+    _local.stats = RequestStats(view)
+    return _local.stats
+
+
+def finish_request():
+    """
+    Stops collecting for the current request, adds its queries to the
+    per-view counters and returns its RequestStats.
+
+    """
+    stats = current()
+    _local.stats = None
+    _local.last = stats
+    if stats is not None:
+        totals = stats.totals()
+        with _counters_lock:
+            view_counters = _counters.setdefault(
+                stats.view or 'unknown',
+                {'requests': 0, 'queries': 0, 'wall_time': 0.0,
+                 'qtime': 0, 'bytes': 0})
+            view_counters['requests'] += 1
+            for name, value in totals.items():
+                view_counters[name] += value
+    return stats
+
+
+def current():
+    return getattr(_local, 'stats', None)
+
+
+def last_request():
+    """
+    Returns the RequestStats of the request most recently finished on this
+    thread, such as one made through the Django test client.
+
+    """
+    return getattr(_local, 'last', None)
+
+
+@contextmanager
+def collecting(stats):
+    """
+    Adds the Solr requests made on this thread to `stats` (the result of
+    current() on another thread) until the block exits.
+
+    """
+    previous = current()
+    _local.stats = stats
+    try:
+        yield
+    finally:
+        _local.stats = previous
+
+
+@contextmanager
+def source(name):
+    """
+    Labels the Solr requests made on this thread until the block exits as
+    having been made by `name`.
+
+    """
+    sources = getattr(_local, 'sources', None)
+    if sources is None:
+        sources = _local.sources = []
+    sources.append(name)
+    try:
+        yield
+    finally:
+        sources.pop()
+
+
+def record(method, url, body, wall_time, content):
+    """
+    Records a request to Solr. Called by seo_pysolr.Solr for every request
+    it sends.
+
+    """
+    match = QTIME.search(content[:256]) if content else None
+    sources = getattr(_local, 'sources', None)
+    stats = current()
+    query = {
+        'method': method,
+        'url': url,
+        'body': body,
+        'wall_time': wall_time,
+        'qtime': int(match.group(1)) if match else None,
+        'bytes': len(content or ''),
+        'source': sources[-1] if sources else None,
+        'view': stats.view if stats is not None else None,
+    }
+    if stats is not None:
+        stats.add(query)
+
+    threshold = getattr(settings, 'SOLR_SLOW_QUERY_MS', None)
+    if threshold is not None and wall_time * 1000 >= threshold:
+        body = body or ''
+        if len(body) > SLOW_QUERY_BODY_LENGTH:
+            body = '%s... (%d characters)' % (body[:SLOW_QUERY_BODY_LENGTH],
+                                             len(body))
+        logger.warning("Slow Solr query (%.0fms wall, %sms QTime) from %s "
+                       "in %s: %s %s %s", wall_time * 1000, query['qtime'],
+                       query['source'], query['view'], method.upper(), url,
+                       body)
+    return query
+
+
+def counters():
+    """
+    Returns a copy of the totals for every view since the process started
+    (or reset_counters() was last called): {view: {'requests', 'queries',
+    'wall_time', 'qtime', 'bytes'}}.
+
+    """
+    with _counters_lock:
+        return dict((view, dict(values)) for view, values in
+                    _counters.items())
+
+
+def reset_counters():
+    with _counters_lock:
+        _counters.clear()
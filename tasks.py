@@ -7,26 +7,31 @@ import newrelic.agent
 import os
 import pysolr
 import sys
+import time
 import traceback
 from urllib2 import HTTPError, URLError
 import urlparse
 import uuid
 
-from celery import group
+from celery import chord, group
 from celery.task import task
 
 from django.conf import settings
 from django.contrib.sitemaps import ping_google
 from django.contrib.contenttypes.models import ContentType
 from django.core import mail
+from django.core.cache import cache
 from django.core.urlresolvers import reverse_lazy
 from django.template.loader import render_to_string
 from django.db.models import Q
 
 from seo.models import Company, SeoSite, BusinessUnit
+from seo.sitemap import write_site_sitemaps
+from seo_pysolr import Solr
 from myjobs.models import EmailLog, User, STOP_SENDING, BAD_EMAIL
 from myjobs.helpers import log_to_jira
 from mymessages.models import Message
+from mysearches.helpers import plan_feed_queries
 from mysearches.models import SavedSearch, SavedSearchDigest, SavedSearchLog
 from mypartners.models import PartnerLibrary
 from mypartners.helpers import get_library_partners
@@ -36,6 +41,7 @@ from registration.models import ActivationProfile
 from solr import helpers
 from solr.models import Update
 from solr.signals import object_to_dict, profileunits_to_dict
+from universal.helpers import EmailBatch
 
 
 logger = logging.getLogger(__name__)
@@ -70,16 +76,18 @@ PARTNER_LIBRARY_SOURCES = {
 
 @task(name='tasks.send_search_digest', ignore_result=True,
       default_retry_delay=180, max_retries=2, bind=True)
-def send_search_digest(self, search):
+def send_search_digest(self, search, feed_items=None):
     """
     Task used by send_send_search_digests to send individual digest or search
     emails.
 
     Inputs:
     :search: SavedSearch or SavedSearchDigest instance to be mailed
+    :feed_items: Jobs already retrieved for the saved searches being mailed;
+        see mysearches.helpers.plan_feed_queries
     """
     try:
-        search.send_email()
+        search.send_email(feed_items=feed_items)
     except (ValueError, URLError, HTTPError) as e:
         if self.request.retries < 2:  # retry sending email twice
             raise send_search_digest.retry(arg=[search], exc=e)
@@ -144,12 +152,116 @@ def update_partner_library():
             added, skipped, source)
 
 
+@task(name='tasks.send_search_batch', ignore_result=False)
+def send_search_batch(kind, pks):
+    """
+    Task used by send_search_digests to send a batch of digest or search
+    emails.
+
+    Emails that can't be sent are handed to send_search_digest, which
+    retries them and disables the search if need be. With
+    settings.SAVED_SEARCH_SEND_RATE, the batch is sent no faster than that
+    many emails per second. Each mail connection is used for
+    settings.SAVED_SEARCH_EMAILS_PER_CONNECTION emails.
+
+    Inputs:
+    :kind: 'digest' for SavedSearchDigest ids, 'search' for SavedSearch ids
+    :pks: ids of the digests or searches to be mailed
+
+    Outputs:
+    :dict: Timing for the batch; 'kind', 'emails', 'failed', 'queries' (the
+        number of distinct feed queries planned), 'searches' and 'seconds'
+    """
+    started = time.time()
+    if kind == 'digest':
+        objs = SavedSearchDigest.objects.filter(pk__in=pks)
+    else:
+        objs = SavedSearch.objects.filter(pk__in=pks)
+    objs = list(objs.select_related('user'))
+
+    if kind == 'digest':
+        saved_searches = dict(
+            (digest.pk, list(digest.user.savedsearch_set.filter(
+                is_active=True)))
+            for digest in objs)
+    else:
+        saved_searches = dict((search.pk, [search]) for search in objs)
+
+    feed_items = {}
+    report = {'searches': 0, 'queries': 0}
+    if getattr(settings, 'SAVED_SEARCH_PLAN_DIGESTS', False):
+        # Many users save the same search; retrieve the jobs for each
+        # distinct search once and share them between the emails.
+        feed_items, report = plan_feed_queries(
+            list(chain.from_iterable(saved_searches.values())))
+
+    send_rate = getattr(settings, 'SAVED_SEARCH_SEND_RATE', None)
+    failed = 0
+    with EmailBatch(getattr(settings, 'SAVED_SEARCH_EMAILS_PER_CONNECTION',
+                            1)):
+        for sent, obj in enumerate(objs):
+            items = dict((search.pk, feed_items[search.pk])
+                         for search in saved_searches[obj.pk]
+                         if search.pk in feed_items) or None
+            try:
+                obj.send_email(feed_items=items)
+            except Exception:
+                logger.exception("Couldn't send %s %s; retrying it on its "
+                                 "own.", kind, obj.pk)
+                failed += 1
+                send_search_digest.apply_async(
+                    (obj,), countdown=send_search_digest.default_retry_delay)
+            if send_rate:
+                ahead = started + (sent + 1) / float(send_rate) - time.time()
+                if ahead > 0:
+                    time.sleep(ahead)
+
+    timing = {
+        'kind': kind,
+        'emails': len(objs),
+        'failed': failed,
+        'queries': report['queries'],
+        'searches': report['searches'],
+        'seconds': time.time() - started,
+    }
+    logger.info("Sent saved search batch: %(emails)d %(kind)s emails "
+                "(%(failed)d failed, %(queries)d feed queries for "
+                "%(searches)d searches) in %(seconds).1fs", timing)
+    return timing
+
+
+@task(name='tasks.send_search_digests_report', ignore_result=True)
+def send_search_digests_report(timings, started):
+    """
+    Logs how long the batches sent by send_search_digests took. Called once
+    every batch has been sent.
+
+    Inputs:
+    :timings: The results of each send_search_batch
+    :started: Time the batches were queued at
+    """
+    seconds = [timing['seconds'] for timing in timings]
+    logger.info("Sent %d saved search emails (%d failed) in %d batches; "
+                "%.1fs after they were queued, slowest batch %.1fs, "
+                "%d feed queries for %d searches",
+                sum(timing['emails'] for timing in timings),
+                sum(timing['failed'] for timing in timings),
+                len(timings), time.time() - started, max(seconds or [0]),
+                sum(timing['queries'] for timing in timings),
+                sum(timing['searches'] for timing in timings))
+
+
 @task(name='tasks.send_search_digests', ignore_result=True)
 def send_search_digests():
     """
     Daily task to send saved searches. If user opted in for a digest, they
     receive it daily and do not get individual saved search emails. Otherwise,
     each active saved search is sent individually.
+
+    Only the ids of the digests and searches to be sent are looked up here;
+    they are sent in batches of settings.SAVED_SEARCH_BATCH_SIZE by
+    send_search_batch. With settings.SAVED_SEARCH_SEND_RATE, each batch is
+    delayed until the batches before it could have been sent at that rate.
     """
 
     def filter_by_time(qs):
@@ -165,26 +277,40 @@ def send_search_digests():
         today = datetime.today()
         day_of_week = today.isoweekday()
 
-        daily = qs.filter(frequency='D')
-        weekly = qs.filter(frequency='W', day_of_week=str(day_of_week))
-        monthly = qs.filter(frequency='M', day_of_month=today.day)
-        return chain(daily, weekly, monthly)
+        return qs.filter(Q(frequency='D') |
+                         Q(frequency='W', day_of_week=str(day_of_week)) |
+                         Q(frequency='M', day_of_month=today.day))
 
     digests = SavedSearchDigest.objects.filter(is_active=True,
                                                user__opt_in_myjobs=True,
                                                user__is_disabled=False)
-    digests = filter_by_time(digests)
-    for obj in digests:
-        send_search_digest.s(obj).apply_async()
-
-    not_digest = SavedSearchDigest.objects.filter(is_active=False,
-                                                  user__opt_in_myjobs=True,
-                                                  user__is_disabled=False)
-    for item in not_digest:
-        saved_searches = item.user.savedsearch_set.filter(is_active=True)
-        saved_searches = filter_by_time(saved_searches)
-        for search_obj in saved_searches:
-            send_search_digest.s(search_obj).apply_async()
+    digest_ids = filter_by_time(digests).order_by('pk').values_list(
+        'pk', flat=True)
+
+    searches = SavedSearch.objects.filter(
+        is_active=True, user__savedsearchdigest__is_active=False,
+        user__opt_in_myjobs=True, user__is_disabled=False)
+    # Ordering by feed puts identical searches in the same batch, where
+    # their jobs can be retrieved once.
+    search_ids = filter_by_time(searches).order_by('feed', 'pk').values_list(
+        'pk', flat=True)
+
+    batch_size = getattr(settings, 'SAVED_SEARCH_BATCH_SIZE', 500)
+    send_rate = getattr(settings, 'SAVED_SEARCH_SEND_RATE', None)
+    batches = []
+    queued = 0
+    for kind, ids in [('digest', list(digest_ids)),
+                      ('search', list(search_ids))]:
+        for start in range(0, len(ids), batch_size):
+            pks = ids[start:start + batch_size]
+            batch = send_search_batch.s(kind, pks)
+            if send_rate:
+                batch.set(countdown=queued / float(send_rate))
+            batches.append(batch)
+            queued += len(pks)
+
+    if batches:
+        chord(batches)(send_search_digests_report.s(time.time()))
 
 
 @task(name='task.delete_inactive_activations', ignore_result=True)
@@ -323,7 +449,7 @@ def update_solr_task(solr_location=None):
             obj_list = filter(None, list(obj_list))
             uid_list = " OR ".join(obj_list)
             for location in solr_location.values():
-                solr = pysolr.Solr(location)
+                solr = Solr(location)
                 solr.delete(q="uid:(%s)" % uid_list)
         Update.objects.filter(delete=True).delete()
 
@@ -347,7 +473,7 @@ def update_solr_task(solr_location=None):
 
     updates = split_list(updates, 1000)
     for location in solr_location.values():
-        solr = pysolr.Solr(location)
+        solr = Solr(location)
         for update_subset in updates:
             update_subset = filter(None, list(update_subset))
             solr.add(list(update_subset))
@@ -402,7 +528,7 @@ def task_reindex_solr(solr_location=None):
     l = split_list(l, 1000)
 
     for location in solr_location.values():
-        solr = pysolr.Solr(location)
+        solr = Solr(location)
         for x in l:
             x = filter(None, list(x))
             solr.add(x)
@@ -589,7 +715,7 @@ def parse_log(logs, solr_location):
         # down into something that solr can manage
         subsets = split_list(to_solr, 500)
         for location in solr_location.values():
-            solr = pysolr.Solr(location)
+            solr = Solr(location)
             for subset in subsets:
                 try:
                     subset = filter(None, subset)
@@ -611,7 +737,7 @@ def delete_old_analytics_docs():
     else:
         solr_location = settings.SOLR['current']
 
-    pysolr.Solr(solr_location).delete(
+    Solr(solr_location).delete(
         q="doc_type:analytics AND view_date:[* TO NOW/DAY-30DAYS]")
 
 
@@ -699,6 +825,34 @@ def task_update_solr(jsid, **kwargs):
         raise task_update_solr.retry()
 
 
+@task(name="tasks.task_tag_custom_facets", acks_late=True,
+      ignore_result=True)
+def task_tag_custom_facets(jsid, filepath=None, delete_feed=True,
+                           clear_cache=False):
+    """
+    Tags the jobs in a feed file imported by import_jobs.update_solr() with
+    the custom facets they match; see import_jobs.tag_custom_facets().
+
+    Without a `filepath`, the business unit's feed is downloaded again, to
+    retag the jobs already in the index (e.g. after a custom facet's query
+    changed) without re-importing them.
+
+    """
+    conn = Solr(settings.HAYSTACK_CONNECTIONS['default']['URL'])
+    try:
+        if filepath is None:
+            filepath = import_jobs.download_feed_file(jsid)
+        retagged = import_jobs.tag_custom_facets(conn, jsid, filepath)
+    except:
+        logging.error(traceback.format_exc(sys.exc_info()))
+        raise task_tag_custom_facets.retry()
+    if delete_feed:
+        os.remove(filepath)
+    if retagged and clear_cache:
+        # Allow for Solr replication, as import_jobs.update_solr() does.
+        task_clear_bu_cache.apply_async(args=[jsid], countdown=1500)
+
+
 @task(name='tasks.etl_to_solr', ignore_result=True, send_error_emails=True)
 def task_etl_to_solr(guid, buid, name):
     try:
@@ -747,6 +901,61 @@ def task_submit_all_sitemaps():
         task_submit_sitemap.delay(site.domain)
 
 
+@task(name="tasks.generate_sitemaps", ignore_result=True)
+def task_generate_sitemaps(buid):
+    """
+    Regenerates the stored sitemaps of every site showing the jobs of the
+    given business unit, including the sites that show every job.
+
+    A site whose sitemaps are already due to be regenerated isn't queued
+    again; the pending regeneration, which runs SITEMAP_SITE_DELAY seconds
+    after it was queued, covers this import too. This keeps the sites that
+    show every job from being regenerated after every import.
+
+    """
+    if not getattr(settings, 'SITEMAP_SHARD_DIR', None):
+        return
+    delay = getattr(settings, 'SITEMAP_SITE_DELAY', 300)
+    sites = SeoSite.objects.filter(Q(business_units=buid) |
+                                   Q(business_units__isnull=True))
+    for site_id in sites.values_list('pk', flat=True).distinct():
+        # The flag outlives the countdown, in case the worker is backed up,
+        # but expires eventually if the regeneration is lost.
+        if cache.add(sitemaps_pending_key(site_id), True,
+                     delay + settings.SITEMAP_SHARD_DELAY):
+            task_generate_site_sitemaps.apply_async(args=[site_id],
+                                                    countdown=delay)
+
+
+def sitemaps_pending_key(site_id):
+    return 'sitemaps_pending:%s' % site_id
+
+
+@task(name="tasks.generate_site_sitemaps", ignore_result=True)
+def task_generate_site_sitemaps(site_id):
+    # Imports finishing from here on need another regeneration, as this
+    # one may already have read their sites' jobs.
+    cache.delete(sitemaps_pending_key(site_id))
+    try:
+        site = SeoSite.objects.get(pk=site_id)
+    except SeoSite.DoesNotExist:
+        return
+    try:
+        write_site_sitemaps(site)
+    except Exception as e:
+        logging.error("Unable to generate sitemaps for %s", site.domain)
+        logging.exception(e)
+        raise task_generate_site_sitemaps.retry()
+
+
+@task(name="tasks.generate_all_sitemaps", ignore_result=True)
+def task_generate_all_sitemaps():
+    if not getattr(settings, 'SITEMAP_SHARD_DIR', None):
+        return
+    for site_id in SeoSite.objects.values_list('pk', flat=True):
+        task_generate_site_sitemaps.delay(site_id)
+
+
 def get_event_list(events):
     """
     Turns a block of json events into a list of events.
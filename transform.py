@@ -2,6 +2,7 @@ import datetime
 import logging
 
 from dateutil.parser import parse as date_parse
+from django.db import connections, router
 from django.utils.encoding import force_text
 from lxml import etree
 from seo.models import Company, Country, Redirect
@@ -193,7 +194,41 @@ def transform_for_postajob(job):
     return solr_job
 
 
-def hr_xml_to_json(xml, business_unit):
+class TransformContext(object):
+    """
+    Everything hr_xml_to_json() and make_redirects() look up in the
+    database for one business unit's jobs, loaded in bulk up front so that
+    transforming a feed doesn't run any queries per job.
+
+    inputs:
+        :business_unit: the business unit the jobs are coming from
+        :moc_index: an optional moc_coding.helpers.MocIndex; if None, MOC
+                    data is still queried per job
+
+    """
+    def __init__(self, business_unit, moc_index=None):
+        self.business_unit = business_unit
+        self.moc_index = moc_index
+        self.countries = dict(Country.objects.exclude(abbrev=None)
+                                             .values_list('abbrev', 'name'))
+        companies = list(business_unit.company_set.all()[:1])
+        self.company = companies[0] if companies else None
+        on_sites = set(business_unit.site_packages.values_list('pk',
+                                                               flat=True))
+        self.on_sites = filter(None, on_sites) or [0]
+        # {guid: url} for every redirect this business unit already has.
+        self.redirects = dict(Redirect.objects.filter(buid=business_unit.id)
+                                              .values_list('guid', 'url'))
+
+    def country_name(self, abbrev):
+        try:
+            return self.countries[abbrev]
+        except KeyError:
+            raise Country.DoesNotExist("No country with abbreviation %s" %
+                                       abbrev)
+
+
+def hr_xml_to_json(xml, business_unit, moc_index=None, context=None):
     """
     Cleans a job coming from an HR-XML document. This should add any
     required fields, and re-format any fields that are not coming in
@@ -207,6 +242,10 @@ def hr_xml_to_json(xml, business_unit):
         :business unit: the business unit the job is coming from
         :create_redirect: flags whether or not a redirect for the job link
                           should be added to the redirect table
+        :moc_index: an optional moc_coding.helpers.MocIndex used to look up
+                    MOC data without querying the database
+        :context: an optional TransformContext for business_unit; if given,
+                  no queries are made for the job
 
     outputs:
         A solr-ready job as a dictionary
@@ -219,6 +258,9 @@ def hr_xml_to_json(xml, business_unit):
             elem.tag = elem.tag[i + 1:]
     etree.cleanup_namespaces(xml)
 
+    if context is not None and moc_index is None:
+        moc_index = context.moc_index
+
     # Get some useful references
     app = xml.xpath('.//ApplicationArea')[0]
     data = xml.xpath('.//PositionOpening')[0]
@@ -235,6 +277,8 @@ def hr_xml_to_json(xml, business_unit):
     country_short = data.find('.//CountryCode').text
     if country_short in [None, '', 'XXX']:
         country = country_short = ""
+    elif context is not None:
+        country = context.country_name(country_short)
     else:
         country = Country.objects.get(abbrev=country_short).name
     title = data.find('.//PositionTitle').text
@@ -245,12 +289,19 @@ def hr_xml_to_json(xml, business_unit):
     longitude = data.find('.//SpatialLocation/Longitude').text
 
     # Lookup the company.  (Assumes that company is 1-to-1 on BusinessUnit)
-    try:
-        company = business_unit.company_set.all()[0]
-    except Company.DoesNotExist, Company.MultipleObjectsReturned:
-        logger.error("Unable to find Company for BusinessUnit %s",
-                     business_unit)
-        return None
+    if context is not None:
+        company = context.company
+        if company is None:
+            logger.error("Unable to find Company for BusinessUnit %s",
+                         business_unit)
+            return None
+    else:
+        try:
+            company = business_unit.company_set.all()[0]
+        except Company.DoesNotExist, Company.MultipleObjectsReturned:
+            logger.error("Unable to find Company for BusinessUnit %s",
+                         business_unit)
+            return None
 
     job = {'is_posted': False}
     # Use dateutil here because datetime.strptime does not support this format.
@@ -264,9 +315,13 @@ def hr_xml_to_json(xml, business_unit):
         raise
 
     # Determine what sites these jobs should be on
-    on_sites = set(business_unit.site_packages.values_list('pk', flat=True))
-    on_sites = filter(None, on_sites)
-    job['on_sites'] = on_sites or [0]
+    if context is not None:
+        job['on_sites'] = list(context.on_sites)
+    else:
+        on_sites = set(business_unit.site_packages.values_list('pk',
+                                                               flat=True))
+        on_sites = filter(None, on_sites)
+        job['on_sites'] = on_sites or [0]
 
 
     # This has to be seo.joblisting, otherwise the jobs won't be included
@@ -348,14 +403,21 @@ def hr_xml_to_json(xml, business_unit):
     job['onet'] = job['onet_exact'] = list(onets)
 
     # Standard Mocs
-    mocs = DEJobFeed.job_mocs({'onet_code': job['onet']})
+    if moc_index is not None:
+        mocs = moc_index.job_mocs(job['onet'])
+    else:
+        mocs = DEJobFeed.job_mocs({'onet_code': job['onet']})
     moc_tups = DEJobFeed.moc_data(mocs)
     job['moc'] = job['moc_exact'] = moc_tups.codes
     job['moc_slab'] = job['moc_slab_exact'] = moc_tups.slabs
     job['mocid'] = moc_tups.ids
 
     # Mapped Mocs
-    mapped_moc_tup = get_mapped_mocs(business_unit, onets)
+    if moc_index is not None:
+        mapped_moc_tup = DEJobFeed.moc_data(
+            moc_index.mapped_mocs(business_unit.id, onets))
+    else:
+        mapped_moc_tup = get_mapped_mocs(business_unit, onets)
     job['mapped_moc'] = job['mapped_moc_exact'] = mapped_moc_tup.codes
     job['mapped_moc_slab'] = job['mapped_moc_slab_exact'] = mapped_moc_tup.slabs
     job['mapped_mocid'] = mapped_moc_tup.ids
@@ -387,17 +449,103 @@ def _clean_time(time):
             return datetime.datetime.now()
 
 
+def redirect_guid(job):
+    """The Redirect primary key for a job dictionary."""
+    return '{%s}' % str(uuid.UUID(job['guid'])).upper()
+
+
+def _new_redirect(job, business_unit, guid):
+    location = "%s-%s" % (job['state_short'], job['city_slab_exact'])
+    return Redirect(guid=guid,
+                    buid=business_unit.id,
+                    uid=None,
+                    url=job['link'],
+                    new_date=job['date_new'],
+                    expired_date=None,
+                    job_location=location,
+                    job_title=job['title_exact'],
+                    company_name=job['company'])
+
+
+def make_redirects(jobs, context, batch_size=500):
+    """Given a list of job dictionaries, make or update their redirect
+    records with a query per batch_size new redirects and one per
+    batch_size redirects whose url changed.
+
+    Input:
+        :jobs: A list of dictionaries describing jobs.
+        :context: The TransformContext for the jobs' business unit.
+    :return: a list of redirects, in the same order as jobs"""
+    business_unit = context.business_unit
+    guids = [redirect_guid(job) for job in jobs]
+
+    # Jobs can move between business units, so look up any guid we don't
+    # already know about before deciding it is new.
+    existing = context.redirects
+    unknown = [guid for guid in set(guids) if guid not in existing]
+    for i in xrange(0, len(unknown), batch_size):
+        existing.update(Redirect.objects.filter(
+            guid__in=unknown[i:i + batch_size]).values_list('guid', 'url'))
+
+    redirects = []
+    new_redirects = {}
+    changed_urls = {}
+    for job, guid in zip(jobs, guids):
+        if guid in existing:
+            if existing[guid] != job['link']:
+                changed_urls[guid] = job['link']
+                existing[guid] = job['link']
+            redirects.append(Redirect(guid=guid, buid=business_unit.id,
+                                      url=job['link']))
+        else:
+            if guid not in new_redirects:
+                logger.debug("Creating new redirect for guid %s", guid)
+                new_redirects[guid] = _new_redirect(job, business_unit, guid)
+            redirects.append(new_redirects[guid])
+
+    _update_redirect_urls(changed_urls, batch_size=batch_size)
+    Redirect.objects.bulk_create(new_redirects.values(),
+                                 batch_size=batch_size)
+    existing.update((guid, redirect.url) for guid, redirect in
+                    new_redirects.items())
+    return redirects
+
+
+def _update_redirect_urls(urls, batch_size=500):
+    """Sets the url of existing redirect records with one UPDATE per
+    batch_size of them. The ORM can only set a field to the same value for
+    every row it updates, so this is a single UPDATE ... CASE statement.
+
+    Input:
+        :urls: A dictionary of {guid: new url}."""
+    db = router.db_for_write(Redirect)
+    connection = connections[db]
+    qn = connection.ops.quote_name
+    table = qn(Redirect._meta.db_table)
+    guid_column = qn(Redirect._meta.get_field('guid').column)
+    url_column = qn(Redirect._meta.get_field('url').column)
+    items = urls.items()
+    cursor = connection.cursor()
+    for i in xrange(0, len(items), batch_size):
+        batch = items[i:i + batch_size]
+        sql = "UPDATE %s SET %s = CASE %s %s END WHERE %s IN (%s)" % (
+            table, url_column, guid_column,
+            ' '.join(['WHEN %s THEN %s'] * len(batch)), guid_column,
+            ', '.join(['%s'] * len(batch)))
+        params = [value for item in batch for value in item]
+        params.extend(guid for guid, url in batch)
+        cursor.execute(sql, params)
+
+
 def make_redirect(job, business_unit):
     """Given a job dictionary, make a redirect record
 
     Input:
         :job: A dictionary describing a job.
     :return: a redirect"""
-    location = "%s-%s" % (job['state_short'], job['city_slab_exact'])
-
     # Get or create doesn't support not saving, and Redirects are not valid to
     # save until new_date is set.
-    guid = '{%s}' % str(uuid.UUID(job['guid'])).upper()
+    guid = redirect_guid(job)
     try:
         redirect = Redirect.objects.get(guid=guid)
         redirect.url = job['link']
@@ -405,14 +553,6 @@ def make_redirect(job, business_unit):
         return redirect
     except Redirect.DoesNotExist:
         logger.debug("Creating new redirect for guid %s", guid)
-        redirect = Redirect(guid=guid,
-                            buid=business_unit.id,
-                            uid=None,
-                            url=job['link'],
-                            new_date=job['date_new'],
-                            expired_date=None,
-                            job_location=location,
-                            job_title=job['title_exact'],
-                            company_name=job['company'])
+        redirect = _new_redirect(job, business_unit, guid)
         redirect.save()
         return redirect
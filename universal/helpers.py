@@ -1,5 +1,6 @@
 from copy import copy
 import re
+import threading
 import urllib
 from urlparse import parse_qsl, urlparse, urlunparse
 
@@ -7,7 +8,9 @@ from django.db.models.loading import get_model
 from django.conf import settings
 from django.shortcuts import get_object_or_404, Http404
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.core.mail import EmailMessage
+from django.core.mail import EmailMessage, get_connection
+
+from seo.site_context import site_settings
 
 
 def update_url_param(url, param, new_val):
@@ -90,10 +93,10 @@ def get_company(request):
     if not request.user or request.user.is_anonymous():
         return None
 
-    # If settings.SITE is set we're on a microsite, so get the company
+    # If site_settings.SITE is set we're on a microsite, so get the company
     # based on the microsite we're on instead.
-    if settings.SITE.canonical_company:
-        company = settings.SITE.canonical_company
+    if site_settings.SITE.canonical_company:
+        company = site_settings.SITE.canonical_company
 
         if company.companyuser_set.filter(user=request.user).exists():
             return company
@@ -211,6 +214,61 @@ def send_email(email_body, email_type=settings.GENERIC,
         email_kwargs['headers'] = headers
     message = EmailMessage(**email_kwargs)
     message.content_subtype = 'html'
-    message.send()
+    batch = EmailBatch.current()
+    if batch is not None:
+        batch.send(message)
+    else:
+        message.send()
 
     return message
+
+
+class EmailBatch(object):
+    """
+    Sends the emails send_email() sends on this thread while the batch is in
+    use over one mail connection, rather than opening a connection per
+    email. The connection is reopened after every :size: emails, and after
+    an email fails to send.
+
+        with EmailBatch(size=100):
+            for search in searches:
+                search.send_email()
+
+    """
+    _local = threading.local()
+
+    def __init__(self, size=100):
+        self.size = size
+        self.connection = None
+        self.sent = 0
+
+    @classmethod
+    def current(cls):
+        return getattr(cls._local, 'batch', None)
+
+    def send(self, message):
+        if self.connection is None:
+            self.connection = get_connection()
+            self.connection.open()
+        try:
+            self.connection.send_messages([message])
+        except Exception:
+            self.close()
+            raise
+        self.sent += 1
+        if self.sent % self.size == 0:
+            self.close()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def __enter__(self):
+        self.previous = self.current()
+        self._local.batch = self
+        return self
+
+    def __exit__(self, *exc_info):
+        self._local.batch = self.previous
+        self.close()
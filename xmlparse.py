@@ -47,20 +47,36 @@ class JobFeed(object):
     datetime_pattern -- A string specifying the format of the datetime
     data in the feed. Should conform to the specification outlined here:
     http://docs.python.org/library/time.html#time.strftime
+    stream -- Boolean. If True, the feed file is never held in memory as a
+    whole. It is validated with a single `iterparse` pass that discards
+    each job node once it has been seen, and `iter_solr_jobs` re-reads the
+    file the same way, so memory use does not grow with the feed size.
+    moc_index -- A moc_coding.helpers.MocIndex. If given, MOC data for each
+    job is looked up in the index instead of being queried per job.
     """
     def __init__(self, filepath, js_field=None, crawl_field=None, node_tag=None,
                  datetime_pattern=None, jsid=None, schema=None, markdown=True,
-                 company=None):
+                 company=None, stream=False, moc_index=None):
         if None in (js_field, crawl_field, datetime_pattern):
             raise AttributeError("You must specify valid values for js_field, "
                                  "datetime_pattern and crawl_field.")
         self.filepath = filepath
         self.bu_mapped_mocs = None
-        self.parser = etree.XMLParser(recover=False, schema=schema)
-        self.doc = etree.parse(self.filepath, self.parser)
+        self.stream = stream
+        self.moc_index = moc_index
+        self.node_tag = node_tag
+        self.uids = []
+        if self.stream:
+            self.parser = etree.iterparse(self.filepath, events=('end', ),
+                                          schema=schema)
+            # Only the document-level tags (e.g. <meta>) survive the scan,
+            # which is all that parse_doc() needs.
+            self.doc = self.scan_jobs(self.parser)
+        else:
+            self.parser = etree.XMLParser(recover=False, schema=schema)
+            self.doc = etree.parse(self.filepath, self.parser)
         self.datetime_pattern = datetime_pattern
         self.jsid = jsid
-        self.node_tag = node_tag
         self.job_source_name = self.unescape(self.parse_doc(js_field))
         self.crawled_date = get_strptime(self.parse_doc(crawl_field),
                                          self.datetime_pattern)
@@ -96,8 +112,54 @@ class JobFeed(object):
         This method must return a list of dictionaries from solr_job_dict.
 
         """
-        return [self.solr_job_dict(node) for node in
-                self.doc.find(self.node_tag).iterchildren()]
+        return list(self.iter_solr_jobs())
+
+    def iter_solr_jobs(self):
+        """
+        Yields the dictionaries from solr_job_dict one job at a time. In
+        streaming mode the feed file is re-read and each job node is
+        discarded as soon as its dictionary has been built.
+
+        """
+        if self.stream:
+            nodes = self.iter_job_nodes(etree.iterparse(self.filepath,
+                                                        events=('end', )))
+        else:
+            nodes = self.doc.find(self.node_tag).iterchildren()
+        for node in nodes:
+            yield self.solr_job_dict(node)
+
+    def iter_job_nodes(self, context):
+        """
+        Yields each job node from an `iterparse` context, clearing the node
+        (and any siblings already processed) once the consumer is done with
+        it so the partially built tree never holds more than one job.
+
+        """
+        for event, elem in context:
+            parent = elem.getparent()
+            if parent is None or parent.tag != self.node_tag:
+                continue
+            yield elem
+            elem.clear()
+            while elem.getprevious() is not None:
+                del parent[0]
+
+    def scan_jobs(self, context):
+        """
+        Runs a full `iterparse` pass over the feed (which is where schema
+        validation happens in streaming mode), recording the uid of each
+        job in `self.uids`.
+
+        Returns the root element, which by then contains only the
+        document-level tags.
+
+        """
+        for node in self.iter_job_nodes(context):
+            uid = node.find('uid')
+            if uid is not None:
+                self.uids.append(uid.text)
+        return context.root
 
     @staticmethod
     def moc_data(mocs):
@@ -343,9 +405,14 @@ class DEJobFeed(JobFeed):
         city_slab = self.city_slab(job_node)
         state_slab = self.state_slab(job_node)
         title_slab = self.title_slab(job_node)
-        mocs = self.job_mocs(job_node)
+        if self.moc_index is not None:
+            mocs = self.moc_index.job_mocs(job_node['onet_code'])
+            mapped_moc_tups = self.moc_data(
+                self.moc_index.mapped_mocs(self.jsid, job_node['onet_code']))
+        else:
+            mocs = self.job_mocs(job_node)
+            mapped_moc_tups = self.mapped_mocs(mocs, job_node)
         moc_tups = self.moc_data(mocs)
-        mapped_moc_tups = self.mapped_mocs(mocs, job_node)
         
         job_dict['job_source_name'] = self.job_source_name
         job_dict['buid'] = self.jsid 
@@ -483,6 +550,9 @@ class DEv2JobFeed(DEJobFeed):
             self.error_messages = []
 
     def jobparse(self):
+        if self.stream:
+            return [{'uid': self.unescape(uid)} for uid in self.uids]
+
         joblist = []
         jobs = self.doc.find(self.node_tag).iterchildren()
 